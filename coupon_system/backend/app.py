@@ -1,365 +1,150 @@
-from flask import Flask, request, jsonify
+from flask import Flask
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
-import json
-import os
-from dotenv import load_dotenv
+from flask_jwt_extended import JWTManager
 
-from models import db, User, Product, Coupon, CouponRedemption, CouponUsageLog
-from models import ThemeType, ProductCategory, CouponType
+from config import configure
+from models import db, Coupon
+from read_models import load_coupons
 from coupon_service import CouponService
-
-load_dotenv()
-
-app = Flask(__name__)
-
-# Configuration
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///coupon_system.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-string')
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
-
-# Initialize extensions
-db.init_app(app)
-jwt = JWTManager(app)
-CORS(app)
-
-# Initialize coupon service
-coupon_service = CouponService()
-
-# Create tables
-with app.app_context():
-    db.create_all()
-
-# Helper functions
-def log_coupon_usage(coupon_code, user_id, action, success, error_message=None):
-    """Log coupon usage for analytics and debugging"""
-    log_entry = CouponUsageLog(
-        coupon_code=coupon_code,
-        user_id=user_id,
-        action=action,
-        success=success,
-        error_message=error_message,
-        ip_address=request.remote_addr,
-        user_agent=request.headers.get('User-Agent')
-    )
-    db.session.add(log_entry)
-    db.session.commit()
-
-def serialize_coupon(coupon):
-    """Serialize coupon object to JSON"""
-    return {
-        'id': coupon.id,
-        'code': coupon.code,
-        'name': coupon.name,
-        'description': coupon.description,
-        'coupon_type': coupon.coupon_type.value,
-        'discount_value': coupon.discount_value,
-        'min_purchase_amount': coupon.min_purchase_amount,
-        'max_discount_amount': coupon.max_discount_amount,
-        'valid_from': coupon.valid_from.isoformat() if coupon.valid_from else None,
-        'valid_until': coupon.valid_until.isoformat() if coupon.valid_until else None,
-        'usage_limit': coupon.usage_limit,
-        'usage_limit_per_user': coupon.usage_limit_per_user,
-        'applicable_themes': json.loads(coupon.applicable_themes) if coupon.applicable_themes else [],
-        'applicable_categories': json.loads(coupon.applicable_categories) if coupon.applicable_categories else [],
-        'applicable_product_ids': json.loads(coupon.applicable_product_ids) if coupon.applicable_product_ids else [],
-        'is_active': coupon.is_active,
-        'is_valid': coupon.is_valid,
-        'usage_count': coupon.get_usage_count(),
-        'created_at': coupon.created_at.isoformat()
-    }
-
-def serialize_product(product):
-    """Serialize product object to JSON"""
-    return {
-        'id': product.id,
-        'name': product.name,
-        'description': product.description,
-        'category': product.category.value,
-        'theme': product.theme.value,
-        'price': product.price,
-        'image_url': product.image_url,
-        'stock_quantity': product.stock_quantity,
-        'is_active': product.is_active,
-        'created_at': product.created_at.isoformat()
-    }
-
-# Authentication Routes
-@app.route('/api/auth/register', methods=['POST'])
-def register():
-    """Register a new user"""
-    try:
-        data = request.get_json()
-        
-        # Validate input
-        if not data.get('username') or not data.get('email') or not data.get('password'):
-            return jsonify({'error': 'Username, email, and password are required'}), 400
-        
-        # Check if user exists
-        if User.query.filter_by(username=data['username']).first():
-            return jsonify({'error': 'Username already exists'}), 400
-        
-        if User.query.filter_by(email=data['email']).first():
-            return jsonify({'error': 'Email already exists'}), 400
-        
-        # Create user
-        user = User(
-            username=data['username'],
-            email=data['email'],
-            password_hash=generate_password_hash(data['password'])
-        )
-        
-        db.session.add(user)
-        db.session.commit()
-        
-        # Generate access token
-        access_token = create_access_token(identity=user.id)
-        
-        return jsonify({
-            'message': 'User registered successfully',
-            'access_token': access_token,
-            'user': {
-                'id': user.id,
-                'username': user.username,
-                'email': user.email
-            }
-        }), 201
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/api/auth/login', methods=['POST'])
-def login():
-    """Login user"""
-    try:
-        data = request.get_json()
-        
-        if not data.get('username') or not data.get('password'):
-            return jsonify({'error': 'Username and password are required'}), 400
-        
-        user = User.query.filter_by(username=data['username']).first()
-        
-        if user and check_password_hash(user.password_hash, data['password']):
-            access_token = create_access_token(identity=user.id)
-            return jsonify({
-                'message': 'Login successful',
-                'access_token': access_token,
-                'user': {
-                    'id': user.id,
-                    'username': user.username,
-                    'email': user.email
-                }
-            }), 200
-        
-        return jsonify({'error': 'Invalid credentials'}), 401
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-# Product Routes
-@app.route('/api/products', methods=['GET'])
-def get_products():
-    """Get all products with optional filtering"""
-    try:
-        theme = request.args.get('theme')
-        category = request.args.get('category')
-        
-        query = Product.query.filter_by(is_active=True)
-        
-        if theme:
-            try:
-                theme_enum = ThemeType(theme.upper())
-                query = query.filter_by(theme=theme_enum)
-            except ValueError:
-                return jsonify({'error': 'Invalid theme'}), 400
-        
-        if category:
-            try:
-                category_enum = ProductCategory(category.upper())
-                query = query.filter_by(category=category_enum)
-            except ValueError:
-                return jsonify({'error': 'Invalid category'}), 400
-        
-        products = query.all()
-        return jsonify({
-            'products': [serialize_product(p) for p in products]
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/api/products/<int:product_id>', methods=['GET'])
-def get_product(product_id):
-    """Get a specific product"""
-    try:
-        product = Product.query.get_or_404(product_id)
-        return jsonify({'product': serialize_product(product)}), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-# Coupon Routes
-@app.route('/api/coupons/validate', methods=['POST'])
-def validate_coupon():
-    """Validate a coupon code"""
-    try:
-        data = request.get_json()
-        coupon_code = data.get('code', '').strip().upper()
-        user_id = data.get('user_id')
-        cart_items = data.get('cart_items', [])  # List of {product_id, quantity, price}
-        
-        if not coupon_code:
-            return jsonify({'error': 'Coupon code is required'}), 400
-        
-        result = coupon_service.validate_coupon(coupon_code, user_id, cart_items)
-        
-        # Log the validation attempt
-        log_coupon_usage(coupon_code, user_id, 'validate', result['valid'], 
-                        result.get('message') if not result['valid'] else None)
-        
-        return jsonify(result), 200 if result['valid'] else 400
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/api/coupons/apply', methods=['POST'])
-@jwt_required()
-def apply_coupon():
-    """Apply a coupon to an order"""
-    try:
-        user_id = get_jwt_identity()
-        data = request.get_json()
-        
-        coupon_code = data.get('code', '').strip().upper()
-        order_id = data.get('order_id')
-        cart_items = data.get('cart_items', [])
-        original_amount = data.get('original_amount')
-        
-        if not all([coupon_code, order_id, cart_items, original_amount]):
-            return jsonify({'error': 'Missing required fields'}), 400
-        
-        result = coupon_service.apply_coupon(coupon_code, user_id, order_id, cart_items, original_amount)
-        
-        # Log the application attempt
-        log_coupon_usage(coupon_code, user_id, 'apply', result.get('success', False),
-                        result.get('message') if not result.get('success') else None)
-        
-        if result.get('success'):
-            return jsonify(result), 200
-        else:
-            return jsonify(result), 400
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/api/coupons', methods=['GET'])
-def get_available_coupons():
-    """Get all available coupons"""
-    try:
-        theme = request.args.get('theme')
-        category = request.args.get('category')
-        
-        query = Coupon.query.filter_by(is_active=True)
-        
-        # Filter by current date
-        now = datetime.utcnow()
-        query = query.filter(Coupon.valid_from <= now)
-        query = query.filter((Coupon.valid_until.is_(None)) | (Coupon.valid_until > now))
-        
-        coupons = query.all()
-        
-        # Filter by theme or category if specified
-        filtered_coupons = []
-        for coupon in coupons:
-            if theme or category:
-                applicable_themes = json.loads(coupon.applicable_themes) if coupon.applicable_themes else []
-                applicable_categories = json.loads(coupon.applicable_categories) if coupon.applicable_categories else []
-                
-                if theme and theme.upper() not in applicable_themes:
-                    continue
-                if category and category.upper() not in applicable_categories:
-                    continue
-            
-            filtered_coupons.append(coupon)
-        
-        return jsonify({
-            'coupons': [serialize_coupon(c) for c in filtered_coupons]
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/api/coupons/user-history', methods=['GET'])
-@jwt_required()
-def get_user_coupon_history():
-    """Get user's coupon usage history"""
-    try:
-        user_id = get_jwt_identity()
-        
-        redemptions = CouponRedemption.query.filter_by(user_id=user_id).order_by(CouponRedemption.created_at.desc()).all()
-        
-        history = []
-        for redemption in redemptions:
-            history.append({
-                'id': redemption.id,
-                'coupon_code': redemption.coupon.code,
-                'coupon_name': redemption.coupon.name,
-                'order_id': redemption.order_id,
-                'discount_applied': redemption.discount_applied,
-                'original_amount': redemption.original_amount,
-                'final_amount': redemption.final_amount,
-                'is_used': redemption.is_used,
-                'used_at': redemption.used_at.isoformat() if redemption.used_at else None,
-                'created_at': redemption.created_at.isoformat()
-            })
-        
-        return jsonify({'history': history}), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-# Analytics Routes (for admin)
-@app.route('/api/analytics/coupons', methods=['GET'])
-def get_coupon_analytics():
-    """Get coupon usage analytics"""
-    try:
-        # Get usage statistics
-        total_coupons = Coupon.query.count()
-        active_coupons = Coupon.query.filter_by(is_active=True).count()
-        total_redemptions = CouponRedemption.query.filter_by(is_used=True).count()
-        
-        # Most used coupons
-        most_used_query = db.session.query(
-            Coupon.code,
-            Coupon.name,
-            db.func.count(CouponRedemption.id).label('usage_count')
-        ).join(CouponRedemption).filter(CouponRedemption.is_used == True).group_by(Coupon.id).order_by(db.func.count(CouponRedemption.id).desc()).limit(10)
-        
-        most_used = [{'code': row.code, 'name': row.name, 'usage_count': row.usage_count} 
-                    for row in most_used_query.all()]
-        
-        return jsonify({
-            'total_coupons': total_coupons,
-            'active_coupons': active_coupons,
-            'total_redemptions': total_redemptions,
-            'most_used_coupons': most_used
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-# Health check
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat(),
-        'version': '1.0.0'
-    }), 200
+from inventory_service import InventoryService
+from catalogue import catalogue
+from product_search import product_search
+from serialization_cache import serialization_cache
+from usage_counters import usage_counters
+from validity_schedule import validity_schedule
+from user_eligibility import user_eligibility
+from validation_memo import validation_memo
+from flash_sale import flash_sale
+from usage_stripes import usage_stripes
+from redemption_feed import redemption_feed
+from redemption_archive import redemption_archive
+from bulk_apply import BulkApplier
+from batch_requests import batch_dispatcher
+from cache_sync import cache_sync
+from tenancy import tenancy
+from shared_store import SharedStore
+from password_hasher import PasswordHasher
+from rate_limiter import RateLimiter
+from code_filter import coupon_code_filter
+from routes import api
+
+def create_app(config=None):
+    """
+    Build the Flask app
+
+    Only reads configuration and registers extensions and routes; nothing
+    here touches the database. Schema changes are applied with
+    ``python migrations.py upgrade`` and caches fill on first use, or up
+    front when ``WARM_CACHES`` is set.
+
+    Args:
+        config (dict, optional): Settings applied over the environment
+
+    Returns:
+        Flask: The configured application
+    """
+    app = Flask(__name__)
+
+    # Configuration
+    configure(app)
+    if config:
+        app.config.update(config)
+
+    # Initialize extensions; tenant binds must be known before the engines are created
+    tenancy.init_app(app)
+    db.init_app(app)
+    JWTManager(app)
+    CORS(app)
+    PasswordHasher(app)
+    RateLimiter(app)
+    coupon_code_filter.init_app(app)
+
+    # Initialize coupon service
+    shared_store = SharedStore(app)
+    catalogue.init_app(app)
+    product_search.init_app(app)
+    usage_counters.init_app(app)
+    serialization_cache.init_app(app)
+    validity_schedule.init_app(app)
+    user_eligibility.init_app(app)
+    validation_memo.init_app(app)
+    flash_sale.init_app(app)
+    usage_stripes.init_app(app)
+    redemption_feed.init_app(app)
+    redemption_archive.init_app(app)
+    batch_dispatcher.init_app(app)
+    coupon_service = CouponService(catalogue, validity_schedule, shared_store, validation_memo, usage_stripes)
+    app.extensions['coupon_service'] = coupon_service
+    app.extensions['bulk_applier'] = BulkApplier(coupon_service, usage_stripes, app.config['BULK_APPLY_CHUNK_SIZE'])
+    InventoryService().init_app(app)
+    cache_sync.init_app(app)
+
+    app.register_blueprint(api)
+
+    if app.config.get('WARM_CACHES'):
+        warm_caches(app)
+    return app
+
+def warm_caches(app):
+    """Fill the in-process caches before the worker accepts traffic"""
+    with app.app_context():
+        tenancy.each(_warm_tenant_caches)
+        product_search.index()
+        db.session.remove()
+        # Workers forked from a preloading master must open their own connections
+        for engine in db.engines.values():
+            engine.dispose()
+
+def _warm_tenant_caches():
+    # Take the change-log cursor first; its initial reset would drop anything loaded before it
+    cache_sync.maybe_poll()
+    snapshot = catalogue.snapshot()
+    for product in snapshot.filter(active_only=False):
+        serialization_cache.product_fragment(product, snapshot.version)
+    live_ids = validity_schedule.valid_ids()
+    if live_ids:
+        for coupon in load_coupons(live_ids):
+            serialization_cache.coupon_fragment(coupon)
+    usage_counters.reload()
+    flash_sale.preload()
+    if coupon_code_filter.enabled:
+        coupon_code_filter.rebuild()
+
+# Apply changes made by other workers to this worker's caches
+def drop_remote_coupon_changes(coupon_ids):
+    """Forget cached state for coupons another worker changed (None means all)"""
+    if coupon_ids is None:
+        serialization_cache.invalidate('coupon')
+        coupon_code_filter.invalidate()
+    else:
+        for coupon_id in coupon_ids:
+            serialization_cache.invalidate('coupon', coupon_id)
+        for (code,) in db.session.query(Coupon.code).filter(Coupon.id.in_(coupon_ids)):
+            coupon_code_filter.add(code)
+    validity_schedule.invalidate()
+    validation_memo.invalidate(coupon_ids)
+    flash_sale.invalidate(coupon_ids)
+
+def drop_remote_product_changes(product_ids):
+    """Forget cached state that depends on products another worker changed"""
+    catalogue.invalidate()
+    # Products are shared, so every tenant's memoized results may depend on them
+    for memo in validation_memo.all_instances():
+        memo.invalidate()
+
+# Handlers run for whichever tenant's log is being read, so the per-tenant caches are looked up per call
+cache_sync.subscribe('coupon', drop_remote_coupon_changes)
+cache_sync.subscribe('product', drop_remote_product_changes)
+cache_sync.subscribe('redemption', lambda coupon_ids: usage_counters.refresh(coupon_ids))
+cache_sync.subscribe('redemption', lambda coupon_ids: validation_memo.invalidate(coupon_ids))
+cache_sync.subscribe('redemption', lambda coupon_ids: flash_sale.invalidate(coupon_ids))
+cache_sync.subscribe('user_redemption', lambda user_ids: user_eligibility.invalidate_users(user_ids))
 
 if __name__ == '__main__':
+    from migrations import upgrade
+
+    app = create_app()
+    # Development server: bring the schema up to date before serving
+    with app.app_context():
+        upgrade()
     app.run(debug=True, host='0.0.0.0', port=5000)
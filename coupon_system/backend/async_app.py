@@ -0,0 +1,86 @@
+"""
+Async serving mode for the coupon API
+
+Serves the API from an ASGI server, so requests waiting for the database
+hold a coroutine rather than a thread. Every ``/api`` request is answered by
+the sync app's own route (see ``forward``), run on a worker thread once it
+gets one of the ``ASYNC_DB_CONCURRENCY`` database slots. Business rules,
+rate limits, usage limits, tenant databases and caches are therefore the
+same in both modes, and there is no second copy of them to keep in step.
+Requests that wait longer than ``ASYNC_DB_ACQUIRE_TIMEOUT`` get 503.
+
+Run with, for example:
+    hypercorn async_app:app --workers 4 --bind 0.0.0.0:5000
+"""
+
+from datetime import datetime
+from quart import Quart, Response, request, jsonify
+from werkzeug.test import EnvironBuilder
+
+from config import configure
+from app import create_app
+from async_db import AsyncDatabase, DatabaseBusy
+
+app = Quart(__name__)
+
+# Methods forwarded to the sync app; it answers CORS preflights too
+METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS']
+
+# Configuration
+configure(app)
+
+# Initialize extensions
+async_db = AsyncDatabase(app)
+
+# The sync app, whose routes answer every forwarded request
+flask_app = create_app()
+
+# Helper functions
+def call_flask(environ):
+    """Run a request through the sync app; returns (body, status, headers)"""
+    response = flask_app.response_class.from_app(flask_app, environ, buffered=True)
+    return response.get_data(), response.status_code, list(response.headers)
+
+async def forward():
+    """Answer the current request with the sync app's route, on a worker thread holding a database slot"""
+    builder = EnvironBuilder(
+        path=request.path, query_string=request.query_string.decode('latin-1'), method=request.method,
+        base_url=request.host_url, headers=list(request.headers.items()), data=await request.get_data(),
+        environ_base={'REMOTE_ADDR': request.remote_addr}
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    body, status, headers = await async_db.run(call_flask, environ)
+    return Response(body, status, headers)
+
+@app.errorhandler(DatabaseBusy)
+async def database_busy(error):
+    response = jsonify({'error': 'Server is busy, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.after_serving
+async def shutdown():
+    await async_db.dispose()
+
+# API Routes
+@app.route('/api/<path:path>', methods=METHODS)
+async def api(path):
+    """Serve any API route through the sync app"""
+    return await forward()
+
+# Health check
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    """Health check endpoint"""
+    return jsonify({
+        'status': 'healthy',
+        'mode': 'async',
+        'timestamp': datetime.utcnow().isoformat(),
+        'version': '1.0.0'
+    }), 200
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
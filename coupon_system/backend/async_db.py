@@ -0,0 +1,55 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import functools
+
+class DatabaseBusy(Exception):
+    """Raised when no database slot frees up within the wait timeout"""
+
+class AsyncDatabase:
+    """Bounded database access for the async serving mode
+
+    Database work runs behind an ``asyncio.Semaphore`` so the number of
+    requests talking to the database at once is fixed by
+    ``ASYNC_DB_CONCURRENCY``; other requests wait on the event loop without
+    holding a thread or a connection. Each admitted call runs on one of as
+    many worker threads, through the sync app's own engines and sessions.
+    """
+
+    def __init__(self, app=None):
+        self.concurrency = 32
+        self.acquire_timeout = 5.0
+        self._semaphore = None
+        self._executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.concurrency = app.config.get('ASYNC_DB_CONCURRENCY', self.concurrency)
+        self.acquire_timeout = app.config.get('ASYNC_DB_ACQUIRE_TIMEOUT', self.acquire_timeout)
+        app.extensions['async_db'] = self
+
+    async def run(self, func, *args):
+        """Call sync ``func(*args)`` on a worker thread while holding one of the concurrency slots"""
+        async with self._slot():
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='async-db')
+            return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args))
+
+    @asynccontextmanager
+    async def _slot(self):
+        if self._semaphore is None:
+            # Created lazily so it binds to the serving event loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise DatabaseBusy('Timed out waiting for a database slot')
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    async def dispose(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
@@ -0,0 +1,183 @@
+"""
+Vectorized coupon quotes over large batches of carts
+
+Answers "what would this coupon have cost on these carts?" for millions of
+cart lines at once. Cart lines come in as parallel columns (cart id,
+product id, price, quantity) and every rule from
+``CouponService.validate_coupon`` / ``_calculate_discount`` is applied with
+NumPy array operations, giving the same per-cart discounts as the scalar path
+for carts where the coupon itself is valid and the user still has uses left.
+
+Usage:
+    python batch_quote.py BTS20OFF carts.csv
+
+where carts.csv has a header row and the columns cart_id,product_id,price,quantity.
+"""
+
+import json
+import sys
+import numpy as np
+
+from models import db, Product, Coupon, CouponType
+from coupon_service import CouponService
+
+class CompiledCoupon:
+    """A coupon's rules flattened into arrays aligned with the catalogue
+
+    ``eligible`` marks, for each catalogue product, whether the coupon's
+    theme/category/product-id restrictions match it, so applying the
+    restrictions to a batch becomes a single gather.
+    """
+
+    def __init__(self, coupon, catalogue_ids, catalogue_themes, catalogue_categories):
+        self.code = coupon.code
+        self.coupon_type = coupon.coupon_type
+        self.discount_value = coupon.discount_value
+        self.min_purchase_amount = coupon.min_purchase_amount
+        self.max_discount_amount = coupon.max_discount_amount
+
+        applicable_themes = json.loads(coupon.applicable_themes) if coupon.applicable_themes else []
+        applicable_categories = json.loads(coupon.applicable_categories) if coupon.applicable_categories else []
+        applicable_product_ids = json.loads(coupon.applicable_product_ids) if coupon.applicable_product_ids else []
+        self.restricted = any([applicable_themes, applicable_categories, applicable_product_ids])
+
+        order = np.argsort(catalogue_ids, kind='stable')
+        self.product_ids = np.asarray(catalogue_ids, dtype=np.int64)[order]
+        themes = np.asarray(catalogue_themes, dtype=object)[order]
+        categories = np.asarray(catalogue_categories, dtype=object)[order]
+
+        if self.restricted:
+            eligible = np.zeros(len(self.product_ids), dtype=bool)
+            if applicable_product_ids:
+                eligible |= np.isin(self.product_ids, np.asarray(applicable_product_ids, dtype=np.int64))
+            if applicable_themes:
+                eligible |= np.isin(themes, applicable_themes)
+            if applicable_categories:
+                eligible |= np.isin(categories, applicable_categories)
+        else:
+            eligible = np.ones(len(self.product_ids), dtype=bool)
+        self.eligible = eligible
+
+    @classmethod
+    def from_database(cls, coupon):
+        """Compile a coupon against the current product catalogue"""
+        rows = db.session.query(Product.id, Product.theme, Product.category).all()
+        return cls(
+            coupon,
+            [row.id for row in rows],
+            [row.theme.value for row in rows],
+            [row.category.value for row in rows]
+        )
+
+    def lookup(self, product_ids):
+        """Return (exists, eligible) masks for an array of product ids"""
+        if len(self.product_ids) == 0:
+            missing = np.zeros(len(product_ids), dtype=bool)
+            return missing, missing
+        positions = np.searchsorted(self.product_ids, product_ids)
+        positions = np.minimum(positions, len(self.product_ids) - 1)
+        exists = self.product_ids[positions] == product_ids
+        return exists, exists & self.eligible[positions]
+
+def quote_carts(compiled, cart_ids, product_ids, prices, quantities):
+    """
+    Price one coupon against a batch of carts
+
+    Args:
+        compiled (CompiledCoupon): Coupon compiled against the catalogue
+        cart_ids (array): Cart identifier for each line
+        product_ids (array): Product id for each line (0 for lines without one)
+        prices (array): Unit price for each line
+        quantities (array): Quantity for each line
+
+    Returns:
+        dict: 'cart_ids' (unique carts, sorted), 'discounts' and 'cart_totals'
+            per cart, and 'applicable' marking carts the coupon accepts
+    """
+    cart_ids = np.asarray(cart_ids)
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+    quantities = np.asarray(quantities, dtype=np.int64)
+
+    # bincount walks the lines in input order, so each cart's float sum
+    # accumulates in the same order as the scalar loop
+    unique_carts, inverse = np.unique(cart_ids, return_inverse=True)
+    num_carts = len(unique_carts)
+    cart_totals = np.bincount(inverse, weights=prices * quantities, minlength=num_carts)
+
+    applicable = np.ones(num_carts, dtype=bool)
+    if compiled.min_purchase_amount:
+        applicable &= cart_totals >= compiled.min_purchase_amount
+
+    _, line_eligible = compiled.lookup(product_ids)
+    line_eligible &= product_ids != 0
+    if compiled.restricted:
+        eligible_lines = np.bincount(inverse, weights=line_eligible, minlength=num_carts)
+        applicable &= eligible_lines > 0
+
+    coupon_type = compiled.coupon_type
+    if coupon_type == CouponType.PERCENTAGE:
+        raw = cart_totals * (compiled.discount_value / 100)
+        if compiled.max_discount_amount:
+            raw = np.minimum(raw, compiled.max_discount_amount)
+    elif coupon_type == CouponType.FIXED_AMOUNT:
+        raw = np.minimum(compiled.discount_value, cart_totals)
+    elif coupon_type == CouponType.FREE_SHIPPING:
+        raw = np.full(num_carts, CouponService.FREE_SHIPPING_COST)
+    elif coupon_type == CouponType.BUY_ONE_GET_ONE:
+        # line_eligible already excludes lines whose product does not exist
+        free_value = np.where(line_eligible, (quantities // 2) * prices, 0.0)
+        raw = np.bincount(inverse, weights=free_value, minlength=num_carts)
+    else:
+        raw = np.zeros(num_carts)
+
+    discounts = np.where(applicable, _round_cents(raw), 0.0)
+    return {
+        'cart_ids': unique_carts,
+        'discounts': discounts,
+        'cart_totals': cart_totals,
+        'applicable': applicable,
+    }
+
+def _round_cents(values):
+    # Python's round() is correctly rounded where np.round(x, 2) is not, and
+    # the scalar path uses round(); one pass per cart keeps results identical
+    return np.fromiter((round(v, 2) for v in values.tolist()), dtype=np.float64, count=len(values))
+
+def load_cart_lines(path):
+    """Read cart_id,product_id,price,quantity columns from a CSV file"""
+    data = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+    return (
+        data[:, 0].astype(np.int64),
+        data[:, 1].astype(np.int64),
+        data[:, 2],
+        data[:, 3].astype(np.int64)
+    )
+
+def main(argv):
+    if len(argv) != 3:
+        print('Usage: python batch_quote.py COUPON_CODE carts.csv')
+        return 1
+
+    from app import create_app
+
+    app = create_app()
+
+    coupon_code, path = argv[1].strip().upper(), argv[2]
+    with app.app_context():
+        coupon = Coupon.query.filter_by(code=coupon_code).first()
+        if not coupon:
+            print(f'Coupon {coupon_code} not found')
+            return 1
+        compiled = CompiledCoupon.from_database(coupon)
+
+    result = quote_carts(compiled, *load_cart_lines(path))
+    applicable = result['applicable']
+    print(f'Carts quoted: {len(result["cart_ids"])}')
+    print(f'Carts eligible: {int(applicable.sum())}')
+    print(f'Total discount: {result["discounts"].sum():.2f}')
+    print(f'Eligible cart value: {result["cart_totals"][applicable].sum():.2f}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,182 @@
+"""
+Batched API calls
+
+``POST /api/batch`` takes a list of sub-requests to other ``/api`` routes and
+answers them all in one response, so a page that needs products, coupons and
+a validation pays one network round trip instead of several. Each
+sub-request is dispatched through the normal Flask machinery (the same view,
+auth checks, rate limits and error handlers as a direct call) inside the
+batch's app context, so they share its database session and the
+in-process caches. For the same reason every sub-request works for the
+batch's tenant: its tenant header is replaced by the batch request's.
+
+Sub-requests run in the order given. A run of consecutive GET requests is
+read-only and order-independent, so it is spread over up to
+``BATCH_MAX_WORKERS`` threads; each of those gets its own app context and
+session, as sessions are not shared across threads. Any other method waits
+for the requests before it and runs on the batch's own session.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+from flask import current_app, request
+from werkzeug.test import EnvironBuilder
+
+from models import db
+from tenancy import tenancy
+
+BATCH_PATH = '/api/batch'
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+# Headers a sub-request inherits from the batch request unless it sets its own
+INHERITED_HEADERS = ('Authorization', 'User-Agent')
+
+class BatchError(ValueError):
+    """The batch itself is malformed; no sub-request was run"""
+
+class BatchDispatcher:
+    """Runs the sub-requests of a batch and collects their responses"""
+
+    def __init__(self, app=None):
+        self.max_requests = 20
+        self.max_workers = 4
+        self._executor = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_requests = app.config.get('BATCH_MAX_REQUESTS', self.max_requests)
+        self.max_workers = app.config.get('BATCH_MAX_WORKERS', self.max_workers)
+        app.extensions['batch_dispatcher'] = self
+
+    def parse(self, payload):
+        """
+        Check a batch body and normalize its sub-requests
+
+        Args:
+            payload: Decoded JSON body, ``{"requests": [{"id", "method", "path", "body", "headers"}]}``
+
+        Returns:
+            list: Sub-request dicts with id, method, path, body and headers
+
+        Raises:
+            BatchError: If the batch or one of its sub-requests is malformed
+        """
+        items = payload.get('requests') if isinstance(payload, dict) else None
+        if not isinstance(items, list) or not items:
+            raise BatchError('requests must be a non-empty list')
+        if len(items) > self.max_requests:
+            raise BatchError(f'At most {self.max_requests} requests per batch')
+
+        parsed = []
+        for position, item in enumerate(items):
+            if not isinstance(item, dict):
+                raise BatchError(f'Request {position} is not an object')
+            method = str(item.get('method') or 'GET').upper()
+            path = item.get('path')
+            headers = item.get('headers') or {}
+            if method not in METHODS:
+                raise BatchError(f'Request {position}: method must be one of {", ".join(METHODS)}')
+            if not isinstance(path, str) or not path.startswith('/api/'):
+                raise BatchError(f'Request {position}: path must start with /api/')
+            if path.split('?', 1)[0].rstrip('/') == BATCH_PATH:
+                raise BatchError(f'Request {position}: batches cannot be nested')
+            if not isinstance(headers, dict):
+                raise BatchError(f'Request {position}: headers must be an object')
+            parsed.append({
+                'id': item.get('id', position),
+                'method': method,
+                'path': path,
+                'body': item.get('body'),
+                'headers': {str(k): str(v) for k, v in headers.items()}
+            })
+        return parsed
+
+    def run(self, sub_requests):
+        """
+        Dispatch sub-requests from inside the batch request
+
+        Returns:
+            list: (id, status, response body bytes, is_json), in request order
+        """
+        app = current_app._get_current_object()
+        environs = [self._environ(sub_request) for sub_request in sub_requests]
+        results = [None] * len(sub_requests)
+
+        position = 0
+        while position < len(sub_requests):
+            end = position
+            while end < len(sub_requests) and sub_requests[end]['method'] == 'GET':
+                end += 1
+            if end - position > 1 and self.max_workers > 1:
+                # Independent reads: run side by side, each on its own session
+                futures = [(i, self._pool().submit(self._dispatch_in_new_context, app, environs[i]))
+                           for i in range(position, end)]
+                for i, future in futures:
+                    results[i] = future.result()
+                position = end
+            else:
+                results[position] = self._dispatch(app, environs[position])
+                position += 1
+
+        return [(sub_request['id'],) + result for sub_request, result in zip(sub_requests, results)]
+
+    def _environ(self, sub_request):
+        headers = {name: request.headers[name] for name in INHERITED_HEADERS if name in request.headers}
+        headers.update(sub_request['headers'])
+        # Sub-requests share the batch's session, and with it the batch's tenant databases
+        headers = {name: value for name, value in headers.items() if name.lower() != tenancy.header.lower()}
+        if tenancy.header in request.headers:
+            headers[tenancy.header] = request.headers[tenancy.header]
+        path, _, query = sub_request['path'].partition('?')
+        builder = EnvironBuilder(
+            path=path, query_string=query, method=sub_request['method'], base_url=request.host_url,
+            headers=headers, json=sub_request['body'],
+            environ_base={'REMOTE_ADDR': request.remote_addr}
+        )
+        try:
+            return builder.get_environ()
+        finally:
+            builder.close()
+
+    def _dispatch(self, app, environ):
+        with app.request_context(environ):
+            try:
+                response = app.full_dispatch_request()
+            except Exception as e:
+                response = app.make_response(({'error': str(e)}, 500))
+            body = response.get_data()
+            if response.status_code >= 500:
+                # Leave the shared session clean for the requests after this one
+                db.session.rollback()
+            return response.status_code, body, response.is_json
+
+    def _dispatch_in_new_context(self, app, environ):
+        with app.app_context():
+            return self._dispatch(app, environ)
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='batch')
+        return self._executor
+
+def encode_results(results):
+    """``{"responses": [...]}`` with JSON bodies spliced in as they are"""
+    parts = []
+    for request_id, status, body, is_json in results:
+        head = json.dumps({'id': request_id, 'status': status}, separators=(',', ':'))
+        if is_json and body.strip():
+            encoded = body.strip()
+        elif body:
+            encoded = json.dumps(body.decode('utf-8', 'replace')).encode('utf-8')
+        else:
+            encoded = b'null'
+        parts.append(head[:-1].encode('utf-8') + b',"body":' + encoded + b'}')
+    return b'{"responses":[' + b','.join(parts) + b']}'
+
+batch_dispatcher = BatchDispatcher()
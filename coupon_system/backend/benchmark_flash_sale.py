@@ -0,0 +1,123 @@
+"""
+Flash-sale benchmark for coupon redemption
+
+Many threads post POST /api/coupons/apply for two coupons with the same
+usage limit on a scratch database, each request from a different user: one
+coupon is applied through the normal path, the other is listed in
+FLASH_SALE_CODES and admitted from the in-memory slot pool. For both it
+reports how many requests reached the database and how fast refusals came
+back. The check fails if the flash-sale coupon ends with more redemptions
+than its limit, or if more than a small margin over its limit of requests
+reached the database.
+
+Usage:
+    python benchmark_flash_sale.py --threads 32 --requests 3000 --limit 200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+def run(threads, requests, limit):
+    from datetime import datetime, timedelta
+    from sqlalchemy import event
+    from flask_jwt_extended import create_access_token
+    from app import create_app
+    from migrations import upgrade
+    from models import db, User, Product, Coupon, CouponRedemption, CouponUsageLog
+    from models import ThemeType, ProductCategory, CouponType
+
+    app = create_app({'FLASH_SALE_CODES': 'FLASH1', 'RATE_LIMIT_ENABLED': False})
+    with app.app_context():
+        upgrade()
+        product = Product(name='Flash product', category=ProductCategory.KEYCHAIN, theme=ThemeType.BTS,
+                          price=100.0, stock_quantity=100)
+        coupons = [Coupon(code=code, name=code, coupon_type=CouponType.PERCENTAGE, discount_value=10,
+                          valid_from=datetime.utcnow() - timedelta(days=1),
+                          valid_until=datetime.utcnow() + timedelta(days=1), usage_limit=limit)
+                   for code in ('PLAIN1', 'FLASH1')]
+        users = [User(username=f'flash{i}', email=f'flash{i}@example.com', password_hash='x')
+                 for i in range(requests)]
+        db.session.add_all([product] + coupons + users)
+        db.session.commit()
+        tokens = [create_access_token(identity=user.id) for user in users]
+        cart = [{'product_id': product.id, 'quantity': 1, 'price': product.price}]
+        engine = db.engine
+
+    statements = [0]
+    lock = threading.Lock()
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        with lock:
+            statements[0] += 1
+
+    def burst(code):
+        statements[0] = 0
+        refusals = []
+        next_request = iter(range(requests))
+
+        def worker():
+            client = app.test_client()
+            for i in next_request:
+                started = time.perf_counter()
+                response = client.post('/api/coupons/apply', headers={'Authorization': f'Bearer {tokens[i]}'},
+                                       json={'code': code, 'order_id': f'{code}-{i}', 'cart_items': cart,
+                                             'original_amount': 100.0})
+                if response.status_code != 200:
+                    with lock:
+                        refusals.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        with app.app_context():
+            coupon_id = db.session.query(Coupon.id).filter_by(code=code).scalar()
+            redeemed = db.session.query(db.func.count(CouponRedemption.id)).filter_by(coupon_id=coupon_id).scalar()
+            # Every apply that gets past admission writes a usage log row
+            reached = CouponUsageLog.query.filter_by(coupon_code=code, action='apply').count()
+        refused_ms = statistics.median(refusals) * 1000 if refusals else 0
+        print(f'{code}: {requests} requests in {elapsed:.2f}s, {redeemed} redeemed (limit {limit}), '
+              f'{reached} reached the database, {statements[0]} statements, '
+              f'median refusal {refused_ms:.2f} ms')
+        return redeemed, reached
+
+    burst('PLAIN1')
+    redeemed, reached = burst('FLASH1')
+
+    if redeemed > limit:
+        print(f'FAILED: flash-sale coupon redeemed {redeemed} times, limit {limit}')
+        return 1
+    if reached > limit + threads:
+        print(f'FAILED: {reached} flash-sale requests reached the database for {limit} slots')
+        return 1
+    print(f'OK: {reached} of {requests} flash-sale requests reached the database for {limit} slots')
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Flash-sale redemption benchmark')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=3000, help='Apply requests per coupon, one per user')
+    parser.add_argument('--limit', type=int, default=200, help='Usage limit of each coupon')
+    args = parser.parse_args(argv)
+
+    # Never run against the real database
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    try:
+        return run(args.threads, args.requests, args.limit)
+    finally:
+        os.unlink(scratch.name)
+
+if __name__ == '__main__':
+    sys.exit(main())
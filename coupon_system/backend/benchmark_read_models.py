@@ -0,0 +1,145 @@
+"""
+Read-model benchmark
+
+Seeds a scratch database with many products, coupons and one user's
+redemptions, then loads each list two ways: through ORM instances (what
+the list endpoints used to do) and through the Core ``select()`` records
+of ``read_models``. For each it reports the peak memory allocated while
+loading the rows (tracemalloc) and the best time over a few rounds to load
+and serialize them. The serialized output is the same on both paths and is
+left out of the memory figure. The check fails if the records do not use
+less than half the memory of the ORM path for every list.
+
+Usage:
+    python benchmark_read_models.py --rows 20000 --rounds 5
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+def seed(rows):
+    from datetime import datetime, timedelta
+    from sqlalchemy import insert
+    from models import db, User, Product, Coupon, CouponRedemption, ThemeType, ProductCategory, CouponType
+
+    now = datetime.utcnow()
+    user = User(username='reader', email='reader@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    db.session.execute(insert(Product.__table__), [{
+        'name': f'Product {i}', 'description': f'Description of product {i}',
+        'category': list(ProductCategory)[i % 6].name, 'theme': list(ThemeType)[i % 5].name,
+        'price': 10.0 + i % 90, 'image_url': f'https://example.com/{i}.jpg', 'stock_quantity': 10,
+        'is_active': True, 'created_at': now
+    } for i in range(rows)])
+    db.session.execute(insert(Coupon.__table__), [{
+        'code': f'READ{i}', 'name': f'Coupon {i}', 'description': f'Description of coupon {i}',
+        'coupon_type': CouponType.PERCENTAGE.name, 'discount_value': 10.0, 'min_purchase_amount': 0.0,
+        'valid_from': now - timedelta(days=1), 'valid_until': now + timedelta(days=30), 'usage_limit': 100,
+        'usage_limit_per_user': 1, 'applicable_themes': '["BTS"]', 'is_active': True, 'created_at': now
+    } for i in range(rows)])
+    db.session.execute(insert(CouponRedemption.__table__), [{
+        'coupon_id': i + 1, 'user_id': user.id, 'order_id': f'order-{i}', 'discount_applied': 5.0,
+        'original_amount': 50.0, 'final_amount': 45.0, 'is_used': True, 'used_at': now, 'created_at': now
+    } for i in range(rows)])
+    db.session.commit()
+    return user.id
+
+def measure(load, serialize, rounds):
+    """(peak bytes allocated loading the rows, best seconds to load and serialize them)"""
+    from models import db
+
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    rows = load()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del rows
+
+    best = None
+    for _ in range(rounds):
+        db.session.remove()
+        started = time.perf_counter()
+        [serialize(row) for row in load()]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    db.session.remove()
+    return peak, best
+
+def run(rows, rounds):
+    from app import create_app
+    from migrations import upgrade
+    from models import Product, Coupon, CouponRedemption
+    from read_models import load_products, load_coupons, load_user_history
+    from serializers import product_static_fields, coupon_static_fields, serialize_redemption_history
+
+    app = create_app()
+    with app.app_context():
+        upgrade()
+        user_id = seed(rows)
+
+        def orm_history():
+            # Each redemption's coupon is lazy-loaded, as the endpoint did
+            redemptions = CouponRedemption.query.filter_by(user_id=user_id) \
+                .order_by(CouponRedemption.created_at.desc()).all()
+            for redemption in redemptions:
+                redemption.coupon
+            return redemptions
+
+        def serialize_orm_history(r):
+            return {
+                'id': r.id, 'coupon_code': r.coupon.code, 'coupon_name': r.coupon.name,
+                'order_id': r.order_id, 'discount_applied': r.discount_applied,
+                'original_amount': r.original_amount, 'final_amount': r.final_amount, 'is_used': r.is_used,
+                'used_at': r.used_at.isoformat() if r.used_at else None, 'created_at': r.created_at.isoformat()
+            }
+
+        cases = [
+            ('products', lambda: Product.query.order_by(Product.id).all(), product_static_fields,
+             load_products, product_static_fields),
+            ('coupons', lambda: Coupon.query.order_by(Coupon.id).all(), coupon_static_fields,
+             load_coupons, coupon_static_fields),
+            ('history', orm_history, serialize_orm_history,
+             lambda: load_user_history(user_id), serialize_redemption_history),
+        ]
+
+        failed = []
+        for name, orm_load, orm_serialize, record_load, record_serialize in cases:
+            orm_peak, orm_time = measure(orm_load, orm_serialize, rounds)
+            record_peak, record_time = measure(record_load, record_serialize, rounds)
+            ratio = orm_peak / record_peak
+            print(f'{name:>9}: ORM {orm_peak / 1e6:6.1f} MB {orm_time * 1000:7.1f} ms | '
+                  f'records {record_peak / 1e6:6.1f} MB {record_time * 1000:7.1f} ms | '
+                  f'{ratio:.1f}x less memory, {orm_time / record_time:.1f}x faster')
+            if ratio < 2:
+                failed.append(name)
+
+    if failed:
+        print(f'FAILED: records use more than half the ORM memory for {", ".join(failed)}')
+        return 1
+    print(f'OK: every list of {rows} rows uses under half the memory through read models')
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ORM vs read-model list benchmark')
+    parser.add_argument('--rows', type=int, default=20000, help='Products, coupons and redemptions to seed')
+    parser.add_argument('--rounds', type=int, default=5, help='Timed runs of each list')
+    args = parser.parse_args(argv)
+
+    # Never run against the real database
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    try:
+        return run(args.rows, args.rounds)
+    finally:
+        os.unlink(scratch.name)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Product search benchmark
+
+Seeds a scratch database with a synthetic catalogue (names and descriptions
+drawn from a fixed vocabulary), builds the catalogue snapshot and search
+index, then times ``product_search.search`` for a mix of word, prefix,
+multi-word, price-range and sorted queries. The check fails if the median
+search takes longer than the budget.
+
+Usage:
+    python benchmark_search.py --products 500000 --rounds 20 --budget-ms 10
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ARTISTS = ['jimin', 'jungkook', 'suga', 'namjoon', 'jhope', 'taehyung', 'jin', 'naruto', 'sasuke', 'luffy',
+           'zoro', 'goku', 'vegeta', 'totoro', 'pikachu', 'lisa', 'jennie', 'rose', 'jisoo', 'felix']
+ADJECTIVES = ['holographic', 'acrylic', 'glitter', 'vintage', 'pastel', 'neon', 'chibi', 'limited', 'signed',
+              'embroidered', 'enamel', 'glow', 'mini', 'deluxe', 'retro', 'matte', 'metallic', 'woven']
+ITEMS = {
+    'KEYCHAIN': ['keychain', 'keyring', 'charm'],
+    'BRACELET': ['bracelet', 'bangle', 'wristband'],
+    'STICKER': ['sticker', 'decal', 'sheet'],
+    'POSTER': ['poster', 'print', 'banner'],
+    'CLOTHING': ['hoodie', 'shirt', 'jacket'],
+    'ACCESSORIES': ['pin', 'badge', 'lanyard'],
+}
+FILLER = [f'w{i}' for i in range(3000)]
+
+QUERIES = [
+    ('word', {'query': 'holographic'}),
+    ('two words', {'query': 'jimin keychain'}),
+    ('prefix', {'query': 'jun'}),
+    ('three words', {'query': 'neon luffy poster'}),
+    ('rare word', {'query': 'w1234'}),
+    ('word + price range', {'query': 'taehyung', 'min_price': 10, 'max_price': 20}),
+    ('word by price', {'query': 'pastel hoodie', 'sort': 'price_asc'}),
+    ('words by name', {'query': 'chibi goku', 'sort': 'name'}),
+]
+
+def seed(count):
+    from sqlalchemy import insert
+    from models import db, Product, ThemeType, ProductCategory
+
+    rng = random.Random(46)
+    themes = list(ThemeType)
+    categories = list(ProductCategory)
+    table = Product.__table__
+    batch = []
+    for i in range(count):
+        category = rng.choice(categories)
+        artist, adjective, item = rng.choice(ARTISTS), rng.choice(ADJECTIVES), rng.choice(ITEMS[category.name])
+        batch.append({
+            'name': f'{artist.title()} {adjective.title()} {item.title()} #{i}',
+            'description': f'{adjective} {item} featuring {artist}, ' + ' '.join(rng.sample(FILLER, 8)),
+            'category': category.name, 'theme': rng.choice(themes).name,
+            'price': round(rng.uniform(2, 80), 2), 'stock_quantity': 10, 'is_active': rng.random() > 0.05,
+        })
+        if len(batch) == 10000:
+            db.session.execute(insert(table), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(table), batch)
+    db.session.commit()
+
+def run(products, rounds, budget_ms):
+    from app import create_app
+    from migrations import upgrade
+    from product_search import product_search
+
+    app = create_app()
+    with app.app_context():
+        upgrade()
+        started = time.perf_counter()
+        seed(products)
+        seeded = time.perf_counter()
+        product_search.index()
+        indexed = time.perf_counter()
+        print(f'Seeded {products} products in {seeded - started:.1f}s, built the snapshot and index in {indexed - seeded:.1f}s')
+
+        medians = []
+        for name, kwargs in QUERIES:
+            product_search.search(**kwargs)
+            timings = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                result = product_search.search(**kwargs)
+                timings.append((time.perf_counter() - started) * 1000)
+            median = statistics.median(timings)
+            medians.append(median)
+            print(f'{name:>20}: {result["total"]:>7} matches, median {median:6.2f} ms, max {max(timings):6.2f} ms')
+
+    overall = statistics.median(medians)
+    if overall > budget_ms:
+        print(f'FAILED: median search {overall:.2f} ms, budget {budget_ms} ms')
+        return 1
+    print(f'OK: median search {overall:.2f} ms over {products} products (budget {budget_ms} ms)')
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Product search benchmark')
+    parser.add_argument('--products', type=int, default=500000)
+    parser.add_argument('--rounds', type=int, default=20, help='Timed runs of each query')
+    parser.add_argument('--budget-ms', type=float, default=10)
+    args = parser.parse_args(argv)
+
+    # Never run against the real database
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    try:
+        return run(args.products, args.rounds, args.budget_ms)
+    finally:
+        os.unlink(scratch.name)
+
+if __name__ == '__main__':
+    sys.exit(main())
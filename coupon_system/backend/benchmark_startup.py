@@ -0,0 +1,144 @@
+"""
+Startup-time benchmark
+
+Measures how long a worker takes from start to its first served response,
+on a scratch database seeded with a catalogue and coupons:
+
+  - fresh process: a new interpreter imports the app, calls create_app()
+    and serves GET /api/products (what a CLI job or a non-preloading
+    server pays)
+  - pre-forked worker: a master process calls create_app() once (warming
+    the caches with --warm), then each worker is forked from it and serves
+    the request (what a preloading server such as gunicorn --preload pays
+    per worker)
+
+The check fails when the median pre-forked worker start, from fork to
+first response, is over the target.
+
+Usage:
+    python benchmark_startup.py --runs 10 --products 2000 --coupons 500 --warm
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app({'WARM_CACHES': sys.argv[1] == '1'})
+created = time.perf_counter()
+status = app.test_client().get('/api/products').status_code
+served = time.perf_counter()
+if status != 200:
+    sys.exit(f'GET /api/products returned {status}')
+print(json.dumps({'import': imported - started, 'create': created - imported, 'first_request': served - created}))
+'''
+
+def seed(products, coupons):
+    from datetime import datetime, timedelta
+    from app import create_app
+    from migrations import upgrade
+    from models import db, Product, Coupon, ThemeType, ProductCategory, CouponType
+
+    app = create_app()
+    themes, categories = list(ThemeType), list(ProductCategory)
+    now = datetime.utcnow()
+    with app.app_context():
+        upgrade()
+        db.session.add_all(Product(
+            name=f'Startup product {i}',
+            category=categories[i % len(categories)],
+            theme=themes[i % len(themes)],
+            price=100.0 + i % 50,
+            stock_quantity=100
+        ) for i in range(products))
+        db.session.add_all(Coupon(
+            code=f'START{i:05d}',
+            name=f'Startup coupon {i}',
+            coupon_type=CouponType.PERCENTAGE,
+            discount_value=10,
+            applicable_themes=json.dumps([themes[i % len(themes)].value]),
+            valid_from=now - timedelta(days=1),
+            valid_until=now + timedelta(days=30)
+        ) for i in range(coupons))
+        db.session.commit()
+
+def fresh_process(warm):
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE, '1' if warm else '0'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def forked_worker(app):
+    read_end, write_end = os.pipe()
+    started = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        forked = time.perf_counter()
+        status = app.test_client().get('/api/products').status_code
+        served = time.perf_counter()
+        timings = {'fork': forked - started, 'first_request': served - forked}
+        os.write(write_end, json.dumps(timings if status == 200 else {'error': status}).encode())
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as pipe:
+        timings = json.loads(pipe.read())
+    os.waitpid(pid, 0)
+    if 'error' in timings:
+        raise RuntimeError(f'GET /api/products returned {timings["error"]} in a forked worker')
+    return timings
+
+def summarize(label, samples):
+    print(label)
+    for phase in samples[0]:
+        values = [s[phase] * 1000 for s in samples]
+        print(f'  {phase:<14} median {statistics.median(values):7.1f} ms   max {max(values):7.1f} ms')
+    totals = [sum(s.values()) * 1000 for s in samples]
+    print(f'  {"total":<14} median {statistics.median(totals):7.1f} ms   max {max(totals):7.1f} ms')
+    return statistics.median(totals)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Worker startup-time benchmark')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--coupons', type=int, default=500)
+    parser.add_argument('--warm', action='store_true', help='Warm the caches inside create_app()')
+    parser.add_argument('--target-ms', type=float, default=200, help='Pre-forked worker start target')
+    args = parser.parse_args(argv)
+
+    # Never run against the real database
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    try:
+        seed(args.products, args.coupons)
+        summarize('Fresh process', [fresh_process(args.warm) for _ in range(args.runs)])
+
+        if not hasattr(os, 'fork'):
+            print('Pre-forked workers: skipped, os.fork is not available')
+            return 0
+        from app import create_app
+        master = create_app({'WARM_CACHES': args.warm})
+        median = summarize('Pre-forked worker', [forked_worker(master) for _ in range(args.runs)])
+    finally:
+        os.unlink(scratch.name)
+
+    if median > args.target_ms:
+        print(f'FAILED: median pre-forked worker start {median:.1f} ms is over {args.target_ms:.0f} ms')
+        return 1
+    print(f'OK: median pre-forked worker start {median:.1f} ms (target {args.target_ms:.0f} ms)')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Concurrency benchmark for stock reservations
+
+Starts many threads that reserve, commit and release stock against a small
+set of products, one of them hot, on a scratch database. It checks that stock
+is never oversold: for every product, remaining stock plus held and
+committed quantities must equal the starting stock, and no product may go
+negative.
+
+Usage:
+    python benchmark_stock.py --threads 16 --attempts 200 --hot-stock 500
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+def run(threads, attempts, hot_stock, cold_stock, products):
+    from app import create_app
+
+    app = create_app()
+    from models import db, Product, StockReservation, StockReservationItem, ThemeType, ProductCategory
+    from inventory_service import InventoryService
+
+    service = InventoryService(reservation_ttl=1, sweep_interval=0.5)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for i in range(products):
+            db.session.add(Product(
+                name=f'Benchmark product {i}',
+                category=ProductCategory.KEYCHAIN,
+                theme=ThemeType.OTHER,
+                price=100.0,
+                stock_quantity=hot_stock if i == 0 else cold_stock
+            ))
+        db.session.commit()
+        product_ids = [p.id for p in Product.query.order_by(Product.id).all()]
+        initial = {p.id: p.stock_quantity for p in Product.query.all()}
+
+    stats = {'reserved': 0, 'rejected': 0, 'errors': 0, 'committed': 0, 'released': 0}
+    stats_lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        with app.app_context():
+            for _ in range(attempts):
+                # Every cart takes the hot product plus one other
+                cart = [{'product_id': product_ids[0], 'quantity': rng.randint(1, 3)},
+                        {'product_id': rng.choice(product_ids[1:]), 'quantity': 1}]
+                result = service.reserve_stock(cart)
+                outcome = 'reserved' if result['success'] else \
+                    'rejected' if result.get('unavailable') else 'errors'
+                follow_up = None
+                if result['success']:
+                    roll = rng.random()
+                    if roll < 0.6:
+                        follow_up = 'committed' if service.commit_reservation(result['reservation_id'])['success'] else None
+                    elif roll < 0.9:
+                        follow_up = 'released' if service.release_reservation(result['reservation_id'])['success'] else None
+                    # The rest are abandoned and left for the expiry sweep
+                with stats_lock:
+                    stats[outcome] += 1
+                    if follow_up:
+                        stats[follow_up] += 1
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        time.sleep(1.1)
+        swept = service.release_expired()
+
+        held = dict(db.session.query(StockReservationItem.product_id, db.func.sum(StockReservationItem.quantity))
+                    .join(StockReservation)
+                    .filter(StockReservation.status.in_(['held', 'committed']))
+                    .group_by(StockReservationItem.product_id).all())
+        remaining = {p.id: p.stock_quantity for p in Product.query.all()}
+
+    oversold = [pid for pid in product_ids
+                if remaining[pid] < 0 or remaining[pid] + held.get(pid, 0) != initial[pid]]
+
+    total = threads * attempts
+    print(f'Attempts: {total} in {elapsed:.2f}s ({total / elapsed:.0f} reservations/s)')
+    print(f'Reserved: {stats["reserved"]}, rejected for stock: {stats["rejected"]}, errors: {stats["errors"]}')
+    print(f'Committed: {stats["committed"]}, released: {stats["released"]}, expired by sweep: {swept}')
+    print(f'Hot product: {initial[product_ids[0]]} -> {remaining[product_ids[0]]}, '
+          f'sold {held.get(product_ids[0], 0)}')
+    if oversold:
+        print(f'FAILED: stock accounting broken for products {oversold}')
+        return 1
+    print('OK: no product oversold and stock fully accounted for')
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stock reservation concurrency benchmark')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--attempts', type=int, default=200, help='Reservations per thread')
+    parser.add_argument('--hot-stock', type=int, default=500)
+    parser.add_argument('--cold-stock', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    # Never run against the real database
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    try:
+        return run(args.threads, args.attempts, args.hot_stock, args.cold_stock, args.products)
+    finally:
+        os.unlink(scratch.name)
+
+if __name__ == '__main__':
+    sys.exit(main())
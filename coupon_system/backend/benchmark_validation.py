@@ -0,0 +1,140 @@
+"""
+Burst benchmark for coupon validation
+
+Many threads validate one coupon at once, as when a code is shared on
+social media, spread over a handful of distinct carts. The burst runs once
+with every validation computed on its own and once through the validation
+memo, counting the database queries each issues. The check fails if the
+memoized burst does not answer exactly as the plain one, if its query count
+grows with the number of requests instead of the number of distinct carts,
+or if a redemption is not reflected in the next validation.
+
+Usage:
+    python benchmark_validation.py --threads 32 --requests 100 --carts 5
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+def run(threads, requests, carts):
+    from datetime import datetime, timedelta
+    from sqlalchemy import event
+    from app import create_app
+    from migrations import upgrade
+    from models import db, User, Product, Coupon, CouponRedemption, ThemeType, ProductCategory, CouponType
+    from coupon_service import CouponService
+    from catalogue import catalogue
+    from validity_schedule import validity_schedule
+    from validation_memo import validation_memo
+
+    app = create_app()
+    with app.app_context():
+        upgrade()
+        user = User(username='burst', email='burst@example.com', password_hash='x')
+        products = [Product(name=f'Burst product {i}', category=ProductCategory.KEYCHAIN, theme=ThemeType.BTS,
+                            price=100.0 + i, stock_quantity=100) for i in range(carts)]
+        coupon = Coupon(code='BURST10', name='Burst', coupon_type=CouponType.PERCENTAGE, discount_value=10,
+                        valid_from=datetime.utcnow() - timedelta(days=1),
+                        valid_until=datetime.utcnow() + timedelta(days=1), usage_limit=1000,
+                        usage_limit_per_user=5)
+        db.session.add_all([user, coupon] + products)
+        db.session.commit()
+        user_id, coupon_id = user.id, coupon.id
+        cart_list = [[{'product_id': p.id, 'quantity': 2, 'price': p.price}] for p in products]
+        engine = db.engine
+
+    queries = [0]
+    lock = threading.Lock()
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            with lock:
+                queries[0] += 1
+
+    def burst(service):
+        # Warm the catalogue and schedule so only validation queries are counted
+        with app.app_context():
+            catalogue.snapshot()
+            validity_schedule.valid_ids()
+        queries[0] = 0
+        answers = {}
+        start = threading.Barrier(threads)
+
+        def worker(seed):
+            with app.app_context():
+                start.wait()
+                for i in range(requests):
+                    cart = cart_list[(seed + i) % carts]
+                    result = service.validate_coupon('BURST10', user_id, cart)
+                    with lock:
+                        answers.setdefault((seed + i) % carts, []).append(result)
+                db.session.remove()
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        return time.perf_counter() - started, queries[0], answers
+
+    total = threads * requests
+    plain = CouponService(catalogue, validity_schedule)
+    elapsed, plain_queries, plain_answers = burst(plain)
+    print(f'Plain:      {total} validations in {elapsed:.2f}s, {plain_queries} queries')
+
+    memoized = CouponService(catalogue, validity_schedule, validation_memo=validation_memo)
+    elapsed, memo_queries, memo_answers = burst(memoized)
+    print(f'Memoized:   {total} validations in {elapsed:.2f}s, {memo_queries} queries')
+
+    failed = False
+    expected = {cart: answers[0] for cart, answers in plain_answers.items()}
+    if any(answer != expected[cart] for cart, answers in memo_answers.items() for answer in answers):
+        print('FAILED: memoized validations differ from plain ones')
+        failed = True
+
+    # A cold validation costs plain_queries / total queries; allow a few per distinct cart
+    per_validation = plain_queries / total
+    if memo_queries > 4 * carts * per_validation:
+        print(f'FAILED: {memo_queries} queries for {carts} distinct carts')
+        failed = True
+
+    with app.app_context():
+        db.session.add(CouponRedemption(coupon_id=coupon_id, user_id=user_id, discount_applied=10,
+                                        original_amount=100, final_amount=90, is_used=True,
+                                        used_at=datetime.utcnow()))
+        db.session.commit()
+        after = memoized.validate_coupon('BURST10', user_id, cart_list[0])
+    if after['coupon']['usage_count'] != expected[0]['coupon']['usage_count'] + 1:
+        print('FAILED: validation after a redemption served a stale usage count')
+        failed = True
+
+    if failed:
+        return 1
+    print(f'OK: {memo_queries} queries for {total} validations over {carts} distinct carts '
+          f'({plain_queries} without coalescing)')
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Coupon validation burst benchmark')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=100, help='Validations per thread')
+    parser.add_argument('--carts', type=int, default=5, help='Distinct carts in the burst')
+    args = parser.parse_args(argv)
+
+    # Never run against the real database
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    try:
+        return run(args.threads, args.requests, args.carts)
+    finally:
+        os.unlink(scratch.name)
+
+if __name__ == '__main__':
+    sys.exit(main())
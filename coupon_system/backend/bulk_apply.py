@@ -0,0 +1,258 @@
+"""
+Bulk coupon application
+
+Applies coupons to a stream of orders (one JSON object per line with code,
+user_id, order_id, cart_items and original_amount), for backfills after an
+outage. Orders are taken in chunks of ``BULK_APPLY_CHUNK_SIZE``; for each
+chunk the coupons and their redemption counts are loaded with a few grouped
+queries, every order is checked with the same rules as
+``CouponService.apply_coupon`` against running in-memory counts, and the
+redemptions, usage-log rows, change-log rows and feed events are written with
+batched inserts in one transaction. Results come back per order, in input
+order.
+
+Usage:
+    python bulk_apply.py orders.ndjson > results.ndjson
+    python bulk_apply.py - < orders.ndjson
+"""
+
+from collections import Counter
+from datetime import datetime
+import json
+import sys
+import time
+from sqlalchemy import insert, select
+
+from models import db, Coupon, CouponRedemption, CouponUsageLog, ArchivedRedemption
+from coupon_service import LoadedCoupon
+from cache_sync import cache_sync
+from redemption_feed import redemption_feed
+from usage_counters import usage_counters
+from user_eligibility import user_eligibility
+from validation_memo import validation_memo
+from flash_sale import flash_sale
+from redemption_archive import redemption_totals
+
+LIMIT_REACHED = 'Coupon has expired or reached usage limit'
+
+def parse_orders(lines):
+    """Orders from NDJSON lines; a line that is not a JSON object becomes an error result"""
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            order = json.loads(line)
+        except ValueError:
+            order = None
+        yield order if isinstance(order, dict) else {'error': f'Line {number} is not a JSON object'}
+
+class BulkApplier:
+    """Applies coupons to many orders per transaction"""
+
+    def __init__(self, coupon_service, usage_stripes=None, chunk_size=1000):
+        self.coupon_service = coupon_service
+        self.usage_stripes = usage_stripes
+        self.chunk_size = chunk_size
+
+    def apply(self, orders, ip_address=None, user_agent=None):
+        """
+        Apply coupons to orders, committing every ``chunk_size`` orders
+
+        Args:
+            orders (iterable): Order dicts with code, user_id, order_id, cart_items, original_amount
+            ip_address (str, optional): Recorded in the usage log
+            user_agent (str, optional): Recorded in the usage log
+
+        Yields:
+            dict: One result per order, in input order
+        """
+        chunk = []
+        for order in orders:
+            chunk.append(order)
+            if len(chunk) >= self.chunk_size:
+                yield from self._apply_chunk(chunk, ip_address, user_agent)
+                chunk = []
+        if chunk:
+            yield from self._apply_chunk(chunk, ip_address, user_agent)
+
+    def _apply_chunk(self, orders, ip_address, user_agent):
+        try:
+            results = self._write_chunk(orders, ip_address, user_agent)
+        except Exception as e:
+            db.session.rollback()
+            results = [{'order_id': order.get('order_id'), 'success': False,
+                        'message': f'Error applying coupon: {str(e)}'} for order in orders]
+        return results
+
+    def _write_chunk(self, orders, ip_address, user_agent):
+        results = [None] * len(orders)
+        pending = []  # (position, order, code, user_id)
+        for position, order in enumerate(orders):
+            if 'error' in order:
+                results[position] = {'order_id': None, 'success': False, 'message': order['error']}
+                continue
+            code = (order.get('code') or '').strip().upper()
+            if not all([code, order.get('user_id'), order.get('order_id'), order.get('cart_items'),
+                        order.get('original_amount')]):
+                results[position] = {'order_id': order.get('order_id'), 'success': False,
+                                     'message': 'Missing required fields'}
+                continue
+            if not isinstance(order['user_id'], int) or not isinstance(order['original_amount'], (int, float)):
+                results[position] = {'order_id': order['order_id'], 'success': False,
+                                     'message': 'user_id must be an integer and original_amount a number'}
+                continue
+            pending.append((position, order, code, order['user_id']))
+
+        coupons, counts, user_counts = self._load_coupons(pending)
+        schedule = self.coupon_service.validity_schedule
+
+        # Check every order against running counts, as if applied one by one
+        accepted = {}  # coupon_id -> [(position, order, discount)]
+        for position, order, code, user_id in pending:
+            coupon = coupons.get(code)
+            if coupon is None:
+                results[position] = {'order_id': order['order_id'], 'success': False,
+                                     'message': 'Coupon code not found or inactive'}
+                continue
+            redemption_count, usage_count = counts.get(coupon.id, (0, 0))
+            user_usage_count = user_counts.get((coupon.id, user_id), 0)
+            live = schedule.is_live(coupon.id) if schedule is not None else None
+            loaded = LoadedCoupon(coupon, redemption_count, usage_count, user_usage_count, live=live)
+            validation = self.coupon_service.evaluate_coupon(loaded, user_id, order['cart_items'])
+            if not validation['valid']:
+                results[position] = {'order_id': order['order_id'], 'success': False,
+                                     'message': validation['message']}
+                continue
+            counts[coupon.id] = (redemption_count + 1, usage_count + 1)
+            user_counts[(coupon.id, user_id)] = user_usage_count + 1
+            accepted.setdefault(coupon.id, []).append((position, order, validation['discount']['discount_amount']))
+
+        # Take the uses from the striped limits; orders past what is left fail
+        if self.usage_stripes is not None:
+            by_id = {coupon.id: coupon for coupon in coupons.values()}
+            for coupon_id, entries in accepted.items():
+                granted = self.usage_stripes.reserve_many(by_id[coupon_id], len(entries))
+                for position, order, _ in entries[granted:]:
+                    results[position] = {'order_id': order['order_id'], 'success': False, 'message': LIMIT_REACHED}
+                del entries[granted:]
+
+        now = datetime.utcnow()
+        redemptions = []
+        positions = []
+        for coupon_id, entries in accepted.items():
+            for position, order, discount in entries:
+                original_amount = order['original_amount']
+                redemptions.append({
+                    'coupon_id': coupon_id,
+                    'user_id': order['user_id'],
+                    'order_id': order['order_id'],
+                    'discount_applied': discount,
+                    'original_amount': original_amount,
+                    'final_amount': max(0, original_amount - discount),
+                    'is_used': True,
+                    'used_at': now,
+                    'created_at': now
+                })
+                positions.append(position)
+
+        connection = db.session.connection()
+        if redemptions:
+            table = CouponRedemption.__table__
+            ids = connection.execute(
+                insert(table).returning(table.c.id, sort_by_parameter_order=True), redemptions
+            ).scalars().all()
+            for redemption, redemption_id, position in zip(redemptions, ids, positions):
+                redemption['id'] = redemption_id
+                results[position] = {
+                    'order_id': redemption['order_id'],
+                    'success': True,
+                    'redemption_id': redemption_id,
+                    'discount_applied': redemption['discount_applied'],
+                    'original_amount': redemption['original_amount'],
+                    'final_amount': redemption['final_amount']
+                }
+            # Core inserts skip the session listeners; record what they would have
+            redemption_feed.record(connection, 'created', redemptions)
+            cache_sync.publish(connection, sorted(
+                {('redemption', r['coupon_id']) for r in redemptions} |
+                {('user_redemption', r['user_id']) for r in redemptions}
+            ))
+
+        logs = [{
+            'coupon_code': (order.get('code') or '').strip().upper(),
+            'user_id': order.get('user_id'),
+            'action': 'apply',
+            'success': result['success'],
+            'error_message': None if result['success'] else result['message'],
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'timestamp': now
+        } for order, result in zip(orders, results) if 'error' not in order]
+        if logs:
+            connection.execute(insert(CouponUsageLog.__table__), logs)
+        db.session.commit()
+
+        if redemptions:
+            coupon_ids = {r['coupon_id'] for r in redemptions}
+            usage_counters.refresh(coupon_ids)
+            user_eligibility.invalidate_users({r['user_id'] for r in redemptions})
+            validation_memo.invalidate(coupon_ids)
+            flash_sale.invalidate(coupon_ids)
+        return results
+
+    def _load_coupons(self, pending):
+        """Active coupons by code, their (redemptions, used) counts and used counts per (coupon, user)"""
+        codes = {code for _, _, code, _ in pending}
+        if not codes:
+            return {}, {}, {}
+        coupons = {coupon.code: coupon for coupon in Coupon.query.filter(
+            Coupon.code.in_(codes), Coupon.is_active == True
+        )}
+        coupon_ids = [coupon.id for coupon in coupons.values()]
+        if not coupon_ids:
+            return coupons, {}, {}
+
+        counts = {coupon_id: (total, used_count) for coupon_id, total, used_count in db.session.execute(
+            redemption_totals(coupon_ids)
+        )}
+        user_ids = {user_id for _, _, _, user_id in pending}
+        user_counts = Counter()
+        for table in (CouponRedemption.__table__, ArchivedRedemption.__table__):
+            for coupon_id, user_id, used_count in db.session.execute(
+                select(table.c.coupon_id, table.c.user_id, db.func.count(table.c.id))
+                .where(table.c.coupon_id.in_(coupon_ids), table.c.user_id.in_(user_ids), table.c.is_used == True)
+                .group_by(table.c.coupon_id, table.c.user_id)
+            ):
+                user_counts[coupon_id, user_id] += used_count
+        return coupons, counts, user_counts
+
+def main(argv):
+    if len(argv) != 2:
+        print(__doc__)
+        return 1
+    from app import create_app
+
+    app = create_app()
+    stream = sys.stdin if argv[1] == '-' else open(argv[1], encoding='utf-8')
+    applied = failed = 0
+    started = time.perf_counter()
+    with app.app_context():
+        applier = app.extensions['bulk_applier']
+        try:
+            for result in applier.apply(parse_orders(stream), user_agent='bulk_apply.py'):
+                print(json.dumps(result))
+                if result['success']:
+                    applied += 1
+                else:
+                    failed += 1
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+    elapsed = time.perf_counter() - started
+    print(f'Applied {applied}, failed {failed} in {elapsed:.2f}s '
+          f'({(applied + failed) / elapsed:.0f} orders/s)', file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,173 @@
+from datetime import datetime, timedelta
+import logging
+import os
+import socket
+import threading
+import time
+from sqlalchemy import event, insert, delete, select
+from sqlalchemy.orm import Session
+
+from models import db, Coupon, CouponRedemption, Product, CacheChange
+from tenancy import TenantScoped, current_tenant, tenant_context
+
+logger = logging.getLogger(__name__)
+
+def worker_origin():
+    """Identifies this worker process in the change log"""
+    # Computed per call so forked workers do not inherit their parent's id
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+class CacheSync:
+    """Cache invalidation between worker processes through a change-log table
+
+    Writes to coupons, products and redemptions add rows to ``cache_changes``
+    in the same transaction as the change. Every worker keeps a cursor (the
+    last change id it has seen) and, at the start of a request and at most
+    every ``CACHE_SYNC_POLL_INTERVAL`` seconds, reads the rows past it and
+    hands the changed ids to the handlers subscribed for each kind. A
+    worker's own changes are skipped, since its session listeners have
+    already applied them locally.
+
+    A handler is called with a set of entity ids, or with None when the
+    worker cannot tell what changed (first poll, or the log was pruned past
+    its cursor) and must drop everything of that kind.
+
+    Each tenant database has its own log, read by that tenant's instance
+    while serving the tenant. Product changes always go to the main
+    database's log, which is read on every request.
+    """
+
+    def __init__(self, app=None, handlers=None):
+        self.poll_interval = 0.5
+        self.retention = 3600
+        self.batch_size = 1000
+        self.tenant = None
+        self._handlers = {} if handlers is None else handlers  # kind -> [callable]
+        self._cursor = None
+        self._polled_at = None
+        self._pruned_at = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.poll_interval = app.config.get('CACHE_SYNC_POLL_INTERVAL', self.poll_interval)
+        self.retention = app.config.get('CACHE_SYNC_RETENTION', self.retention)
+        app.extensions['cache_sync'] = self
+        app.before_request(self.maybe_poll)
+
+    def subscribe(self, kind, handler):
+        """Call ``handler(ids)`` when another worker changes entities of a kind"""
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def publish(self, connection, changes):
+        """Record (kind, entity_id) changes on the caller's transaction"""
+        if not changes:
+            return
+        origin = worker_origin()
+        now = datetime.utcnow()
+        connection.execute(insert(CacheChange.__table__), [
+            {'kind': kind, 'entity_id': entity_id, 'origin': origin, 'created_at': now}
+            for kind, entity_id in changes
+        ])
+
+    def maybe_poll(self):
+        tenant = current_tenant()
+        if self.tenant != tenant:
+            if self.tenant is None:
+                # The main log carries product changes for every tenant
+                with tenant_context(None):
+                    self._maybe_poll()
+            return
+        self._maybe_poll()
+
+    def _maybe_poll(self):
+        polled_at = self._polled_at
+        if polled_at is not None and time.monotonic() - polled_at < self.poll_interval:
+            return
+        # One poll at a time; other threads serve from the current caches
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self.poll()
+        except Exception:
+            logger.exception('Cache sync poll failed')
+        finally:
+            self._lock.release()
+
+    def poll(self):
+        """Apply every change logged by other workers since the last poll"""
+        table = CacheChange.__table__
+        now = time.monotonic()
+
+        if self._cursor is None or now - self._polled_at > self.retention:
+            # Nothing to compare against: start from the end of the log and drop everything
+            self._cursor = db.session.execute(select(db.func.max(table.c.id))).scalar() or 0
+            self._polled_at = now
+            self._dispatch({kind: None for kind in self._handlers})
+            return 0
+
+        origin = worker_origin()
+        changed = {}
+        applied = 0
+        while True:
+            rows = db.session.execute(
+                select(table.c.id, table.c.kind, table.c.entity_id, table.c.origin)
+                .where(table.c.id > self._cursor)
+                .order_by(table.c.id)
+                .limit(self.batch_size)
+            ).all()
+            for change_id, kind, entity_id, change_origin in rows:
+                self._cursor = change_id
+                if change_origin != origin:
+                    changed.setdefault(kind, set()).add(entity_id)
+                    applied += 1
+            if len(rows) < self.batch_size:
+                break
+
+        self._polled_at = now
+        self._dispatch(changed)
+        if now - self._pruned_at > min(60, self.retention):
+            self.prune()
+        return applied
+
+    def prune(self):
+        """Delete log rows older than the retention period"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        db.session.execute(delete(CacheChange.__table__).where(CacheChange.__table__.c.created_at < cutoff))
+        db.session.commit()
+        self._pruned_at = time.monotonic()
+
+    def _dispatch(self, changed):
+        for kind, ids in changed.items():
+            for handler in self._handlers.get(kind, ()):
+                handler(ids)
+
+# Shared by every tenant's instance; handlers resolve the tenant when called
+_handlers = {}
+
+cache_sync = TenantScoped(lambda: CacheSync(handlers=_handlers))
+
+def _logged_changes(session):
+    changes = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Coupon):
+            changes.add(('coupon', obj.id))
+        elif isinstance(obj, Product):
+            changes.add(('product', obj.id))
+        elif isinstance(obj, CouponRedemption):
+            changes.add(('redemption', obj.coupon_id))
+            changes.add(('user_redemption', obj.user_id))
+    return changes
+
+@event.listens_for(Session, 'after_flush')
+def _log_changes(session, flush_context):
+    changes = _logged_changes(session)
+    products = sorted(change for change in changes if change[0] == 'product')
+    if products:
+        # Logged in the main database, next to the products
+        connection = session.connection(bind_arguments={'clause': Product.__table__})
+        cache_sync.publish(connection, products)
+    others = sorted(changes.difference(products))
+    if others:
+        cache_sync.publish(session.connection(), others)
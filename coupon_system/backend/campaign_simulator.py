@@ -0,0 +1,225 @@
+"""
+Estimate what a draft coupon campaign would cost by replaying history
+
+Streams past orders from ``coupon_redemptions`` and its archive in id
+order, in fixed-size keyset-paginated chunks, and runs each one through a
+draft coupon's minimum-purchase, discount, global usage limit and per-user
+limit rules. Memory grows with the number of distinct users, never with the
+number of orders.
+
+Redemptions only store order totals, not cart lines, so theme/category/
+product restrictions cannot be checked and BOGO discounts cannot be priced;
+the report says so when the draft uses them.
+
+Usage:
+    python campaign_simulator.py draft_coupon.json --days 365
+
+where draft_coupon.json holds Coupon fields, for example:
+    {"code": "SUMMER25", "name": "Summer", "coupon_type": "PERCENTAGE",
+     "discount_value": 25, "max_discount_amount": 500,
+     "min_purchase_amount": 1000, "usage_limit": 1000,
+     "usage_limit_per_user": 1,
+     "valid_from": "2025-06-01T00:00:00", "valid_until": "2025-06-08T00:00:00"}
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+import argparse
+import heapq
+import json
+from operator import attrgetter
+import sys
+from sqlalchemy import select
+
+from models import db, Coupon, CouponRedemption, ArchivedRedemption, CouponUsageLog, CouponType
+from coupon_service import CouponService
+
+def build_draft_coupon(definition):
+    """Create an unsaved Coupon from a dict of its fields"""
+    fields = dict(definition)
+    coupon_type = fields['coupon_type']
+    fields['coupon_type'] = CouponType.__members__.get(coupon_type) or CouponType(coupon_type)
+    for key in ('valid_from', 'valid_until'):
+        if isinstance(fields.get(key), str):
+            fields[key] = datetime.fromisoformat(fields[key])
+    for key in ('applicable_themes', 'applicable_categories', 'applicable_product_ids'):
+        if isinstance(fields.get(key), list):
+            fields[key] = json.dumps(fields[key])
+    fields.setdefault('usage_limit_per_user', 1)
+    fields.setdefault('min_purchase_amount', 0)
+    return Coupon(**fields)
+
+def stream_orders(since, until, chunk_size=5000):
+    """Yield (user_id, original_amount, created_at) rows in id order, one chunk at a time
+
+    The live and archived redemption tiers are read side by side and merged by id.
+    """
+    tiers = [_stream_tier(table, since, until, chunk_size)
+             for table in (CouponRedemption.__table__, ArchivedRedemption.__table__)]
+    for row in heapq.merge(*tiers, key=attrgetter('id')):
+        yield row.user_id, row.original_amount, row.created_at
+
+def _stream_tier(table, since, until, chunk_size):
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.user_id, table.c.original_amount, table.c.created_at)
+            .where(table.c.id > last_id,
+                   table.c.created_at >= since,
+                   table.c.created_at < until)
+            .order_by(table.c.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+class CampaignSimulator:
+    """Replays orders against a draft coupon and accumulates the outcome
+
+    When the draft has both ``valid_from`` and ``valid_until``, history is cut
+    into back-to-back windows of that length and usage limits reset at each
+    window, so the report shows how often a campaign of that length would
+    have run out.
+    """
+
+    def __init__(self, coupon, service=None):
+        self.coupon = coupon
+        self.service = service or CouponService()
+        self.window = None
+        if coupon.valid_from and coupon.valid_until:
+            self.window = coupon.valid_until - coupon.valid_from
+
+        self.orders_seen = 0
+        self.redemptions = 0
+        self.total_discount = 0.0
+        self.below_minimum = 0
+        self.refused_usage_limit = 0
+        self.refused_user_limit = 0
+        self.windows = 0
+        self.windows_limit_hit = 0
+        self.user_redemptions = Counter()
+
+        self._window_end = None
+        self._window_count = 0
+        self._window_users = Counter()
+        self._window_limit_hit = False
+
+    def feed(self, user_id, original_amount, created_at):
+        """Replay one historical order"""
+        self.orders_seen += 1
+        self._advance_window(created_at)
+        coupon = self.coupon
+
+        if coupon.min_purchase_amount and original_amount < coupon.min_purchase_amount:
+            self.below_minimum += 1
+            return
+        if coupon.usage_limit and self._window_count >= coupon.usage_limit:
+            self.refused_usage_limit += 1
+            if not self._window_limit_hit:
+                self._window_limit_hit = True
+                self.windows_limit_hit += 1
+            return
+        if not coupon.has_uses_left(self._window_users[user_id]):
+            self.refused_user_limit += 1
+            return
+
+        discount = self.service._calculate_discount(coupon, [], original_amount)['discount_amount']
+        self.total_discount += discount
+        self.redemptions += 1
+        self._window_count += 1
+        self._window_users[user_id] += 1
+        self.user_redemptions[user_id] += 1
+
+    def _advance_window(self, created_at):
+        if self._window_end is None:
+            self.windows = 1
+            self._window_end = created_at + self.window if self.window else None
+            return
+        if self._window_end is None or created_at < self._window_end:
+            return
+        while created_at >= self._window_end:
+            self._window_end += self.window
+            self.windows += 1
+        self._window_count = 0
+        self._window_users = Counter()
+        self._window_limit_hit = False
+
+    def report(self):
+        """Summarize the replay as a dict"""
+        distribution = Counter(self.user_redemptions.values())
+        warnings = []
+        if any([self.coupon.applicable_themes, self.coupon.applicable_categories,
+                self.coupon.applicable_product_ids]):
+            warnings.append('Theme/category/product restrictions ignored: order lines are not stored')
+        if self.coupon.coupon_type == CouponType.BUY_ONE_GET_ONE:
+            warnings.append('BOGO discounts need order lines and are reported as 0')
+
+        return {
+            'orders_replayed': self.orders_seen,
+            'estimated_redemptions': self.redemptions,
+            'estimated_total_discount': round(self.total_discount, 2),
+            'average_discount': round(self.total_discount / self.redemptions, 2) if self.redemptions else 0,
+            'unique_users': len(self.user_redemptions),
+            'orders_below_minimum': self.below_minimum,
+            'orders_refused_usage_limit': self.refused_usage_limit,
+            'orders_refused_user_limit': self.refused_user_limit,
+            'campaign_windows': self.windows,
+            'windows_usage_limit_hit': self.windows_limit_hit,
+            'users_by_redemption_count': {str(k): v for k, v in sorted(distribution.items())},
+            'warnings': warnings
+        }
+
+def count_engaged_users(since, until):
+    """Distinct users who validated or applied any coupon in the period"""
+    return db.session.query(db.func.count(db.distinct(CouponUsageLog.user_id))).filter(
+        CouponUsageLog.user_id.isnot(None),
+        CouponUsageLog.timestamp >= since,
+        CouponUsageLog.timestamp < until
+    ).scalar() or 0
+
+def simulate_campaign(definition, days=365, chunk_size=5000, until=None):
+    """
+    Replay the last ``days`` of orders against a draft coupon definition
+
+    Args:
+        definition (dict): Coupon fields for the draft campaign
+        days (int): How much history to replay
+        chunk_size (int): Orders fetched per query
+
+    Returns:
+        dict: Simulation report
+    """
+    until = until or datetime.utcnow()
+    since = until - timedelta(days=days)
+    simulator = CampaignSimulator(build_draft_coupon(definition))
+    for user_id, original_amount, created_at in stream_orders(since, until, chunk_size):
+        simulator.feed(user_id, original_amount, created_at)
+
+    report = simulator.report()
+    report['period'] = {'from': since.isoformat(), 'until': until.isoformat()}
+    report['engaged_users'] = count_engaged_users(since, until)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate a draft coupon campaign against past orders')
+    parser.add_argument('definition', help='JSON file with the draft coupon fields')
+    parser.add_argument('--days', type=int, default=365, help='Days of history to replay')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='Orders fetched per query')
+    args = parser.parse_args(argv)
+
+    with open(args.definition) as f:
+        definition = json.load(f)
+
+    from app import create_app
+
+    app = create_app()
+
+    with app.app_context():
+        report = simulate_campaign(definition, args.days, args.chunk_size)
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+from array import array
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import Product
+from read_models import load_products
+
+class CatalogueSnapshot:
+    """Immutable, array-backed copy of the product catalogue
+
+    Prices and ids live in typed arrays, the active flags in a bytes object,
+    and per-theme / per-category position lists are precomputed, so filters
+    and lookups are plain memory reads. A snapshot never changes after it is
+    built; readers that hold one see a consistent catalogue at ``version``.
+    """
+
+    def __init__(self, records, version):
+        self.version = version
+        self.records = tuple(records)
+        self.ids = array('q', (r.id for r in self.records))
+        self.prices = array('d', (r.price for r in self.records))
+        self.active = bytes(1 if r.is_active else 0 for r in self.records)
+        self._positions = {product_id: pos for pos, product_id in enumerate(self.ids)}
+
+        by_theme = {}
+        by_category = {}
+        for pos, record in enumerate(self.records):
+            by_theme.setdefault(record.theme, []).append(pos)
+            by_category.setdefault(record.category, []).append(pos)
+        self._by_theme = {k: tuple(v) for k, v in by_theme.items()}
+        self._by_category = {k: tuple(v) for k, v in by_category.items()}
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, product_id):
+        """Return the product record for an id, or None"""
+        try:
+            pos = self._positions.get(int(product_id))
+        except (TypeError, ValueError):
+            return None
+        return None if pos is None else self.records[pos]
+
+    def filter(self, theme=None, category=None, active_only=True):
+        """Return records matching an optional theme and category, in id order"""
+        if theme is not None and category is not None:
+            wanted = set(self._by_category.get(category, ()))
+            positions = [p for p in self._by_theme.get(theme, ()) if p in wanted]
+        elif theme is not None:
+            positions = self._by_theme.get(theme, ())
+        elif category is not None:
+            positions = self._by_category.get(category, ())
+        else:
+            positions = range(len(self.records))
+
+        active = self.active
+        return [self.records[p] for p in positions if active[p] or not active_only]
+
+class CatalogueStore:
+    """Holds the current catalogue snapshot and swaps in new ones
+
+    Committed product changes mark the store stale and the next reader builds
+    a replacement; the swap is a single reference assignment, so readers see
+    either the old snapshot or the new one, never a mix. A refresh interval
+    also picks up changes made by other processes.
+
+    When a shared store is mapped, its product table is served instead and
+    the database snapshot is only the fallback.
+    """
+
+    def __init__(self, app=None):
+        self.refresh_interval = 60
+        self._snapshot = None
+        self._loaded_at = 0
+        self._stale = True
+        self._version = 0
+        self._lock = threading.Lock()
+        self.shared_store = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.refresh_interval = app.config.get('CATALOGUE_REFRESH_INTERVAL', self.refresh_interval)
+        self.shared_store = app.extensions.get('shared_store')
+        app.extensions['catalogue'] = self
+
+    def snapshot(self):
+        """Return the current snapshot, rebuilding it first if it is stale"""
+        if self.shared_store is not None:
+            view = self.shared_store.current()
+            if view is not None:
+                return view.products
+        current = self._snapshot
+        if self._needs_reload(current):
+            with self._lock:
+                # Another thread may have rebuilt it while we waited
+                current = self._snapshot
+                if self._needs_reload(current):
+                    current = self._build()
+        return current
+
+    def get(self, product_id):
+        return self.snapshot().get(product_id)
+
+    def reload(self):
+        """Build a fresh snapshot from the database and swap it in"""
+        with self._lock:
+            return self._build()
+
+    def _needs_reload(self, current):
+        return current is None or self._stale or time.monotonic() - self._loaded_at > self.refresh_interval
+
+    def _build(self):
+        # Clear first so a change committed during the load marks it stale again
+        self._stale = False
+        records = load_products()
+        self._version += 1
+        fresh = CatalogueSnapshot(records, self._version)
+        self._snapshot = fresh
+        self._loaded_at = time.monotonic()
+        return fresh
+
+    def invalidate(self):
+        """Mark the snapshot stale so the next read rebuilds it"""
+        self._stale = True
+
+catalogue = CatalogueStore()
+
+@event.listens_for(Session, 'after_flush')
+def _note_product_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Product):
+            session.info['catalogue_changed'] = True
+            return
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_catalogue(session):
+    if session.info.pop('catalogue_changed', False):
+        catalogue.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_product_changes(session):
+    session.info.pop('catalogue_changed', None)
@@ -0,0 +1,125 @@
+"""
+Multi-process cache coherence check
+
+Starts several worker processes against a scratch database, each with its
+own in-process caches warmed through the API. The parent process then
+renames a coupon and a product and records a redemption, and every worker
+keeps reading the API until it serves the new values. The check fails if any
+worker still serves stale data after the timeout; the refresh intervals are
+set far above it, so only the change log can make the workers converge.
+
+Usage:
+    python check_cache_sync.py --workers 4 --timeout 10
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+def worker(ready, results, coupon_id, product_id, expected, timeout):
+    from app import create_app
+
+    app = create_app()
+
+    client = app.test_client()
+
+    def observe():
+        coupons = client.get('/api/coupons').get_json()['coupons']
+        coupon = next((c for c in coupons if c['id'] == coupon_id), None)
+        product = client.get(f'/api/products/{product_id}').get_json()['product']
+        return (coupon and coupon['name'], coupon and coupon['usage_count'], product['name'])
+
+    warm = observe()
+    ready.put(warm)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        seen = observe()
+        if seen == expected:
+            results.put((os.getpid(), time.time(), seen))
+            return
+        time.sleep(0.01)
+    results.put((os.getpid(), None, observe()))
+
+def run(workers, timeout):
+    from app import create_app
+
+    app = create_app()
+    from models import db, User, Product, Coupon, CouponRedemption, ThemeType, ProductCategory, CouponType
+    from migrations import upgrade
+    from datetime import datetime, timedelta
+
+    with app.app_context():
+        upgrade()
+        user = User(username='sync', email='sync@example.com', password_hash='x')
+        product = Product(name='Before', category=ProductCategory.KEYCHAIN, theme=ThemeType.OTHER,
+                          price=100.0, stock_quantity=10)
+        coupon = Coupon(code='SYNC10', name='Before', coupon_type=CouponType.PERCENTAGE,
+                        discount_value=10, valid_from=datetime.utcnow() - timedelta(days=1),
+                        valid_until=datetime.utcnow() + timedelta(days=1), usage_limit=100)
+        db.session.add_all([user, product, coupon])
+        db.session.commit()
+        ids = (coupon.id, product.id, user.id)
+
+    context = multiprocessing.get_context('spawn')
+    ready, results = context.Queue(), context.Queue()
+    expected = ('After', 1, 'After')
+    processes = [context.Process(target=worker, args=(ready, results, ids[0], ids[1], expected, timeout))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        warm = ready.get(timeout=60)
+        if warm != ('Before', 0, 'Before'):
+            print(f'FAILED: worker warmed with unexpected data {warm}')
+            return 1
+
+    with app.app_context():
+        db.session.get(Coupon, ids[0]).name = 'After'
+        db.session.get(Product, ids[1]).name = 'After'
+        db.session.add(CouponRedemption(coupon_id=ids[0], user_id=ids[2], discount_applied=10,
+                                        original_amount=100, final_amount=90, is_used=True,
+                                        used_at=datetime.utcnow()))
+        db.session.commit()
+    changed_at = time.time()
+
+    outcomes = [results.get(timeout=timeout + 60) for _ in processes]
+    for process in processes:
+        process.join()
+
+    stale = [(pid, seen) for pid, converged_at, seen in outcomes if converged_at is None]
+    for pid, converged_at, seen in outcomes:
+        if converged_at is not None:
+            print(f'Worker {pid}: converged in {(converged_at - changed_at) * 1000:.0f} ms')
+    if stale:
+        for pid, seen in stale:
+            print(f'FAILED: worker {pid} still serves {seen}')
+        return 1
+    print(f'OK: all {workers} workers served the change')
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Multi-process cache coherence check')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--timeout', type=float, default=10, help='Seconds a worker may serve stale data')
+    args = parser.parse_args(argv)
+
+    # Never run against the real database; keep every other refresh path out of reach
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    os.environ['CACHE_SYNC_POLL_INTERVAL'] = '0.05'
+    refresh = str(int(args.timeout * 100))
+    for name in ('CATALOGUE_REFRESH_INTERVAL', 'USAGE_COUNTERS_REFRESH_INTERVAL',
+                 'SERIALIZATION_CACHE_TTL', 'VALIDITY_SCHEDULE_REFRESH_INTERVAL'):
+        os.environ[name] = refresh
+    os.environ['COUPON_EXPIRY_JOB_INTERVAL'] = '0'
+    try:
+        return run(args.workers, args.timeout)
+    finally:
+        os.unlink(scratch.name)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Redemption feed cursor check
+
+Records redemptions on a scratch database, lets a consumer acknowledge all
+of their events and compacts the feed, which deletes every event. It then
+records another redemption and fails unless the consumer, reading past its
+acknowledged cursor, sees the new event.
+
+Usage:
+    python check_redemption_feed.py --events 3
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+def run(events):
+    from app import create_app
+
+    app = create_app()
+    from models import db, User, Coupon, CouponRedemption, CouponType
+    from migrations import upgrade
+    from redemption_feed import redemption_feed
+
+    def redeem(coupon_id, user_id, order_id):
+        db.session.add(CouponRedemption(coupon_id=coupon_id, user_id=user_id, order_id=order_id,
+                                        discount_applied=10, original_amount=100, final_amount=90))
+        db.session.commit()
+
+    with app.app_context():
+        upgrade()
+        user = User(username='feed', email='feed@example.com', password_hash='x')
+        coupon = Coupon(code='FEED10', name='Feed', coupon_type=CouponType.PERCENTAGE, discount_value=10)
+        db.session.add_all([user, coupon])
+        db.session.commit()
+
+        redemption_feed.register('check')
+        for number in range(events):
+            redeem(coupon.id, user.id, f'before-{number}')
+        cursor = redemption_feed.read(0)[-1].id
+        redemption_feed.acknowledge('check', cursor)
+        compacted = redemption_feed.compact()
+        print(f'Acknowledged cursor {cursor}, compacted {compacted} events')
+
+        redeem(coupon.id, user.id, 'after')
+        seen = redemption_feed.read(cursor)
+        if [row.order_id for row in seen] != ['after']:
+            print(f'FAILED: reading past cursor {cursor} returned {[(row.id, row.order_id) for row in seen]}')
+            return 1
+        print(f'OK: the event recorded after compaction has id {seen[0].id}, past cursor {cursor}')
+        return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Redemption feed cursor check')
+    parser.add_argument('--events', type=int, default=3, help='Events acknowledged and compacted first')
+    args = parser.parse_args(argv)
+
+    # Never run against the real database
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    try:
+        return run(args.events)
+    finally:
+        os.unlink(scratch.name)
+
+if __name__ == '__main__':
+    sys.exit(main())
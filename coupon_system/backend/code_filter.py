@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event
+
+from models import db, Coupon
+from tenancy import TenantScoped, tenant_context
+
+logger = logging.getLogger(__name__)
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings
+
+    Answers "definitely absent" or "possibly present". Sized for the
+    expected number of items and false-positive rate, so a million codes at
+    1% costs about 1.2 MB of memory.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.num_bits = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+class CouponCodeFilter:
+    """Membership filter over every coupon code in the database
+
+    Built from the ``coupons`` table on a background thread and swapped in
+    whole once complete. Codes created through the app are added as they
+    are inserted, by this worker's listeners or, for other workers and
+    scripts, through cache sync. Coupons written to the database some other
+    way only reach the filter when it is rebuilt, so a filter older than
+    ``COUPON_FILTER_REBUILD_INTERVAL`` seconds (or grown past its sized
+    capacity) no longer rejects codes: lookups go to the database while a
+    fresh one is built. Request threads never scan the table.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.error_rate = 0.01
+        self.rebuild_interval = 300
+        self._filter = None
+        self._built_at = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('COUPON_FILTER_ENABLED', True)
+        self.error_rate = app.config.get('COUPON_FILTER_ERROR_RATE', self.error_rate)
+        self.rebuild_interval = app.config.get('COUPON_FILTER_REBUILD_INTERVAL', self.rebuild_interval)
+        app.extensions['coupon_code_filter'] = self
+
+    def might_exist(self, code):
+        """Return False only when the code is certainly not a coupon code"""
+        if not self.enabled:
+            return True
+        current = self._filter
+        if current is None or self._is_stale(current):
+            # May lack codes written outside the app; let the database answer until rebuilt
+            self._start_build(current_app._get_current_object())
+            return True
+        return code in current
+
+    def add(self, code):
+        """Record a newly created code"""
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(code)
+            if self._pending is not None:
+                self._pending.append(code)
+
+    def invalidate(self):
+        """Rebuild on next use"""
+        self._built_at = float('-inf')
+
+    def rebuild(self):
+        """Reload all codes from the database and swap in a fresh filter"""
+        with self._rebuild_lock:
+            return self._build()
+
+    def _start_build(self, app):
+        # One build at a time; the thread releases the lock when it is done
+        if not self._rebuild_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                with tenant_context(self.tenant, app):
+                    current = self._filter
+                    # Skip if rebuilt since the caller saw it stale
+                    if current is None or self._is_stale(current):
+                        self._build()
+            except Exception:
+                logger.exception('Coupon code filter rebuild failed')
+            finally:
+                self._rebuild_lock.release()
+
+        try:
+            threading.Thread(target=run, name='coupon-code-filter', daemon=True).start()
+        except Exception:
+            self._rebuild_lock.release()
+            raise
+
+    def _build(self):
+        # Callers hold the rebuild lock, so only one build owns the pending list
+        with self._lock:
+            # Codes inserted while we scan are replayed onto the new filter
+            self._pending = []
+
+        try:
+            total = db.session.query(db.func.count(Coupon.id)).scalar() or 0
+            fresh = BloomFilter(max(1024, total * 2), self.error_rate)
+            for (code,) in db.session.query(Coupon.code).yield_per(10000):
+                fresh.add(code)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            for code in self._pending:
+                fresh.add(code)
+            self._pending = None
+            self._filter = fresh
+            self._built_at = time.monotonic()
+        return fresh
+
+    def _is_stale(self, current):
+        if time.monotonic() - self._built_at > self.rebuild_interval:
+            return True
+        # Sized for twice the codes at build time; past that the error rate climbs
+        capacity = current.num_bits * (math.log(2) ** 2) / -math.log(self.error_rate)
+        return current.count > capacity
+
+coupon_code_filter = TenantScoped(CouponCodeFilter)
+
+@event.listens_for(Coupon, 'after_insert')
+@event.listens_for(Coupon, 'after_update')
+def _track_coupon_code(mapper, connection, target):
+    # A rolled-back insert only leaves a harmless false positive behind
+    coupon_code_filter.add(target.code)
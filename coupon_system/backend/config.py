@@ -0,0 +1,59 @@
+from datetime import timedelta
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def configure(app):
+    """Load settings from the environment into the app config"""
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///coupon_system.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-string')
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    app.config['PASSWORD_HASH_QUEUE_LIMIT'] = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', 32))
+    app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+    app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+    app.config['RATE_LIMIT_WINDOW'] = int(os.environ.get('RATE_LIMIT_WINDOW', 60))
+    app.config['RATE_LIMIT_VALIDATE_PER_IP'] = int(os.environ.get('RATE_LIMIT_VALIDATE_PER_IP', 60))
+    app.config['RATE_LIMIT_VALIDATE_PER_USER'] = int(os.environ.get('RATE_LIMIT_VALIDATE_PER_USER', 30))
+    app.config['RATE_LIMIT_REDIS_URL'] = os.environ.get('RATE_LIMIT_REDIS_URL')
+    app.config['COUPON_FILTER_ENABLED'] = os.environ.get('COUPON_FILTER_ENABLED', 'True').lower() == 'true'
+    app.config['COUPON_FILTER_REBUILD_INTERVAL'] = int(os.environ.get('COUPON_FILTER_REBUILD_INTERVAL', 300))
+    app.config['ASYNC_DB_CONCURRENCY'] = int(os.environ.get('ASYNC_DB_CONCURRENCY', 32))
+    app.config['ASYNC_DB_ACQUIRE_TIMEOUT'] = float(os.environ.get('ASYNC_DB_ACQUIRE_TIMEOUT', 5))
+    app.config['STOCK_RESERVATION_TTL'] = int(os.environ.get('STOCK_RESERVATION_TTL', 900))
+    app.config['STOCK_SWEEP_INTERVAL'] = int(os.environ.get('STOCK_SWEEP_INTERVAL', 30))
+    app.config['CATALOGUE_REFRESH_INTERVAL'] = int(os.environ.get('CATALOGUE_REFRESH_INTERVAL', 60))
+    app.config['USAGE_COUNTERS_REFRESH_INTERVAL'] = int(os.environ.get('USAGE_COUNTERS_REFRESH_INTERVAL', 60))
+    app.config['SERIALIZATION_CACHE_TTL'] = int(os.environ.get('SERIALIZATION_CACHE_TTL', 300))
+    app.config['VALIDITY_SCHEDULE_REFRESH_INTERVAL'] = int(os.environ.get('VALIDITY_SCHEDULE_REFRESH_INTERVAL', 60))
+    app.config['COUPON_EXPIRY_JOB_INTERVAL'] = int(os.environ.get('COUPON_EXPIRY_JOB_INTERVAL', 60))
+    app.config['VALIDATION_MEMO_TTL'] = float(os.environ.get('VALIDATION_MEMO_TTL', 2.0))
+    app.config['VALIDATION_MEMO_MAX_ENTRIES'] = int(os.environ.get('VALIDATION_MEMO_MAX_ENTRIES', 10000))
+    app.config['FLASH_SALE_CODES'] = os.environ.get('FLASH_SALE_CODES', '')
+    app.config['FLASH_SALE_RECONCILE_INTERVAL'] = float(os.environ.get('FLASH_SALE_RECONCILE_INTERVAL', 5))
+    app.config['USAGE_STRIPES_MAX'] = int(os.environ.get('USAGE_STRIPES_MAX', 8))
+    app.config['USAGE_STRIPES_HOT_RATE'] = int(os.environ.get('USAGE_STRIPES_HOT_RATE', 20))
+    app.config['REDEMPTION_FEED_TOKEN'] = os.environ.get('REDEMPTION_FEED_TOKEN')
+    app.config['REDEMPTION_FEED_BATCH_SIZE'] = int(os.environ.get('REDEMPTION_FEED_BATCH_SIZE', 500))
+    app.config['REDEMPTION_FEED_MAX_BATCH_SIZE'] = int(os.environ.get('REDEMPTION_FEED_MAX_BATCH_SIZE', 5000))
+    app.config['REDEMPTION_ARCHIVE_AGE_DAYS'] = int(os.environ.get('REDEMPTION_ARCHIVE_AGE_DAYS', 90))
+    app.config['REDEMPTION_ARCHIVE_BATCH_SIZE'] = int(os.environ.get('REDEMPTION_ARCHIVE_BATCH_SIZE', 5000))
+    app.config['BULK_APPLY_TOKEN'] = os.environ.get('BULK_APPLY_TOKEN')
+    app.config['BULK_APPLY_CHUNK_SIZE'] = int(os.environ.get('BULK_APPLY_CHUNK_SIZE', 1000))
+    app.config['PRODUCT_SEARCH_PAGE_SIZE'] = int(os.environ.get('PRODUCT_SEARCH_PAGE_SIZE', 20))
+    app.config['PRODUCT_SEARCH_MAX_PAGE_SIZE'] = int(os.environ.get('PRODUCT_SEARCH_MAX_PAGE_SIZE', 100))
+    app.config['BATCH_MAX_REQUESTS'] = int(os.environ.get('BATCH_MAX_REQUESTS', 20))
+    app.config['BATCH_MAX_WORKERS'] = int(os.environ.get('BATCH_MAX_WORKERS', 4))
+    app.config['USER_ELIGIBILITY_TTL'] = int(os.environ.get('USER_ELIGIBILITY_TTL', 300))
+    app.config['USER_ELIGIBILITY_MAX_USERS'] = int(os.environ.get('USER_ELIGIBILITY_MAX_USERS', 10000))
+    app.config['CACHE_SYNC_POLL_INTERVAL'] = float(os.environ.get('CACHE_SYNC_POLL_INTERVAL', 0.5))
+    app.config['CACHE_SYNC_RETENTION'] = int(os.environ.get('CACHE_SYNC_RETENTION', 3600))
+    app.config['TENANT_DATABASES'] = os.environ.get('TENANT_DATABASES', '')
+    app.config['TENANT_HEADER'] = os.environ.get('TENANT_HEADER', 'X-Tenant')
+    app.config['DEFAULT_TENANT'] = os.environ.get('DEFAULT_TENANT')
+    app.config['SHARED_STORE_PATH'] = os.environ.get('SHARED_STORE_PATH')
+    app.config['SHARED_STORE_CHECK_INTERVAL'] = float(os.environ.get('SHARED_STORE_CHECK_INTERVAL', 1.0))
+    app.config['WARM_CACHES'] = os.environ.get('WARM_CACHES', 'False').lower() == 'true'
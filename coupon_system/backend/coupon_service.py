@@ -2,10 +2,79 @@ from datetime import datetime
 import json
 from models import db, Coupon, CouponRedemption, Product, User
 from models import CouponType, ThemeType, ProductCategory
+from validation_memo import cart_key
+from read_models import find_active_coupon
+from redemption_archive import archived_count_columns
+from tenancy import current_tenant
+
+class LoadedCoupon:
+    """Coupon row with its redemption counts loaded up front
+
+    The model counts redemptions by walking a lazy relationship. This wrapper
+    answers the same questions from counts fetched in one aggregate query, and
+    can take the live/not-live answer from the validity schedule instead of
+    the row's dates.
+    """
+
+    def __init__(self, coupon, redemption_count=0, usage_count=0, user_usage_count=0, live=None):
+        self._coupon = coupon
+        self.redemption_count = redemption_count
+        self.usage_count = usage_count
+        self.user_usage_count = user_usage_count
+        self.live = live
+
+    def __getattr__(self, name):
+        return getattr(self._coupon, name)
+
+    @property
+    def is_valid(self):
+        live = self.live if self.live is not None else self._coupon.is_live()
+        return live and not self._coupon.is_exhausted(self.redemption_count)
+
+    def get_usage_count(self):
+        return self.usage_count
+
+    def can_user_use(self, user_id):
+        if not self.is_valid:
+            return False
+        return self._coupon.has_uses_left(self.user_usage_count)
+
+def redemption_count_columns(user_id=None):
+    """Aggregates for LoadedCoupon: (redemptions, used, used by this user)"""
+    used = CouponRedemption.is_used == True
+    return (
+        db.func.count(CouponRedemption.id),
+        db.func.coalesce(db.func.sum(db.case((used, 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case((used & (CouponRedemption.user_id == user_id), 1), else_=0)), 0)
+    )
+
+def redemption_count_statement(coupon_id, user_id=None):
+    """One row of LoadedCoupon counts for a coupon, archived redemptions included"""
+    return db.select(*(
+        recent + archived for recent, archived in zip(
+            redemption_count_columns(user_id), archived_count_columns(coupon_id, user_id)
+        )
+    )).where(CouponRedemption.coupon_id == coupon_id)
 
 class CouponService:
     """Service class for handling coupon operations"""
     
+    # Flat shipping cost discounted by FREE_SHIPPING coupons (₹100)
+    FREE_SHIPPING_COST = 100.0
+    
+    def __init__(self, catalogue=None, validity_schedule=None, shared_store=None, validation_memo=None,
+                 usage_stripes=None):
+        # In-memory product snapshot used instead of per-item ORM lookups
+        self.catalogue = catalogue
+        # Set of live coupon ids used instead of per-request date checks
+        self.validity_schedule = validity_schedule
+        # Memory-mapped coupon definitions used instead of the coupon query
+        self.shared_store = shared_store
+        # Coalesces identical concurrent validations and keeps results briefly
+        self.validation_memo = validation_memo
+        # Striped counters that enforce usage limits atomically with the redemption
+        self.usage_stripes = usage_stripes
+    
     def validate_coupon(self, coupon_code, user_id=None, cart_items=None):
         """
         Validate a coupon code against cart items
@@ -16,17 +85,48 @@ class CouponService:
             cart_items (list, optional): List of cart items with product_id, quantity, price
             
         Returns:
-            dict: Validation result with status and details
+            dict: Validation result with status and details (shared between
+                identical requests when a validation memo is set; do not modify)
         """
         try:
-            # Find coupon
-            coupon = Coupon.query.filter_by(code=coupon_code, is_active=True).first()
-            if not coupon:
-                return {
-                    'valid': False,
-                    'message': 'Coupon code not found or inactive'
-                }
+            if self.validation_memo is None:
+                return self._validate_coupon(coupon_code, user_id, cart_items)[1]
+            return self.validation_memo.run(
+                (coupon_code, user_id, cart_key(cart_items)),
+                lambda: self._validate_coupon(coupon_code, user_id, cart_items)
+            )
             
+        except Exception as e:
+            return {
+                'valid': False,
+                'message': f'Error validating coupon: {str(e)}'
+            }
+    
+    def _validate_coupon(self, coupon_code, user_id=None, cart_items=None):
+        """Find and evaluate a coupon; returns (coupon id or None, result)"""
+        coupon = self._find_coupon(coupon_code)
+        if not coupon:
+            return None, {
+                'valid': False,
+                'message': 'Coupon code not found or inactive'
+            }
+        return coupon.id, self.evaluate_coupon(self._load_counts(coupon, user_id), user_id, cart_items)
+    
+    def evaluate_coupon(self, coupon, user_id=None, cart_items=None, get_product=None):
+        """
+        Run the validity, per-user and cart rules for an already loaded coupon
+        
+        Args:
+            coupon: A Coupon, or any object with Coupon's columns plus
+                is_valid, can_user_use() and get_usage_count()
+            user_id (int, optional): User ID for user-specific validations
+            cart_items (list, optional): List of cart items with product_id, quantity, price
+            get_product (callable, optional): Product lookup by id, defaults to the ORM
+            
+        Returns:
+            dict: Validation result with status and details
+        """
+        try:
             # Check basic validity
             if not coupon.is_valid:
                 return {
@@ -60,14 +160,14 @@ class CouponService:
                 }
             
             # Check product/theme/category restrictions
-            if not self._validate_cart_against_restrictions(coupon, cart_items):
+            if not self._validate_cart_against_restrictions(coupon, cart_items, get_product):
                 return {
                     'valid': False,
                     'message': 'This coupon is not applicable to the items in your cart'
                 }
             
             # Calculate discount
-            discount_info = self._calculate_discount(coupon, cart_items, cart_total)
+            discount_info = self._calculate_discount(coupon, cart_items, cart_total, get_product)
             
             return {
                 'valid': True,
@@ -97,21 +197,35 @@ class CouponService:
             dict: Application result
         """
         try:
-            # First validate the coupon
-            validation_result = self.validate_coupon(coupon_code, user_id, cart_items)
+            # First validate the coupon, always against the database row
+            coupon = Coupon.query.filter_by(code=coupon_code, is_active=True).first()
+            if not coupon:
+                return {
+                    'success': False,
+                    'message': 'Coupon code not found or inactive'
+                }
+            
+            validation_result = self.evaluate_coupon(self._load_counts(coupon, user_id), user_id, cart_items)
             if not validation_result['valid']:
                 return {
                     'success': False,
                     'message': validation_result['message']
                 }
             
-            coupon = Coupon.query.filter_by(code=coupon_code).first()
             discount_info = validation_result['discount']
             
             # Calculate final amount
             discount_amount = discount_info['discount_amount']
             final_amount = max(0, original_amount - discount_amount)
             
+            # Take a use of the limit in the same transaction as the redemption
+            if self.usage_stripes is not None and not self.usage_stripes.reserve(coupon, f'{user_id}:{order_id}'):
+                db.session.rollback()
+                return {
+                    'success': False,
+                    'message': 'Coupon has expired or reached usage limit'
+                }
+            
             # Create redemption record
             redemption = CouponRedemption(
                 coupon_id=coupon.id,
@@ -144,8 +258,9 @@ class CouponService:
                 'message': f'Error applying coupon: {str(e)}'
             }
     
-    def _validate_cart_against_restrictions(self, coupon, cart_items):
+    def _validate_cart_against_restrictions(self, coupon, cart_items, get_product=None):
         """Check if cart items match coupon restrictions"""
+        get_product = get_product or self._get_product
         
         # Parse restrictions
         applicable_themes = json.loads(coupon.applicable_themes) if coupon.applicable_themes else []
@@ -164,7 +279,7 @@ class CouponService:
             if not product_id:
                 continue
                 
-            product = Product.query.get(product_id)
+            product = get_product(product_id)
             if not product:
                 continue
             
@@ -188,7 +303,7 @@ class CouponService:
         # At least one item must be valid for the coupon to apply
         return len(valid_items) > 0
     
-    def _calculate_discount(self, coupon, cart_items, cart_total):
+    def _calculate_discount(self, coupon, cart_items, cart_total, get_product=None):
         """Calculate discount amount based on coupon type"""
         
         if coupon.coupon_type == CouponType.PERCENTAGE:
@@ -217,7 +332,7 @@ class CouponService:
         elif coupon.coupon_type == CouponType.FREE_SHIPPING:
             # This would typically be handled by the shipping calculation system
             # For now, we'll assume a fixed shipping cost to discount
-            shipping_cost = 100.0  # This should come from shipping calculation (₹100)
+            shipping_cost = self.FREE_SHIPPING_COST  # This should come from shipping calculation
             
             return {
                 'type': 'free_shipping',
@@ -227,7 +342,7 @@ class CouponService:
         
         elif coupon.coupon_type == CouponType.BUY_ONE_GET_ONE:
             # Find applicable items and calculate BOGO discount
-            applicable_items = self._get_applicable_items(coupon, cart_items)
+            applicable_items = self._get_applicable_items(coupon, cart_items, get_product)
             bogo_discount = self._calculate_bogo_discount(applicable_items)
             
             return {
@@ -241,8 +356,9 @@ class CouponService:
             'discount_amount': 0
         }
     
-    def _get_applicable_items(self, coupon, cart_items):
+    def _get_applicable_items(self, coupon, cart_items, get_product=None):
         """Get cart items that the coupon applies to"""
+        get_product = get_product or self._get_product
         applicable_items = []
         
         # Parse restrictions
@@ -255,7 +371,7 @@ class CouponService:
             if not product_id:
                 continue
                 
-            product = Product.query.get(product_id)
+            product = get_product(product_id)
             if not product:
                 continue
             
@@ -272,6 +388,33 @@ class CouponService:
         
         return applicable_items
     
+    def _find_coupon(self, coupon_code):
+        """Active coupon by code, from the shared store when it has the code"""
+        view = None
+        # The store is written from the main database, so tenants read their own
+        if self.shared_store is not None and current_tenant() is None:
+            view = self.shared_store.current()
+        if view is not None:
+            coupon = view.coupons.find(coupon_code)
+            if coupon is not None:
+                return coupon if coupon.is_active else None
+        # Not mapped, or created since the store was written
+        return find_active_coupon(coupon_code)
+    
+    def _load_counts(self, coupon, user_id=None):
+        """Wrap a coupon with its redemption counts from one indexed aggregate"""
+        counts = db.session.execute(redemption_count_statement(coupon.id, user_id)).one()
+        live = None
+        if self.validity_schedule is not None:
+            live = coupon.is_active and self.validity_schedule.is_live(coupon.id)
+        return LoadedCoupon(coupon, *counts, live=live)
+    
+    def _get_product(self, product_id):
+        """Default product lookup used by the restriction checks"""
+        if self.catalogue is not None:
+            return self.catalogue.get(product_id)
+        return Product.query.get(product_id)
+    
     def _calculate_bogo_discount(self, applicable_items):
         """Calculate BOGO discount for applicable items"""
         total_discount = 0
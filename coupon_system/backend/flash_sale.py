@@ -0,0 +1,171 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Coupon, CouponRedemption
+from tenancy import TenantScoped
+from redemption_archive import redemption_totals
+
+class _Pool:
+    __slots__ = ('coupon_id', 'limit', 'remaining', 'in_flight', 'checked_at', 'stale', 'reconciling')
+
+    def __init__(self):
+        self.coupon_id = None
+        self.limit = None
+        self.remaining = 0
+        self.in_flight = 0
+        self.checked_at = 0
+        self.stale = True
+        self.reconciling = False
+
+class FlashSale:
+    """In-memory admission for flash-sale coupons
+
+    For each code listed in ``FLASH_SALE_CODES`` the worker keeps a pool of
+    the redemption slots still left (usage limit minus redemptions). An apply
+    request takes a slot under a lock before any database work; when the
+    pool is empty it is refused at once, so only about as many requests as
+    there are slots reach the validate-and-insert path. A request that does
+    not end in a redemption gives its slot back.
+
+    The pool is only an admission gate: apply still checks the usage limit
+    against the database. It is recounted from the database when it is
+    first used (so a restarted worker starts from the real count), every
+    ``FLASH_SALE_RECONCILE_INTERVAL`` seconds, and after redemptions are
+    changed or removed here or, via the change log, in another worker.
+    Requests in flight during a recount are subtracted again, so a pool can
+    briefly run short but never hands out slots that are already used.
+    """
+
+    def __init__(self, app=None):
+        self.codes = frozenset()
+        self.reconcile_interval = 5
+        self._pools = {}  # code -> _Pool
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        codes = app.config.get('FLASH_SALE_CODES') or ''
+        self.codes = frozenset(code.strip().upper() for code in codes.split(',') if code.strip())
+        self.reconcile_interval = app.config.get('FLASH_SALE_RECONCILE_INTERVAL', self.reconcile_interval)
+        app.extensions['flash_sale'] = self
+
+    def admit(self, coupon_code):
+        """
+        Take a redemption slot for a coupon
+
+        Args:
+            coupon_code (str): Normalized coupon code
+
+        Returns:
+            bool or None: True when a slot was taken (call finish() afterwards),
+                False when none are left, None when the code has no pool
+        """
+        if coupon_code not in self.codes:
+            return None
+        pool = self._current_pool(coupon_code)
+        if pool is None or pool.limit is None:
+            return None
+        with self._lock:
+            if pool.remaining <= 0:
+                return False
+            pool.remaining -= 1
+            pool.in_flight += 1
+        return True
+
+    def finish(self, coupon_code, redeemed):
+        """Settle a slot taken by admit(): keep it if a redemption was recorded, else return it"""
+        pool = self._pools.get(coupon_code)
+        if pool is None:
+            return
+        with self._lock:
+            pool.in_flight -= 1
+            if not redeemed:
+                pool.remaining += 1
+
+    def preload(self):
+        """Load the pools of every flash-sale code"""
+        for coupon_code in self.codes:
+            self._current_pool(coupon_code)
+
+    def status(self):
+        """Current pools: {code: {'remaining': n, 'in_flight': n}}"""
+        with self._lock:
+            return {code: {'remaining': pool.remaining, 'in_flight': pool.in_flight}
+                    for code, pool in self._pools.items() if pool.limit is not None}
+
+    def invalidate(self, coupon_ids=None):
+        """Recount the pools of the given coupons (all when None) on their next use"""
+        with self._lock:
+            for pool in self._pools.values():
+                if coupon_ids is None or pool.coupon_id is None or pool.coupon_id in coupon_ids:
+                    pool.stale = True
+
+    def _current_pool(self, coupon_code):
+        pool = self._pools.get(coupon_code)
+        with self._lock:
+            if pool is None:
+                pool = self._pools[coupon_code] = _Pool()
+            due = pool.stale or time.monotonic() - pool.checked_at >= self.reconcile_interval
+            if not due or pool.reconciling:
+                # Others admit against the current numbers while one thread recounts
+                return pool if pool.checked_at else None
+            pool.reconciling = True
+            pool.stale = False
+        try:
+            self._reconcile(coupon_code, pool)
+        except Exception:
+            pool.stale = True
+            raise
+        finally:
+            pool.reconciling = False
+        return pool
+
+    def _reconcile(self, coupon_code, pool):
+        row = db.session.query(Coupon.id, Coupon.usage_limit).filter(
+            Coupon.code == coupon_code, Coupon.is_active == True
+        ).first()
+        redeemed = 0
+        if row is not None and row.usage_limit:
+            redeemed = db.session.execute(redemption_totals([row.id])).one_or_none()
+            redeemed = redeemed.redemptions if redeemed is not None else 0
+        with self._lock:
+            pool.checked_at = time.monotonic()
+            if row is None or not row.usage_limit:
+                # Unknown, inactive or unlimited: apply takes the normal path
+                pool.coupon_id = row.id if row is not None else None
+                pool.limit = None
+                pool.remaining = 0
+                return
+            pool.coupon_id = row.id
+            pool.limit = row.usage_limit
+            pool.remaining = max(0, row.usage_limit - redeemed - pool.in_flight)
+
+flash_sale = TenantScoped(FlashSale)
+
+# Redemptions edited or removed here can free slots; recount on next use
+@event.listens_for(CouponRedemption, 'after_update')
+@event.listens_for(CouponRedemption, 'after_delete')
+def _queue_returned_slot(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('flash_sale_coupons', set()).add(target.coupon_id)
+
+@event.listens_for(Coupon, 'after_insert')
+@event.listens_for(Coupon, 'after_update')
+def _queue_coupon_change(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('flash_sale_coupons', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def _recount_pools(session):
+    coupon_ids = session.info.pop('flash_sale_coupons', None)
+    if coupon_ids:
+        flash_sale.invalidate(coupon_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_pools(session):
+    session.info.pop('flash_sale_coupons', None)
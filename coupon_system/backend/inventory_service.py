@@ -0,0 +1,281 @@
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+from sqlalchemy import update, bindparam
+
+from models import db, Product, StockReservation, StockReservationItem
+
+logger = logging.getLogger(__name__)
+
+class InventoryService:
+    """Service class for reserving and releasing product stock
+
+    Stock is taken with conditional updates (``stock_quantity >= :qty``)
+    instead of a lock, so two checkouts only wait on each other when they
+    touch the same product row, and stock can never go negative. All lines
+    of a cart are taken inside one transaction, one statement per product,
+    and expired holds are released by a background sweep.
+    """
+
+    def __init__(self, reservation_ttl=900, sweep_interval=30):
+        self.reservation_ttl = reservation_ttl
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0
+        self._sweep_lock = threading.Lock()
+        self._job = None
+        self._job_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.reservation_ttl = app.config.get('STOCK_RESERVATION_TTL', self.reservation_ttl)
+        self.sweep_interval = app.config.get('STOCK_SWEEP_INTERVAL', self.sweep_interval)
+        app.extensions['inventory_service'] = self
+        # Started by the first request so the thread lives in the serving
+        # process, not in a pre-fork master or a CLI job
+        app.before_request(lambda: self.start_sweep_job(app))
+
+    def reserve_stock(self, cart_items, user_id=None, order_id=None, ttl=None):
+        """
+        Reserve stock for every line of a cart, all or nothing
+
+        Args:
+            cart_items (list): List of cart items with product_id and quantity
+            user_id (int, optional): User holding the reservation
+            order_id (str, optional): External order ID
+            ttl (int, optional): Seconds before the hold is released automatically
+
+        Returns:
+            dict: Reservation result
+        """
+        try:
+            self.maybe_release_expired()
+
+            lines = self._merge_lines(cart_items)
+            if not lines:
+                return {
+                    'success': False,
+                    'message': 'No valid cart items to reserve'
+                }
+
+            # Sorted by product so concurrent carts take row locks in the same order.
+            # One statement per line: executemany rowcounts are not reliable on every driver
+            for product_id, quantity in lines:
+                result = db.session.execute(
+                    update(Product.__table__)
+                    .where(Product.__table__.c.id == product_id)
+                    .where(Product.__table__.c.is_active == True)
+                    .where(Product.__table__.c.stock_quantity >= quantity)
+                    .values(stock_quantity=Product.__table__.c.stock_quantity - quantity)
+                )
+                if result.rowcount != 1:
+                    db.session.rollback()
+                    return {
+                        'success': False,
+                        'message': 'Insufficient stock for one or more items',
+                        'unavailable': self._find_unavailable(lines)
+                    }
+
+            reservation = StockReservation(
+                user_id=user_id,
+                order_id=order_id,
+                status='held',
+                expires_at=datetime.utcnow() + timedelta(seconds=ttl or self.reservation_ttl)
+            )
+            db.session.add(reservation)
+            db.session.flush()
+            db.session.add_all([
+                StockReservationItem(reservation_id=reservation.id, product_id=product_id, quantity=quantity)
+                for product_id, quantity in lines
+            ])
+            db.session.commit()
+
+            return {
+                'success': True,
+                'reservation_id': reservation.id,
+                'expires_at': reservation.expires_at.isoformat(),
+                'items': [{'product_id': p, 'quantity': q} for p, q in lines],
+                'message': 'Stock reserved successfully'
+            }
+
+        except Exception as e:
+            db.session.rollback()
+            return {
+                'success': False,
+                'message': f'Error reserving stock: {str(e)}'
+            }
+
+    def release_reservation(self, reservation_id, status='released', user_id=None):
+        """
+        Return a held reservation's stock to the shelf
+
+        Args:
+            reservation_id (str): Reservation to release
+            status (str): Final status to record, 'released' or 'expired'
+            user_id (int, optional): Only release the reservation if this user holds it
+
+        Returns:
+            dict: Release result; 'not_found' is set when the user has no such reservation
+        """
+        try:
+            if not self._transition(reservation_id, 'held', status, user_id=user_id):
+                db.session.rollback()
+                if not self._exists(reservation_id, user_id):
+                    return self._not_found(reservation_id)
+                return {
+                    'success': False,
+                    'message': 'Reservation not found or no longer held'
+                }
+            self._restock(reservation_id)
+            db.session.commit()
+            return {
+                'success': True,
+                'reservation_id': reservation_id,
+                'message': 'Stock released successfully'
+            }
+        except Exception as e:
+            db.session.rollback()
+            return {
+                'success': False,
+                'message': f'Error releasing stock: {str(e)}'
+            }
+
+    def commit_reservation(self, reservation_id, user_id=None):
+        """Mark a held reservation as sold so it is never released; only the holder's when user_id is given"""
+        try:
+            if not self._transition(reservation_id, 'held', 'committed', require_unexpired=True, user_id=user_id):
+                db.session.rollback()
+                if not self._exists(reservation_id, user_id):
+                    return self._not_found(reservation_id)
+                return {
+                    'success': False,
+                    'message': 'Reservation not found, expired or no longer held'
+                }
+            db.session.commit()
+            return {
+                'success': True,
+                'reservation_id': reservation_id,
+                'message': 'Reservation committed successfully'
+            }
+        except Exception as e:
+            db.session.rollback()
+            return {
+                'success': False,
+                'message': f'Error committing reservation: {str(e)}'
+            }
+
+    def release_expired(self, now=None, batch_size=500):
+        """Release every held reservation past its expiry, returning how many were released"""
+        now = now or datetime.utcnow()
+        released = 0
+        while True:
+            expired_ids = [row.id for row in db.session.query(StockReservation.id).filter(
+                StockReservation.status == 'held',
+                StockReservation.expires_at <= now
+            ).limit(batch_size).all()]
+            if not expired_ids:
+                break
+            for reservation_id in expired_ids:
+                # Another worker may have swept or committed it meanwhile
+                if self._transition(reservation_id, 'held', 'expired'):
+                    self._restock(reservation_id)
+                    released += 1
+            db.session.commit()
+        return released
+
+    def maybe_release_expired(self):
+        """Sweep expired holds at most once per sweep interval"""
+        if time.monotonic() - self._last_sweep < self.sweep_interval:
+            return 0
+        if not self._sweep_lock.acquire(blocking=False):
+            return 0
+        try:
+            self._last_sweep = time.monotonic()
+            return self.release_expired()
+        finally:
+            self._sweep_lock.release()
+
+    def start_sweep_job(self, app):
+        """Release expired holds every ``sweep_interval`` seconds on a daemon thread"""
+        interval = self.sweep_interval
+        if self._job is not None or interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    with app.app_context():
+                        released = self.maybe_release_expired()
+                        if released:
+                            logger.info('Released %s expired stock reservations', released)
+                except Exception:
+                    logger.exception('Stock reservation sweep failed')
+
+        with self._job_lock:
+            if self._job is None:
+                self._job = threading.Thread(target=run, name='stock-sweep', daemon=True)
+                self._job.start()
+
+    def _transition(self, reservation_id, from_status, to_status, require_unexpired=False, user_id=None):
+        # Conditional status change; only one caller can win it
+        query = update(StockReservation.__table__).where(
+            StockReservation.__table__.c.id == reservation_id,
+            StockReservation.__table__.c.status == from_status
+        )
+        if user_id is not None:
+            query = query.where(StockReservation.__table__.c.user_id == user_id)
+        if require_unexpired:
+            query = query.where(StockReservation.__table__.c.expires_at > datetime.utcnow())
+        result = db.session.execute(query.values(status=to_status))
+        return result.rowcount == 1
+
+    def _exists(self, reservation_id, user_id=None):
+        query = db.session.query(StockReservation.id).filter(StockReservation.id == reservation_id)
+        if user_id is not None:
+            query = query.filter(StockReservation.user_id == user_id)
+        return query.first() is not None
+
+    def _not_found(self, reservation_id):
+        # Also returned for another user's reservation, so ids cannot be probed
+        return {
+            'success': False,
+            'not_found': True,
+            'reservation_id': reservation_id,
+            'message': 'Reservation not found'
+        }
+
+    def _restock(self, reservation_id):
+        items = db.session.query(StockReservationItem.product_id, StockReservationItem.quantity).filter_by(
+            reservation_id=reservation_id
+        ).order_by(StockReservationItem.product_id).all()
+        if items:
+            db.session.execute(
+                update(Product.__table__)
+                .where(Product.__table__.c.id == bindparam('pid'))
+                .values(stock_quantity=Product.__table__.c.stock_quantity + bindparam('qty')),
+                [{'pid': item.product_id, 'qty': item.quantity} for item in items]
+            )
+
+    def _merge_lines(self, cart_items):
+        quantities = {}
+        for item in cart_items or []:
+            try:
+                product_id = int(item.get('product_id'))
+                quantity = int(item.get('quantity', 1))
+            except (TypeError, ValueError):
+                continue
+            if quantity > 0:
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+        return sorted(quantities.items())
+
+    def _find_unavailable(self, lines):
+        requested = dict(lines)
+        rows = db.session.query(Product.id, Product.stock_quantity, Product.is_active).filter(
+            Product.id.in_(requested)
+        ).all()
+        available = {row.id: (row.stock_quantity or 0) if row.is_active else 0 for row in rows}
+        return [
+            {'product_id': product_id, 'requested': quantity, 'available': available.get(product_id, 0)}
+            for product_id, quantity in lines
+            if available.get(product_id, 0) < quantity
+        ]
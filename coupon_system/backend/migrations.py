@@ -0,0 +1,260 @@
+"""
+Schema migrations and query-plan checks
+
+The app never changes the schema on its own. ``upgrade`` creates missing
+tables and applies changes to existing tables (such as new indexes) as
+numbered migrations recorded in ``schema_migrations``. Tenant databases
+(``TENANT_DATABASES``) get the same schema and migrations as the main one,
+so ``upgrade`` and ``status`` cover every database.
+
+Usage:
+    python migrations.py upgrade       # create missing tables and apply pending migrations
+    python migrations.py status        # list applied and pending migrations
+    python migrations.py check-plans   # fail if a hot query falls back to a full table scan
+"""
+
+from datetime import datetime
+import os
+import sys
+import tempfile
+from sqlalchemy import create_engine, text
+
+from models import db, Product, Coupon, CouponRedemption, CacheChange, CouponUsageStripe
+from models import RedemptionEvent, FeedConsumer, ArchivedRedemption, ArchivedRedemptionTotal
+from read_models import user_history_query, active_coupon_statement, stock_levels_statement
+from coupon_service import redemption_count_statement
+from redemption_archive import redemption_totals
+from redemption_feed import events_after
+from usage_stripes import take_statement
+from validity_schedule import unexpired_coupons
+from user_eligibility import used_coupons_statement
+
+def _create_indexes(*indexes):
+    def migrate(connection):
+        for index in indexes:
+            index.create(connection, checkfirst=True)
+    return migrate
+
+def _create_tables(*tables):
+    def migrate(connection):
+        for table in tables:
+            table.create(connection, checkfirst=True)
+    return migrate
+
+def _autoincrement(table, last_id=None):
+    """
+    Rebuild a SQLite table with AUTOINCREMENT so deleted ids are never reused
+
+    Readers that page by id would skip rows that reuse an id below their
+    cursor. ``last_id`` is a statement for the highest id already handed
+    out, for tables whose newest rows may have been deleted.
+    """
+    def migrate(connection):
+        if connection.dialect.name != 'sqlite':
+            return
+        created = connection.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': table.name}
+        ).scalar()
+        if 'AUTOINCREMENT' not in (created or '').upper():
+            previous = f'{table.name}_before_autoincrement'
+            for index in table.indexes:
+                connection.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+            connection.execute(text(f'ALTER TABLE {table.name} RENAME TO {previous}'))
+            table.create(connection)
+            columns = ', '.join(column.name for column in table.columns)
+            connection.execute(text(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {previous}'))
+            connection.execute(text(f'DROP TABLE {previous}'))
+        start = connection.execute(last_id).scalar() if last_id is not None else None
+        if start:
+            sequence = connection.execute(
+                text('SELECT seq FROM sqlite_sequence WHERE name = :name'), {'name': table.name}
+            ).scalar()
+            if sequence is None:
+                connection.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+                                   {'name': table.name, 'seq': start})
+            elif sequence < start:
+                connection.execute(text('UPDATE sqlite_sequence SET seq = :seq WHERE name = :name'),
+                                   {'name': table.name, 'seq': start})
+    return migrate
+
+def _index(table, name):
+    return next(index for index in table.indexes if index.name == name)
+
+# (version, description, callable taking a connection), in order
+MIGRATIONS = [
+    (1, 'Composite indexes for redemption, coupon and product queries', _create_indexes(
+        _index(CouponRedemption.__table__, 'ix_coupon_redemptions_user_created'),
+        _index(CouponRedemption.__table__, 'ix_coupon_redemptions_coupon_used'),
+        _index(Coupon.__table__, 'ix_coupons_active_validity'),
+        _index(Product.__table__, 'ix_products_active_theme_category'),
+    )),
+    (2, 'Change log for cross-worker cache invalidation', _create_tables(CacheChange.__table__)),
+    (3, 'Striped usage counters for coupon limits', _create_tables(CouponUsageStripe.__table__)),
+    (4, 'Redemption event outbox and feed consumers',
+     _create_tables(RedemptionEvent.__table__, FeedConsumer.__table__)),
+    (5, 'Redemption archive and archived usage totals',
+     _create_tables(ArchivedRedemption.__table__, ArchivedRedemptionTotal.__table__)),
+    (6, 'Never reuse redemption event ids after compaction',
+     _autoincrement(RedemptionEvent.__table__, db.select(db.func.max(FeedConsumer.__table__.c.cursor)))),
+    (7, 'Never reuse cache change ids after pruning', _autoincrement(CacheChange.__table__)),
+]
+
+def _ensure_version_table(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at DATETIME)'
+    ))
+
+def applied_versions(connection):
+    _ensure_version_table(connection)
+    return {row[0] for row in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+def upgrade(engine=None):
+    """
+    Create missing tables, then apply every pending migration
+
+    Args:
+        engine (Engine, optional): Database to upgrade; the main and every tenant database when None
+
+    Returns:
+        list: Versions applied to at least one database
+    """
+    if engine is None:
+        applied = set()
+        for tenant_engine in _engines():
+            applied.update(upgrade(tenant_engine))
+        return sorted(applied)
+    db.metadata.create_all(engine)
+    applied = []
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+    for version, description, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as connection:
+            migrate(connection)
+            connection.execute(
+                text('INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)'),
+                {'v': version, 'd': description, 't': datetime.utcnow()}
+            )
+        applied.append(version)
+    return applied
+
+def _engines():
+    # The main engine first, then one per tenant bind
+    return [db.engine] + [engine for key, engine in db.engines.items() if key is not None]
+
+def stamp(engine=None):
+    """Mark every migration as applied, for a schema just built by create_all()"""
+    engine = engine or db.engine
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+        for version, description, _ in MIGRATIONS:
+            if version not in done:
+                connection.execute(
+                    text('INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)'),
+                    {'v': version, 'd': description, 't': datetime.utcnow()}
+                )
+
+# Hot queries and the index each one must use, built by the same functions
+# the services call so a change to either shows up here. A query marked
+# ``regroups`` may sort in a temp b-tree: it re-aggregates rows that its
+# indexed parts already grouped per coupon.
+def _plan_queries():
+    now = datetime.utcnow()
+    return [
+        ('user coupon history', user_history_query(1), 'ix_coupon_redemptions_user_created', False),
+        ('usage totals of some coupons, archive included', redemption_totals([1, 2]),
+         'ix_coupon_redemptions_coupon_used', True),
+        ('counts of one coupon and user, archive included', redemption_count_statement(1, 1),
+         'ix_coupon_redemptions_archive_coupon_user', False),
+        ('coupons a user has used', used_coupons_statement(1), 'ix_coupon_redemptions_user_created', False),
+        ('usage stripe of one coupon', take_statement(1, 0), 'ix_coupon_usage_stripes_coupon_stripe', False),
+        ('redemption feed batch', events_after(0, 500), 'INTEGER PRIMARY KEY', False),
+        ('unexpired coupons', unexpired_coupons(now), 'ix_coupons_active_validity', False),
+        ('active coupon by code', active_coupon_statement('CODE'), 'sqlite_autoindex_coupons_1', False),
+        ('active product stock', stock_levels_statement(), 'ix_products_active_theme_category', False),
+    ]
+
+def explain(connection, statement):
+    """Return SQLite's EXPLAIN QUERY PLAN detail lines for a statement"""
+    # Expands IN lists into one parameter per value
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    # Only the plan is wanted, so raw parameter values are good enough
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).fetchall()
+    return [row[-1] for row in rows]
+
+def check_query_plans(engine=None):
+    """
+    Check that every hot query is served by its index
+
+    Runs against a scratch SQLite schema built from the models plus the
+    migrations, so the result does not depend on data volume.
+
+    Returns:
+        list: (query name, problem, plan lines) for each failing query
+    """
+    scratch = None
+    if engine is None:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        scratch.close()
+        engine = create_engine(f'sqlite:///{scratch.name}')
+    try:
+        upgrade(engine)
+        failures = []
+        with engine.connect() as connection:
+            for name, statement, index_name, regroups in _plan_queries():
+                plan = explain(connection, statement)
+                # Reading back a subquery's own rows is not a table scan
+                subqueries = {line.split()[-1] for line in plan if line.startswith(('CO-ROUTINE', 'MATERIALIZE'))}
+                scans = [line for line in plan if line.startswith('SCAN') and 'INDEX' not in line
+                         and line.split()[1] not in subqueries]
+                if scans:
+                    failures.append((name, 'full table scan', plan))
+                elif not regroups and any('TEMP B-TREE' in line for line in plan):
+                    failures.append((name, 'sorts or groups in a temp b-tree', plan))
+                elif not any(index_name in line for line in plan):
+                    failures.append((name, f'does not use {index_name}', plan))
+        return failures
+    finally:
+        engine.dispose()
+        if scratch is not None:
+            os.unlink(scratch.name)
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'upgrade'
+
+    if command == 'check-plans':
+        failures = check_query_plans()
+        for name, problem, plan in failures:
+            print(f'FAIL {name}: {problem}')
+            for line in plan:
+                print(f'    {line}')
+        if failures:
+            return 1
+        print(f'OK: {len(_plan_queries())} queries use their indexes')
+        return 0
+
+    from app import create_app
+
+    app = create_app()
+
+    with app.app_context():
+        if command == 'upgrade':
+            applied = upgrade()
+            print(f'Applied migrations: {applied}' if applied else 'Schema is up to date')
+        elif command == 'status':
+            for engine in _engines():
+                with engine.begin() as connection:
+                    done = applied_versions(connection)
+                print(engine.url.render_as_string(hide_password=True))
+                for version, description, _ in MIGRATIONS:
+                    print(f'[{"x" if version in done else " "}] {version:03d} {description}')
+        else:
+            print(__doc__)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -3,7 +3,9 @@ from datetime import datetime, timedelta
 import uuid
 from enum import Enum
 
-db = SQLAlchemy()
+from tenancy import TenantSession
+
+db = SQLAlchemy(session_options={'class_': TenantSession})
 
 class ThemeType(Enum):
     BTS = "BTS"
@@ -43,6 +45,10 @@ class User(db.Model):
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        # Storefront listing: active products filtered by theme, then category
+        db.Index('ix_products_active_theme_category', 'is_active', 'theme', 'category'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -60,6 +66,10 @@ class Product(db.Model):
 
 class Coupon(db.Model):
     __tablename__ = 'coupons'
+    __table_args__ = (
+        # Available coupons: active and inside their validity window
+        db.Index('ix_coupons_active_validity', 'is_active', 'valid_from', 'valid_until'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(50), unique=True, nullable=False)
@@ -94,17 +104,27 @@ class Coupon(db.Model):
     
     @property
     def is_valid(self):
-        now = datetime.utcnow()
+        return self.check_validity(len(self.redemptions))
+    
+    def check_validity(self, redemption_count):
+        """Validity rules given an already known redemption count"""
+        return self.is_live() and not self.is_exhausted(redemption_count)
+    
+    def is_live(self, now=None):
+        """Active and inside the validity window"""
+        now = now or datetime.utcnow()
         if not self.is_active:
             return False
         if self.valid_until and now > self.valid_until:
             return False
         if now < self.valid_from:
             return False
-        if self.usage_limit and len(self.redemptions) >= self.usage_limit:
-            return False
         return True
     
+    def is_exhausted(self, redemption_count):
+        """Whether the total usage limit has been reached"""
+        return bool(self.usage_limit and redemption_count >= self.usage_limit)
+    
     def get_usage_count(self):
         return len([r for r in self.redemptions if r.is_used])
     
@@ -112,10 +132,20 @@ class Coupon(db.Model):
         if not self.is_valid:
             return False
         user_redemptions = [r for r in self.redemptions if r.user_id == user_id and r.is_used]
-        return len(user_redemptions) < self.usage_limit_per_user
+        return self.has_uses_left(len(user_redemptions))
+    
+    def has_uses_left(self, user_usage_count):
+        """Per-user limit check given the user's used redemption count"""
+        return user_usage_count < self.usage_limit_per_user
 
 class CouponRedemption(db.Model):
     __tablename__ = 'coupon_redemptions'
+    __table_args__ = (
+        # User history, newest first
+        db.Index('ix_coupon_redemptions_user_created', 'user_id', 'created_at'),
+        # Per-coupon usage counts and limits, grouped by coupon where is_used
+        db.Index('ix_coupon_redemptions_coupon_used', 'coupon_id', 'is_used'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     coupon_id = db.Column(db.Integer, db.ForeignKey('coupons.id'), nullable=False)
@@ -134,6 +164,43 @@ class CouponRedemption(db.Model):
     def __repr__(self):
         return f'<CouponRedemption {self.coupon.code} by {self.user.username}>'
 
+class ArchivedRedemption(db.Model):
+    __tablename__ = 'coupon_redemptions_archive'
+    __table_args__ = (
+        # User history, newest first
+        db.Index('ix_coupon_redemptions_archive_user_created', 'user_id', 'created_at'),
+        # Per-user usage of a coupon whose redemptions were archived
+        db.Index('ix_coupon_redemptions_archive_coupon_user', 'coupon_id', 'user_id'),
+    )
+
+    # Same columns and ids as coupon_redemptions; rows are moved here, never edited
+    id = db.Column(db.Integer, primary_key=True)
+    coupon_id = db.Column(db.Integer, db.ForeignKey('coupons.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    order_id = db.Column(db.String(100))
+    discount_applied = db.Column(db.Float, nullable=False)
+    original_amount = db.Column(db.Float, nullable=False)
+    final_amount = db.Column(db.Float, nullable=False)
+    is_used = db.Column(db.Boolean, default=False)
+    used_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ArchivedRedemption {self.id}>'
+
+class ArchivedRedemptionTotal(db.Model):
+    __tablename__ = 'archived_redemption_totals'
+
+    # Counts of a coupon's archived redemptions, added to the live ones for usage limits
+    coupon_id = db.Column(db.Integer, db.ForeignKey('coupons.id'), primary_key=True)
+    redemptions = db.Column(db.Integer, nullable=False, default=0)
+    used = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ArchivedRedemptionTotal {self.coupon_id} {self.used}/{self.redemptions}>'
+
 class CouponUsageLog(db.Model):
     __tablename__ = 'coupon_usage_logs'
     
@@ -149,3 +216,92 @@ class CouponUsageLog(db.Model):
     
     def __repr__(self):
         return f'<CouponUsageLog {self.coupon_code} - {self.action}>'
+
+class CouponUsageStripe(db.Model):
+    __tablename__ = 'coupon_usage_stripes'
+    __table_args__ = (
+        # Applies update one stripe by (coupon, stripe)
+        db.Index('ix_coupon_usage_stripes_coupon_stripe', 'coupon_id', 'stripe', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    coupon_id = db.Column(db.Integer, db.ForeignKey('coupons.id'), nullable=False)
+    stripe = db.Column(db.Integer, nullable=False)  # 0 .. number of stripes - 1
+    used = db.Column(db.Integer, nullable=False, default=0)
+    capacity = db.Column(db.Integer, nullable=False, default=0)  # a coupon's capacities sum to its usage limit
+    
+    def __repr__(self):
+        return f'<CouponUsageStripe {self.coupon_id}/{self.stripe} {self.used}/{self.capacity}>'
+
+class RedemptionEvent(db.Model):
+    __tablename__ = 'redemption_events'
+    # Compaction may delete every row; ids must still never be handed out again
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    id = db.Column(db.Integer, primary_key=True)  # feed cursor; consumers read past their last acknowledged id
+    event = db.Column(db.String(20), nullable=False)  # 'created', 'updated', 'deleted'
+    redemption_id = db.Column(db.Integer, nullable=False)
+    coupon_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    order_id = db.Column(db.String(100))
+    discount_applied = db.Column(db.Float)
+    original_amount = db.Column(db.Float)
+    final_amount = db.Column(db.Float)
+    is_used = db.Column(db.Boolean)
+    used_at = db.Column(db.DateTime)
+    recorded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<RedemptionEvent {self.id} {self.event} {self.redemption_id}>'
+
+class FeedConsumer(db.Model):
+    __tablename__ = 'feed_consumers'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    cursor = db.Column(db.Integer, nullable=False, default=0)  # last acknowledged event id
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    acknowledged_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<FeedConsumer {self.name} at {self.cursor}>'
+
+class StockReservation(db.Model):
+    __tablename__ = 'stock_reservations'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    order_id = db.Column(db.String(100))  # external order reference
+    status = db.Column(db.String(20), nullable=False, default='held')  # 'held', 'committed', 'released', 'expired'
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    items = db.relationship('StockReservationItem', backref='reservation', lazy=True)
+    
+    def __repr__(self):
+        return f'<StockReservation {self.id} - {self.status}>'
+
+class StockReservationItem(db.Model):
+    __tablename__ = 'stock_reservation_items'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    reservation_id = db.Column(db.String(36), db.ForeignKey('stock_reservations.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<StockReservationItem {self.product_id} x{self.quantity}>'
+
+class CacheChange(db.Model):
+    __tablename__ = 'cache_changes'
+    # Pruning may delete every row; ids must still never be handed out again
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    id = db.Column(db.Integer, primary_key=True)  # workers read past their last seen id
+    kind = db.Column(db.String(20), nullable=False)  # 'coupon', 'product', 'redemption', 'user_redemption'
+    entity_id = db.Column(db.Integer)  # coupon id for 'redemption', user id for 'user_redemption'
+    origin = db.Column(db.String(100))  # worker that made the change
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<CacheChange {self.kind} {self.entity_id}>'
@@ -0,0 +1,91 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import threading
+from werkzeug.security import generate_password_hash, check_password_hash
+
+class HasherOverloaded(Exception):
+    """Raised when the hashing pool cannot take more work"""
+
+class PasswordHasher:
+    """Runs password hashing and verification on a bounded process pool
+
+    Hashing is CPU bound, so running it on the request thread holds the GIL
+    and starves every other request served by the same worker. Work is handed
+    to a process pool instead; at most ``workers + queue_limit`` jobs are in
+    flight and anything beyond that is refused immediately with
+    ``HasherOverloaded`` so the caller can answer 503.
+    """
+
+    def __init__(self, app=None):
+        self.workers = 2
+        self.queue_limit = 32
+        self.timeout = 5.0
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read pool settings from the app config"""
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', self.workers)
+        self.queue_limit = app.config.get('PASSWORD_HASH_QUEUE_LIMIT', self.queue_limit)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', self.timeout)
+        self._slots = threading.BoundedSemaphore(max(1, self.workers + self.queue_limit))
+        app.extensions['password_hasher'] = self
+
+    def hash(self, password):
+        """Hash a password, returning the Werkzeug hash string"""
+        return self._run(generate_password_hash, password)
+
+    def verify(self, password_hash, password):
+        """Check a password against a stored hash"""
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+    def _get_executor(self):
+        # Created on first use so importing the app does not fork workers
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _run(self, func, *args):
+        # A pool size of 0 hashes inline, which is handy for scripts and tests
+        if self.workers <= 0:
+            return func(*args)
+
+        if self._slots is None:
+            self._slots = threading.BoundedSemaphore(max(1, self.workers + self.queue_limit))
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HasherOverloaded('Password hashing queue is full')
+
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BrokenProcessPool:
+            slots.release()
+            self.shutdown()
+            raise HasherOverloaded('Password hashing pool is restarting')
+        except Exception:
+            slots.release()
+            raise
+
+        # The slot is held until the job really finishes, even if we stop waiting
+        future.add_done_callback(lambda f: slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HasherOverloaded('Password hashing timed out')
+        except BrokenProcessPool:
+            self.shutdown()
+            raise HasherOverloaded('Password hashing pool is restarting')
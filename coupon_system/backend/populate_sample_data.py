@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
 import json
-from app import app
+from app import create_app
 from models import db, User, Product, Coupon
 from models import ThemeType, ProductCategory, CouponType
 from werkzeug.security import generate_password_hash
@@ -8,6 +8,7 @@ from werkzeug.security import generate_password_hash
 def populate_sample_data():
     """Populate the database with sample data"""
     
+    app = create_app()
     with app.app_context():
         # Clear existing data (optional)
         db.drop_all()
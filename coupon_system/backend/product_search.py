@@ -0,0 +1,270 @@
+"""
+Product search
+
+Full-text and prefix search over product names and descriptions, with
+price-range, theme and category filters, sorting and theme / category facet
+counts. Searches run against an inverted index built from the catalogue
+snapshot: every word of a product's name and description maps to a sorted
+NumPy array of snapshot positions, and the price, active flag, theme and
+category of every product sit in arrays aligned with those positions. A
+query intersects the postings of its words (each word is a prefix), masks
+the result with the filters, counts the facets with ``bincount`` over that
+same matched set and sorts only the matches.
+
+The index belongs to one snapshot version. When the catalogue changes, the
+first search after it builds a new index while other searches keep using
+the previous one.
+
+Usage:
+    python product_search.py "jimin key" 10     # run a search from the shell
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import chain, count as count_from
+from operator import add
+import re
+import sys
+import threading
+import time
+import numpy as np
+
+from models import ThemeType, ProductCategory
+
+THEMES = list(ThemeType)
+CATEGORIES = list(ProductCategory)
+
+SORTS = ('relevance', 'price_asc', 'price_desc', 'name', 'newest')
+
+# Search terms beyond this are ignored
+MAX_TERMS = 8
+
+_WORD = re.compile(r'\w+')
+
+def search_terms(query):
+    """Lower-cased word terms of a search string"""
+    return _WORD.findall((query or '').lower())[:MAX_TERMS]
+
+def _sorted_unique(values):
+    """Sorted distinct values, by a sort and a compare with the neighbour"""
+    values = np.sort(values)
+    if len(values) > 1:
+        values = values[np.concatenate(([True], values[1:] != values[:-1]))]
+    return values
+
+def _build_postings(vocabulary, token_lists):
+    """{word: sorted positions} from each position's list of words
+
+    Words are coded through ``vocabulary`` and every (code, position) pair is
+    packed into one integer, so a single sort both drops repeated
+    words within a product and groups the positions by word.
+    """
+    count = len(token_lists)
+    if not count:
+        return {}
+    lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=count)
+    codes = np.fromiter(map(vocabulary.__getitem__, chain.from_iterable(token_lists)), dtype=np.int64,
+                        count=int(lengths.sum()))
+    keys = _sorted_unique(codes * count + np.repeat(np.arange(count, dtype=np.int64), lengths))
+    codes, positions = np.divmod(keys, count)
+    positions = positions.astype(np.int32)
+    starts = np.flatnonzero(np.diff(codes, prepend=-1))
+    ends = np.append(starts[1:], len(codes))
+    # Codes are handed out in insertion order, so a word's code is its index here
+    words = list(vocabulary)
+    return {words[code]: positions[start:end]
+            for code, start, end in zip(codes[starts].tolist(), starts.tolist(), ends.tolist())}
+
+class SearchIndex:
+    """Inverted index and filter columns for one catalogue snapshot
+
+    Positions are snapshot positions, which are in product id order, so a
+    stable sort on any key breaks ties by id.
+    """
+
+    def __init__(self, snapshot):
+        self.version = snapshot.version
+        self.records = snapshot.filter(active_only=False)
+        count = len(self.records)
+        self.prices = np.fromiter((r.price for r in self.records), dtype=np.float64, count=count)
+        self.active = np.fromiter((bool(r.is_active) for r in self.records), dtype=bool, count=count)
+        self.themes = np.fromiter((THEMES.index(r.theme) for r in self.records), dtype=np.int8, count=count)
+        self.categories = np.fromiter((CATEGORIES.index(r.category) for r in self.records), dtype=np.int8,
+                                      count=count)
+        # Rank of each product in case-insensitive name order, for the name sort
+        names = [(r.name or '').lower() for r in self.records]
+        self.name_ranks = np.empty(count, dtype=np.int64)
+        self.name_ranks[sorted(range(count), key=names.__getitem__)] = np.arange(count)
+
+        name_words = list(map(_WORD.findall, names))
+        text_words = list(map(add, name_words, map(_WORD.findall, (
+            (r.description or '').lower() for r in self.records
+        ))))
+        vocabulary = defaultdict(count_from().__next__)
+        self._postings = _build_postings(vocabulary, text_words)
+        self._name_postings = _build_postings(vocabulary, name_words)
+        self._words = sorted(self._postings)
+
+    def __len__(self):
+        return len(self.records)
+
+    def matches(self, term, name_only=False):
+        """Sorted positions of products with a word starting with ``term``"""
+        postings = self._name_postings if name_only else self._postings
+        start = bisect_left(self._words, term)
+        found = []
+        for word in self._words[start:]:
+            if not word.startswith(term):
+                break
+            if word in postings:
+                found.append(postings[word])
+        if not found:
+            return np.empty(0, dtype=np.int32)
+        if len(found) == 1:
+            return found[0]
+        return _sorted_unique(np.concatenate(found))
+
+    def search(self, terms, min_price=None, max_price=None, theme=None, category=None,
+               sort='relevance', limit=20, offset=0):
+        """Matching records for one page, the total and the facet counts over every match"""
+        if terms:
+            postings = sorted((self.matches(term) for term in terms), key=len)
+            positions = postings[0]
+            for other in postings[1:]:
+                if not len(positions):
+                    break
+                positions = np.intersect1d(positions, other, assume_unique=True)
+        else:
+            positions = np.arange(len(self.records), dtype=np.int32)
+
+        mask = self.active[positions]
+        if min_price is not None:
+            mask &= self.prices[positions] >= min_price
+        if max_price is not None:
+            mask &= self.prices[positions] <= max_price
+        if theme is not None:
+            mask &= self.themes[positions] == THEMES.index(theme)
+        if category is not None:
+            mask &= self.categories[positions] == CATEGORIES.index(category)
+        positions = positions[mask]
+
+        theme_counts = np.bincount(self.themes[positions], minlength=len(THEMES))
+        category_counts = np.bincount(self.categories[positions], minlength=len(CATEGORIES))
+
+        if sort == 'relevance' and terms:
+            # More of the query's words in the name ranks higher
+            name_hits = np.zeros(len(positions), dtype=np.int8)
+            for term in terms:
+                name_hits += np.isin(positions, self.matches(term, name_only=True), assume_unique=True)
+            ordered = positions[np.argsort(-name_hits, kind='stable')]
+        elif sort == 'price_asc':
+            ordered = positions[np.argsort(self.prices[positions], kind='stable')]
+        elif sort == 'price_desc':
+            ordered = positions[np.argsort(-self.prices[positions], kind='stable')]
+        elif sort == 'name':
+            ordered = positions[np.argsort(self.name_ranks[positions])]
+        else:
+            # Newest first: product ids grow with insertion
+            ordered = positions[::-1]
+
+        return {
+            'products': [self.records[pos] for pos in ordered[offset:offset + limit].tolist()],
+            'total': len(positions),
+            'facets': {
+                'themes': {THEMES[code].value: int(n) for code, n in enumerate(theme_counts) if n},
+                'categories': {CATEGORIES[code].value: int(n) for code, n in enumerate(category_counts) if n}
+            }
+        }
+
+class ProductSearch:
+    """Search API over the catalogue, backed by a per-snapshot inverted index"""
+
+    def __init__(self, app=None):
+        self.page_size = 20
+        self.max_page_size = 100
+        self.catalogue = None
+        self._index = None
+        self._building = False
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.page_size = app.config.get('PRODUCT_SEARCH_PAGE_SIZE', self.page_size)
+        self.max_page_size = app.config.get('PRODUCT_SEARCH_MAX_PAGE_SIZE', self.max_page_size)
+        self.catalogue = app.extensions['catalogue']
+        app.extensions['product_search'] = self
+
+    def search(self, query=None, min_price=None, max_price=None, theme=None, category=None,
+               sort='relevance', limit=None, offset=0):
+        """
+        Search active products
+
+        Args:
+            query (str, optional): Words to match; each is a prefix match on name or description
+            min_price (float, optional): Lowest price, inclusive
+            max_price (float, optional): Highest price, inclusive
+            theme (ThemeType, optional): Only this theme
+            category (ProductCategory, optional): Only this category
+            sort (str): One of ``SORTS``
+            limit (int, optional): Page size, capped at the configured maximum
+            offset (int): Matches to skip
+
+        Returns:
+            dict: 'products' (catalogue records of the page, in order), 'version'
+                of the snapshot they come from, 'total' matches and 'facets'
+                {'themes': {name: count}, 'categories': {name: count}}
+        """
+        if sort not in SORTS:
+            raise ValueError(f'Unknown sort: {sort}')
+        limit = max(1, min(limit or self.page_size, self.max_page_size))
+        index = self.index()
+        result = index.search(search_terms(query), min_price, max_price, theme, category,
+                              sort, limit, max(0, offset))
+        result['version'] = index.version
+        return result
+
+    def index(self):
+        """The index for the current catalogue snapshot, building it if needed"""
+        snapshot = self.catalogue.snapshot()
+        current = self._index
+        if current is not None and current.version == snapshot.version:
+            return current
+        with self._lock:
+            current = self._index
+            if current is not None and (current.version == snapshot.version or self._building):
+                # Another thread is building the new one; answer from the previous snapshot
+                return current
+            self._building = True
+        try:
+            fresh = SearchIndex(snapshot)
+            self._index = fresh
+            return fresh
+        finally:
+            self._building = False
+
+product_search = ProductSearch()
+
+def main(argv):
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        index = product_search.index()
+        built = time.perf_counter()
+        result = product_search.search(argv[1], limit=int(argv[2]) if len(argv) > 2 else None)
+        searched = time.perf_counter()
+        print(f'Indexed {len(index)} products in {built - started:.2f}s; search took '
+              f'{(searched - built) * 1000:.2f} ms')
+        print(f"{result['total']} matches; themes {result['facets']['themes']}, "
+              f"categories {result['facets']['categories']}")
+        for product in result['products']:
+            print(f'  {product.id}: {product.name} ({product.price})')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
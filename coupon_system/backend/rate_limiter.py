@@ -0,0 +1,181 @@
+from collections import OrderedDict
+import math
+import threading
+import time
+
+class MemoryBackend:
+    """Sliding-window counters kept in process memory
+
+    Each key holds only the current and previous window counts, so state is
+    O(1) per client. Keys are kept in least-recently-hit order and anything
+    idle for two full windows is dropped as new hits come in, which bounds
+    memory without a separate sweeper thread.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, window, now):
+        """Record a hit and return the weighted count for the sliding window"""
+        current_window = int(now // window)
+        with self._lock:
+            entry = self._counters.pop(key, None)
+            if entry is None or entry[0] < current_window - 1:
+                entry = [current_window, 0, 0]
+            elif entry[0] == current_window - 1:
+                entry = [current_window, 0, entry[1]]
+            entry[1] += 1
+            self._counters[key] = entry
+
+            # Expire idle keys from the cold end of the ordering
+            while self._counters:
+                oldest_key, oldest = next(iter(self._counters.items()))
+                if oldest[0] >= current_window - 1 and len(self._counters) <= self.max_keys:
+                    break
+                del self._counters[oldest_key]
+
+        return _weighted_count(entry[1], entry[2], window, now)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+class SharedBackend:
+    """Sliding-window counters stored in a shared key/value server
+
+    Works with any client exposing Redis-style ``incr``, ``expire`` and
+    ``get`` so every worker process sees the same counts. Counter keys expire
+    on their own after two windows.
+    """
+
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    def hit(self, key, window, now):
+        """Record a hit and return the weighted count for the sliding window"""
+        current_window = int(now // window)
+        current_key = f'{self.prefix}{key}:{current_window}'
+        current = self.client.incr(current_key)
+        if current == 1:
+            self.client.expire(current_key, int(window * 2))
+        previous = self.client.get(f'{self.prefix}{key}:{current_window - 1}')
+        return _weighted_count(current, int(previous or 0), window, now)
+
+class LocalSharedClient:
+    """In-process stand-in for the shared counter server
+
+    Implements the small subset of the Redis API that ``SharedBackend`` uses,
+    so multi-process behaviour can be exercised without a running server.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def incr(self, key):
+        with self._lock:
+            self._purge(key)
+            self._values[key] = self._values.get(key, 0) + 1
+            return self._values[key]
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if key in self._values:
+                self._expires[key] = time.time() + seconds
+                return True
+            return False
+
+    def get(self, key):
+        with self._lock:
+            self._purge(key)
+            return self._values.get(key)
+
+    def _purge(self, key):
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+
+class RateLimiter:
+    """Per-client request limiter for unauthenticated endpoints
+
+    Uses the sliding-window counter approximation: the count for the current
+    window plus the previous window's count weighted by how much of it still
+    overlaps. Rejected hits are counted too, so a client that keeps hammering
+    stays blocked.
+    """
+
+    def __init__(self, app=None, backend=None):
+        self.backend = backend
+        self.enabled = True
+        self.window = 60
+        self.limits = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure limits and pick a backend from the app config"""
+        self.enabled = app.config.get('RATE_LIMIT_ENABLED', True)
+        self.window = app.config.get('RATE_LIMIT_WINDOW', self.window)
+        self.limits = {
+            'ip': app.config.get('RATE_LIMIT_VALIDATE_PER_IP', 60),
+            'user': app.config.get('RATE_LIMIT_VALIDATE_PER_USER', 30),
+        }
+
+        if self.backend is None:
+            redis_url = app.config.get('RATE_LIMIT_REDIS_URL')
+            if redis_url:
+                # Only needed for multi-process deployments
+                import redis
+                self.backend = SharedBackend(redis.Redis.from_url(redis_url))
+            else:
+                self.backend = MemoryBackend(app.config.get('RATE_LIMIT_MAX_KEYS', 100000))
+
+        app.extensions['rate_limiter'] = self
+
+    def check(self, scope, identifier, now=None):
+        """
+        Count a hit against one client and decide whether to allow it
+
+        Args:
+            scope (str): Limit name from ``self.limits`` such as 'ip' or 'user'
+            identifier: Client identifier within that scope
+
+        Returns:
+            tuple: (allowed, retry_after_seconds)
+        """
+        limit = self.limits.get(scope)
+        if not self.enabled or not limit or identifier is None:
+            return True, 0
+
+        now = time.time() if now is None else now
+        count = self.backend.hit(f'{scope}:{identifier}', self.window, now)
+        if count <= limit:
+            return True, 0
+
+        retry_after = max(1, math.ceil(self.window - (now % self.window)))
+        return False, retry_after
+
+    def check_all(self, **identifiers):
+        """
+        Check several scopes at once, e.g. ``check_all(ip=addr, user=user_id)``
+
+        Returns:
+            tuple: (allowed, retry_after_seconds) for the most restrictive scope
+        """
+        retry_after = 0
+        allowed = True
+        for scope, identifier in identifiers.items():
+            scope_allowed, scope_retry = self.check(scope, identifier)
+            if not scope_allowed:
+                allowed = False
+                retry_after = max(retry_after, scope_retry)
+        return allowed, retry_after
+
+def _weighted_count(current, previous, window, now):
+    elapsed = (now % window) / window
+    return current + previous * (1 - elapsed)
@@ -0,0 +1,121 @@
+"""
+Read models
+
+Lightweight records for read-only paths. Each loader runs a Core
+``select()`` for exactly the columns a record has and maps every row
+straight into a namedtuple or ``__slots__`` record, skipping the ORM's
+identity map, attribute instrumentation, change tracking and lazy
+relationships. Records carry the model's attribute names, so the
+serializers and the coupon rules accept them in place of model instances.
+They are detached snapshots: nothing written to them reaches the database.
+"""
+
+from collections import namedtuple
+from sqlalchemy import select, null, union_all
+
+from models import db, Product, Coupon, CouponRedemption, ArchivedRedemption
+
+# Read-only view of a product row. stock_quantity is not part of the
+# snapshot (it changes on every checkout) and is None unless overlaid.
+CatalogueProduct = namedtuple('CatalogueProduct', [
+    'id', 'name', 'description', 'category', 'theme', 'price',
+    'image_url', 'stock_quantity', 'is_active', 'created_at'
+])
+
+class CouponRecord:
+    """Read-only coupon definition with the model's attribute names and rule methods"""
+
+    __slots__ = ('id', 'code', 'name', 'description', 'coupon_type', 'discount_value',
+                 'min_purchase_amount', 'max_discount_amount', 'valid_from', 'valid_until',
+                 'usage_limit', 'usage_limit_per_user', 'applicable_themes', 'applicable_categories',
+                 'applicable_product_ids', 'is_active', 'created_at')
+
+    is_live = Coupon.is_live
+    is_exhausted = Coupon.is_exhausted
+    has_uses_left = Coupon.has_uses_left
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f'<CouponRecord {self.code}>'
+
+# A user's redemption with the code and name of its coupon
+RedemptionHistoryRecord = namedtuple('RedemptionHistoryRecord', [
+    'id', 'coupon_code', 'coupon_name', 'order_id', 'discount_applied', 'original_amount',
+    'final_amount', 'is_used', 'used_at', 'created_at'
+])
+
+products_table = Product.__table__
+coupons_table = Coupon.__table__
+redemptions_table = CouponRedemption.__table__
+archive_table = ArchivedRedemption.__table__
+
+PRODUCT_COLUMNS = (
+    products_table.c.id, products_table.c.name, products_table.c.description, products_table.c.category,
+    products_table.c.theme, products_table.c.price, products_table.c.image_url,
+    null().label('stock_quantity'), products_table.c.is_active, products_table.c.created_at
+)
+COUPON_COLUMNS = tuple(coupons_table.c[name] for name in CouponRecord.__slots__)
+
+def history_columns(table):
+    """RedemptionHistoryRecord columns from one redemption tier joined to coupons"""
+    columns = (
+        table.c.id, coupons_table.c.code, coupons_table.c.name, table.c.order_id, table.c.discount_applied,
+        table.c.original_amount, table.c.final_amount, table.c.is_used, table.c.used_at, table.c.created_at
+    )
+    # Labelled, as SQLite orders a UNION only by result column names
+    return tuple(column.label(name) for column, name in zip(columns, RedemptionHistoryRecord._fields))
+
+def load_products():
+    """Every product as a CatalogueProduct, in id order"""
+    rows = db.session.execute(select(*PRODUCT_COLUMNS).order_by(products_table.c.id))
+    return list(map(CatalogueProduct._make, rows))
+
+def load_coupons(coupon_ids=None):
+    """
+    Coupons as CouponRecords, in id order
+
+    Args:
+        coupon_ids (iterable, optional): Only these coupons; all when None
+
+    Returns:
+        list: CouponRecord for each coupon found
+    """
+    statement = select(*COUPON_COLUMNS).order_by(coupons_table.c.id)
+    if coupon_ids is not None:
+        statement = statement.where(coupons_table.c.id.in_(list(coupon_ids)))
+    return [CouponRecord(*row) for row in db.session.execute(statement)]
+
+def active_coupon_statement(coupon_code):
+    """Statement for the active coupon with this code"""
+    return select(*COUPON_COLUMNS).where(coupons_table.c.code == coupon_code, coupons_table.c.is_active == True)
+
+def find_active_coupon(coupon_code):
+    """The active coupon with this code as a CouponRecord, or None"""
+    row = db.session.execute(active_coupon_statement(coupon_code)).first()
+    return None if row is None else CouponRecord(*row)
+
+def stock_levels_statement(product_id=None, product_ids=None):
+    """Statement for (id, stock_quantity) of one product, of several, or of every active product"""
+    statement = select(products_table.c.id, products_table.c.stock_quantity)
+    if product_id is not None:
+        return statement.where(products_table.c.id == product_id)
+    if product_ids is not None:
+        return statement.where(products_table.c.id.in_(list(product_ids)))
+    return statement.where(products_table.c.is_active == True)
+
+def user_history_query(user_id):
+    """A user's redemptions from the live and archived tiers, newest first"""
+    history = union_all(*(
+        select(*history_columns(table))
+        .join_from(table, coupons_table, table.c.coupon_id == coupons_table.c.id)
+        .where(table.c.user_id == user_id)
+        for table in (redemptions_table, archive_table)
+    ))
+    return history.order_by(history.selected_columns.created_at.desc())
+
+def load_user_history(user_id):
+    """A user's redemptions, newest first, with their coupon's code and name joined in, archived ones included"""
+    return list(map(RedemptionHistoryRecord._make, db.session.execute(user_history_query(user_id))))
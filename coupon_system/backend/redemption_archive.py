@@ -0,0 +1,194 @@
+"""
+Hot and cold redemption tiers
+
+``coupon_redemptions`` is append-only, but validation, usage limits and
+history mostly read the redemptions of coupons that are still live. Those
+of coupons that are inactive or past ``valid_until`` and older than
+``REDEMPTION_ARCHIVE_AGE_DAYS`` are moved, in batches of
+``REDEMPTION_ARCHIVE_BATCH_SIZE``, into ``coupon_redemptions_archive``
+(same columns and ids). Each batch adds the counts it moves to
+``archived_redemption_totals`` in the same transaction, so the hot table
+and its indexes only hold what is still read often.
+
+Readers see both tiers. Usage counts add a coupon's archived totals (one
+primary-key row), per-user counts read the archive through its coupon and
+user index, and history and analytics read both tables. A coupon that is
+reactivated or extended keeps its archived usage.
+
+Usage:
+    python redemption_archive.py run       # archive every due redemption
+    python redemption_archive.py status    # rows in each tier and rows due
+"""
+
+from datetime import datetime, timedelta
+import sys
+from sqlalchemy import select, insert, update, delete, union_all, func, case, literal, or_
+
+from models import db, Coupon, CouponRedemption, ArchivedRedemption, ArchivedRedemptionTotal
+
+hot_table = CouponRedemption.__table__
+archive_table = ArchivedRedemption.__table__
+totals_table = ArchivedRedemptionTotal.__table__
+
+def redemption_totals(coupon_ids=None):
+    """
+    Per-coupon redemption counts over both tiers, as one statement
+
+    Args:
+        coupon_ids (iterable, optional): Only these coupons; all when None
+
+    Returns:
+        Select: Rows of (coupon_id, redemptions, used)
+    """
+    used = case((hot_table.c.is_used == True, 1), else_=0)
+    recent = select(
+        hot_table.c.coupon_id, func.count(hot_table.c.id).label('redemptions'),
+        func.coalesce(func.sum(used), 0).label('used')
+    ).group_by(hot_table.c.coupon_id)
+    archived = select(totals_table.c.coupon_id, totals_table.c.redemptions, totals_table.c.used)
+    if coupon_ids is not None:
+        coupon_ids = list(coupon_ids)
+        recent = recent.where(hot_table.c.coupon_id.in_(coupon_ids))
+        archived = archived.where(totals_table.c.coupon_id.in_(coupon_ids))
+    both = union_all(recent, archived).subquery('both_tiers')
+    return select(
+        both.c.coupon_id, func.sum(both.c.redemptions).label('redemptions'), func.sum(both.c.used).label('used')
+    ).group_by(both.c.coupon_id)
+
+def archived_count_columns(coupon_id, user_id=None):
+    """Scalar subqueries for a coupon's archived (redemptions, used, used by this user)"""
+    def total(column):
+        return select(func.coalesce(func.sum(column), 0)).where(
+            totals_table.c.coupon_id == coupon_id
+        ).scalar_subquery()
+
+    by_user = select(func.count(archive_table.c.id)).where(
+        archive_table.c.coupon_id == coupon_id,
+        archive_table.c.user_id == user_id,
+        archive_table.c.is_used == True
+    ).scalar_subquery()
+    return total(totals_table.c.redemptions), total(totals_table.c.used), by_user
+
+class RedemptionArchive:
+    """Moves the redemptions of finished coupons to the cold tier"""
+
+    def __init__(self, app=None):
+        self.age_days = 90
+        self.batch_size = 5000
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.age_days = app.config.get('REDEMPTION_ARCHIVE_AGE_DAYS', self.age_days)
+        self.batch_size = app.config.get('REDEMPTION_ARCHIVE_BATCH_SIZE', self.batch_size)
+        app.extensions['redemption_archive'] = self
+
+    def archive(self, now=None):
+        """
+        Move every due redemption to the archive, one transaction per batch
+
+        Args:
+            now (datetime, optional): Reference time for expiry and age
+
+        Returns:
+            dict: 'archived' redemptions and the 'coupons' they belong to
+        """
+        now = now or datetime.utcnow()
+        coupon_ids = self._finished_coupons(now)
+        archived = 0
+        coupons = set()
+        while coupon_ids:
+            moved = self._archive_batch(coupon_ids, now - timedelta(days=self.age_days), now)
+            if not moved:
+                break
+            archived += sum(moved.values())
+            coupons.update(moved)
+        return {'archived': archived, 'coupons': len(coupons)}
+
+    def status(self, now=None):
+        """Rows in each tier and hot rows the next run would move"""
+        now = now or datetime.utcnow()
+        coupon_ids = self._finished_coupons(now)
+        due = 0
+        if coupon_ids:
+            due = db.session.execute(select(func.count(hot_table.c.id)).where(
+                hot_table.c.coupon_id.in_(coupon_ids),
+                hot_table.c.created_at < now - timedelta(days=self.age_days)
+            )).scalar()
+        return {
+            'hot': db.session.execute(select(func.count(hot_table.c.id))).scalar(),
+            'archived': db.session.execute(select(func.count(archive_table.c.id))).scalar(),
+            'due': due
+        }
+
+    def _finished_coupons(self, now):
+        return db.session.execute(select(Coupon.id).where(or_(
+            Coupon.is_active == False,
+            Coupon.valid_until < now
+        ))).scalars().all()
+
+    def _archive_batch(self, coupon_ids, cutoff, now):
+        """Move one batch; returns {coupon_id: redemptions moved}"""
+        try:
+            ids = db.session.execute(
+                select(hot_table.c.id)
+                .where(hot_table.c.coupon_id.in_(coupon_ids), hot_table.c.created_at < cutoff)
+                .order_by(hot_table.c.id)
+                .limit(self.batch_size)
+            ).scalars().all()
+            if not ids:
+                db.session.rollback()
+                return {}
+
+            columns = [column.name for column in hot_table.columns]
+            db.session.execute(insert(archive_table).from_select(
+                columns + ['archived_at'],
+                select(*hot_table.columns, literal(now, db.DateTime)).where(hot_table.c.id.in_(ids))
+            ))
+            counts = db.session.execute(
+                select(hot_table.c.coupon_id, func.count(hot_table.c.id),
+                       func.coalesce(func.sum(case((hot_table.c.is_used == True, 1), else_=0)), 0))
+                .where(hot_table.c.id.in_(ids))
+                .group_by(hot_table.c.coupon_id)
+            ).all()
+            for coupon_id, redemptions, used in counts:
+                result = db.session.execute(
+                    update(totals_table).where(totals_table.c.coupon_id == coupon_id).values(
+                        redemptions=totals_table.c.redemptions + redemptions,
+                        used=totals_table.c.used + used,
+                        updated_at=now
+                    )
+                )
+                if result.rowcount == 0:
+                    db.session.execute(insert(totals_table).values(
+                        coupon_id=coupon_id, redemptions=redemptions, used=used, updated_at=now
+                    ))
+            # Core statements skip the session listeners: counts are unchanged across the tiers
+            db.session.execute(delete(hot_table).where(hot_table.c.id.in_(ids)))
+            db.session.commit()
+            return {coupon_id: redemptions for coupon_id, redemptions, _ in counts}
+        except Exception:
+            db.session.rollback()
+            raise
+
+redemption_archive = RedemptionArchive()
+
+def main(argv):
+    if len(argv) != 2 or argv[1] not in ('run', 'status'):
+        print(__doc__)
+        return 1
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        if argv[1] == 'run':
+            result = redemption_archive.archive()
+            print(f"Archived {result['archived']} redemptions of {result['coupons']} coupons")
+        status = redemption_archive.status()
+        print(f"Hot: {status['hot']} redemptions ({status['due']} due for archiving), "
+              f"archived: {status['archived']} (older than {redemption_archive.age_days} days, "
+              f"inactive or expired coupons)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,161 @@
+"""
+Change feed of coupon redemptions
+
+Every redemption insert, update and delete appends an event to
+``redemption_events`` in the same transaction, so the feed never shows a
+redemption that was rolled back and never misses one that committed.
+Readers page through the events by id (the cursor) in bounded batches, which
+is a primary-key range read on the outbox rather than a scan of
+``coupon_redemptions``. Named consumers store the cursor they have
+acknowledged; compaction deletes the events every consumer is past.
+
+Usage:
+    python redemption_feed.py consumers            # registered consumers and their cursors
+    python redemption_feed.py register finance
+    python redemption_feed.py compact              # drop events acknowledged by every consumer
+"""
+
+from datetime import datetime
+import sys
+from sqlalchemy import event, insert, select, update, delete
+from sqlalchemy.orm import Session
+
+from models import db, CouponRedemption, RedemptionEvent, FeedConsumer
+
+events_table = RedemptionEvent.__table__
+consumers_table = FeedConsumer.__table__
+
+# Redemption columns copied into each event
+EVENT_FIELDS = ('coupon_id', 'user_id', 'order_id', 'discount_applied', 'original_amount',
+                'final_amount', 'is_used', 'used_at')
+
+def events_after(after, limit):
+    """Statement for up to ``limit`` events past a cursor, oldest first"""
+    return select(events_table).where(events_table.c.id > after).order_by(events_table.c.id).limit(limit)
+
+class RedemptionFeed:
+    """Reads, acknowledgements and compaction for the redemption outbox"""
+
+    def __init__(self, app=None):
+        self.batch_size = 500
+        self.max_batch_size = 5000
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.batch_size = app.config.get('REDEMPTION_FEED_BATCH_SIZE', self.batch_size)
+        self.max_batch_size = app.config.get('REDEMPTION_FEED_MAX_BATCH_SIZE', self.max_batch_size)
+        app.extensions['redemption_feed'] = self
+
+    def record(self, connection, event_name, redemptions):
+        """Append events for redemption rows (dicts or objects) on the caller's transaction"""
+        rows = []
+        now = datetime.utcnow()
+        for redemption in redemptions:
+            get = redemption.get if isinstance(redemption, dict) else lambda name: getattr(redemption, name)
+            row = {name: get(name) for name in EVENT_FIELDS}
+            row.update(event=event_name, redemption_id=get('id'), recorded_at=now)
+            rows.append(row)
+        if rows:
+            connection.execute(insert(events_table), rows)
+
+    def read(self, after=0, limit=None):
+        """
+        Events past a cursor, oldest first
+
+        Args:
+            after (int): Last event id already seen
+            limit (int, optional): Batch size, capped at the configured maximum
+
+        Returns:
+            list: Event rows
+        """
+        return db.session.execute(events_after(after, self.batch_limit(limit))).all()
+
+    def batch_limit(self, limit=None):
+        """Events per batch for a requested size"""
+        return max(1, min(limit or self.batch_size, self.max_batch_size))
+
+    def consumer(self, name):
+        return db.session.get(FeedConsumer, name)
+
+    def register(self, name, cursor=0):
+        """Create a consumer (or return the existing one)"""
+        consumer = self.consumer(name)
+        if consumer is None:
+            consumer = FeedConsumer(name=name, cursor=cursor)
+            db.session.add(consumer)
+            db.session.commit()
+        return consumer
+
+    def acknowledge(self, name, cursor):
+        """Move a consumer's cursor forward; returns False for an unknown consumer"""
+        db.session.execute(
+            update(consumers_table)
+            .where(consumers_table.c.name == name, consumers_table.c.cursor < cursor)
+            .values(cursor=cursor, acknowledged_at=datetime.utcnow())
+        )
+        db.session.commit()
+        return self.consumer(name) is not None
+
+    def compact(self):
+        """Delete events every registered consumer has acknowledged; returns how many"""
+        floor = db.session.execute(select(db.func.min(consumers_table.c.cursor))).scalar()
+        if not floor:
+            # No consumers (or one that has read nothing): keep everything
+            return 0
+        result = db.session.execute(delete(events_table).where(events_table.c.id <= floor))
+        db.session.commit()
+        return result.rowcount
+
+def serialize_event(row):
+    """Feed line for an event row"""
+    return {
+        'cursor': row.id,
+        'event': row.event,
+        'redemption_id': row.redemption_id,
+        'coupon_id': row.coupon_id,
+        'user_id': row.user_id,
+        'order_id': row.order_id,
+        'discount_applied': row.discount_applied,
+        'original_amount': row.original_amount,
+        'final_amount': row.final_amount,
+        'is_used': row.is_used,
+        'used_at': row.used_at.isoformat() if row.used_at else None,
+        'recorded_at': row.recorded_at.isoformat() if row.recorded_at else None
+    }
+
+redemption_feed = RedemptionFeed()
+
+@event.listens_for(Session, 'after_flush')
+def _record_redemption_events(session, flush_context):
+    connection = None
+    for event_name, objects in (('created', session.new), ('updated', session.dirty), ('deleted', session.deleted)):
+        redemptions = [obj for obj in objects if isinstance(obj, CouponRedemption)
+                       and (event_name != 'updated' or session.is_modified(obj, include_collections=False))]
+        if redemptions:
+            connection = connection or session.connection()
+            redemption_feed.record(connection, event_name, redemptions)
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else None
+    if command not in ('consumers', 'register', 'compact') or (command == 'register' and len(argv) < 3):
+        print(__doc__)
+        return 1
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        if command == 'register':
+            consumer = redemption_feed.register(argv[2])
+            print(f'{consumer.name}: cursor {consumer.cursor}')
+        elif command == 'compact':
+            print(f'Deleted {redemption_feed.compact()} acknowledged events')
+        else:
+            latest = db.session.execute(select(db.func.max(events_table.c.id))).scalar() or 0
+            for consumer in FeedConsumer.query.order_by(FeedConsumer.name):
+                print(f'{consumer.name}: cursor {consumer.cursor}, {latest - consumer.cursor} behind')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
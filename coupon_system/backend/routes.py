@@ -0,0 +1,638 @@
+from flask import Blueprint, current_app, request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+from werkzeug.local import LocalProxy
+from datetime import datetime
+import hmac
+import json
+
+from models import db, User, Coupon, CouponUsageLog
+from models import ThemeType, ProductCategory
+from catalogue import catalogue
+from read_models import load_coupons, load_user_history, stock_levels_statement
+from serializers import serialize_redemption_history
+from product_search import product_search, SORTS
+from serialization_cache import serialization_cache, close_fragment, join_fragments
+from usage_counters import usage_counters
+from validity_schedule import validity_schedule
+from flash_sale import flash_sale
+from user_eligibility import user_eligibility
+from password_hasher import HasherOverloaded
+from code_filter import coupon_code_filter
+from redemption_feed import redemption_feed, serialize_event
+from redemption_archive import redemption_totals
+from bulk_apply import parse_orders
+from batch_requests import batch_dispatcher, encode_results, BatchError
+from tenancy import tenancy
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+# Per-app services, set up by create_app()
+coupon_service = LocalProxy(lambda: current_app.extensions['coupon_service'])
+inventory_service = LocalProxy(lambda: current_app.extensions['inventory_service'])
+password_hasher = LocalProxy(lambda: current_app.extensions['password_hasher'])
+rate_limiter = LocalProxy(lambda: current_app.extensions['rate_limiter'])
+bulk_applier = LocalProxy(lambda: current_app.extensions['bulk_applier'])
+
+# Helper functions
+def log_coupon_usage(coupon_code, user_id, action, success, error_message=None):
+    """Log coupon usage for analytics and debugging"""
+    log_entry = CouponUsageLog(
+        coupon_code=coupon_code,
+        user_id=user_id,
+        action=action,
+        success=success,
+        error_message=error_message,
+        ip_address=request.remote_addr,
+        user_agent=request.headers.get('User-Agent')
+    )
+    db.session.add(log_entry)
+    db.session.commit()
+
+def load_stock_levels(product_id=None, product_ids=None):
+    """Current stock by product id; stock is volatile so it is not in the catalogue snapshot"""
+    return dict(db.session.execute(stock_levels_statement(product_id, product_ids)).all())
+
+def json_bytes_response(body, status=200):
+    """Wrap an already encoded JSON body in a response"""
+    return current_app.response_class(body, status=status, mimetype='application/json')
+
+def load_coupon_fragments(coupon_ids):
+    """Cached (fragment, rules) by coupon id; rows are only loaded for coupons not cached yet"""
+    cached = {}
+    missing = []
+    for coupon_id in coupon_ids:
+        entry = serialization_cache.cached_coupon(coupon_id)
+        if entry is None:
+            missing.append(coupon_id)
+        else:
+            cached[coupon_id] = entry
+    if missing:
+        for coupon in load_coupons(missing):
+            cached[coupon.id] = serialization_cache.coupon_fragment(coupon)
+    return cached
+
+def coupon_analytics():
+    """Usage totals and the ten most used coupons of the current tenant"""
+    total_coupons = Coupon.query.count()
+    active_coupons = Coupon.query.filter_by(is_active=True).count()
+    # Live and archived redemptions, counted per coupon
+    totals = redemption_totals().subquery()
+    total_redemptions = db.session.query(db.func.coalesce(db.func.sum(totals.c.used), 0)).scalar()
+
+    # Most used coupons
+    most_used_query = db.session.query(
+        Coupon.code,
+        Coupon.name,
+        totals.c.used.label('usage_count')
+    ).join(totals, totals.c.coupon_id == Coupon.id).filter(totals.c.used > 0).order_by(totals.c.used.desc()).limit(10)
+
+    most_used = [{'code': row.code, 'name': row.name, 'usage_count': row.usage_count}
+                 for row in most_used_query.all()]
+
+    return {
+        'total_coupons': total_coupons,
+        'active_coupons': active_coupons,
+        'total_redemptions': total_redemptions,
+        'most_used_coupons': most_used
+    }
+
+def token_forbidden_response(setting, header, feature):
+    """403 unless the request carries the token configured in ``setting``, or None when allowed"""
+    token = current_app.config.get(setting)
+    if not token:
+        return jsonify({'error': f'{feature} is not enabled'}), 403
+    if not hmac.compare_digest(request.headers.get(header, ''), token):
+        return jsonify({'error': f'Invalid {header} header'}), 403
+    return None
+
+def auth_busy_response():
+    """Fast 503 returned when the password hashing pool is saturated"""
+    response = jsonify({'error': 'Authentication service is busy, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def verified_user_id():
+    """Identity of the request's valid JWT, or None when it has none (or an invalid one)"""
+    try:
+        verify_jwt_in_request(optional=True)
+    except (JWTExtendedException, PyJWTError):
+        return None
+    return get_jwt_identity()
+
+def rate_limited_response(retry_after):
+    """429 returned before any database work for throttled clients"""
+    response = jsonify({'valid': False, 'message': 'Too many requests, please slow down'})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+# Authentication Routes
+@api.route('/auth/register', methods=['POST'])
+def register():
+    """Register a new user"""
+    try:
+        data = request.get_json()
+        
+        # Validate input
+        if not data.get('username') or not data.get('email') or not data.get('password'):
+            return jsonify({'error': 'Username, email, and password are required'}), 400
+        
+        # Check if user exists
+        if User.query.filter_by(username=data['username']).first():
+            return jsonify({'error': 'Username already exists'}), 400
+        
+        if User.query.filter_by(email=data['email']).first():
+            return jsonify({'error': 'Email already exists'}), 400
+        
+        # Create user
+        user = User(
+            username=data['username'],
+            email=data['email'],
+            password_hash=password_hasher.hash(data['password'])
+        )
+        
+        db.session.add(user)
+        db.session.commit()
+        
+        # Generate access token
+        access_token = create_access_token(identity=user.id)
+        
+        return jsonify({
+            'message': 'User registered successfully',
+            'access_token': access_token,
+            'user': {
+                'id': user.id,
+                'username': user.username,
+                'email': user.email
+            }
+        }), 201
+        
+    except HasherOverloaded:
+        return auth_busy_response()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/auth/login', methods=['POST'])
+def login():
+    """Login user"""
+    try:
+        data = request.get_json()
+        
+        if not data.get('username') or not data.get('password'):
+            return jsonify({'error': 'Username and password are required'}), 400
+        
+        user = User.query.filter_by(username=data['username']).first()
+        
+        if user and password_hasher.verify(user.password_hash, data['password']):
+            access_token = create_access_token(identity=user.id)
+            return jsonify({
+                'message': 'Login successful',
+                'access_token': access_token,
+                'user': {
+                    'id': user.id,
+                    'username': user.username,
+                    'email': user.email
+                }
+            }), 200
+        
+        return jsonify({'error': 'Invalid credentials'}), 401
+        
+    except HasherOverloaded:
+        return auth_busy_response()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Product Routes
+@api.route('/products', methods=['GET'])
+def get_products():
+    """Get all products with optional filtering"""
+    try:
+        theme = request.args.get('theme')
+        category = request.args.get('category')
+        
+        theme_enum = None
+        if theme:
+            try:
+                theme_enum = ThemeType(theme.upper())
+            except ValueError:
+                return jsonify({'error': 'Invalid theme'}), 400
+        
+        category_enum = None
+        if category:
+            try:
+                category_enum = ProductCategory(category.upper())
+            except ValueError:
+                return jsonify({'error': 'Invalid category'}), 400
+        
+        snapshot = catalogue.snapshot()
+        stock = load_stock_levels()
+        fragments = [
+            close_fragment(serialization_cache.product_fragment(p, snapshot.version), stock_quantity=stock.get(p.id))
+            for p in snapshot.filter(theme_enum, category_enum)
+        ]
+        return json_bytes_response(join_fragments('products', fragments))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/products/search', methods=['GET'])
+def search_products():
+    """Search products by name and description, with price filters, sorting and facet counts"""
+    try:
+        args = request.args
+        theme = args.get('theme')
+        category = args.get('category')
+        sort = args.get('sort', 'relevance')
+        try:
+            theme_enum = ThemeType(theme.upper()) if theme else None
+            category_enum = ProductCategory(category.upper()) if category else None
+        except ValueError:
+            return jsonify({'error': 'Invalid theme or category'}), 400
+        try:
+            min_price = float(args['min_price']) if args.get('min_price') else None
+            max_price = float(args['max_price']) if args.get('max_price') else None
+            limit = int(args['limit']) if args.get('limit') else None
+            offset = int(args.get('offset') or 0)
+        except ValueError:
+            return jsonify({'error': 'min_price and max_price must be numbers, limit and offset integers'}), 400
+        if sort not in SORTS:
+            return jsonify({'error': f'sort must be one of: {", ".join(SORTS)}'}), 400
+
+        result = product_search.search(args.get('q'), min_price, max_price, theme_enum, category_enum,
+                                       sort, limit, offset)
+        stock = load_stock_levels(product_ids=[p.id for p in result['products']])
+        fragments = [
+            close_fragment(serialization_cache.product_fragment(p, result['version']), stock_quantity=stock.get(p.id))
+            for p in result['products']
+        ]
+        extra = json.dumps({'total': result['total'], 'facets': result['facets']}, separators=(',', ':'))
+        return json_bytes_response(join_fragments('products', fragments)[:-1] + b',' + extra[1:].encode('utf-8'))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/products/<int:product_id>', methods=['GET'])
+def get_product(product_id):
+    """Get a specific product"""
+    try:
+        snapshot = catalogue.snapshot()
+        product = snapshot.get(product_id)
+        if product is None:
+            return jsonify({'error': 'Product not found'}), 404
+        stock = load_stock_levels(product_id)
+        fragment = close_fragment(serialization_cache.product_fragment(product, snapshot.version),
+                                  stock_quantity=stock.get(product_id))
+        return json_bytes_response(b'{"product":' + fragment + b'}')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Coupon Routes
+@api.route('/coupons/validate', methods=['POST'])
+def validate_coupon():
+    """Validate a coupon code"""
+    try:
+        data = request.get_json()
+        coupon_code = data.get('code', '').strip().upper()
+        user_id = data.get('user_id')
+        cart_items = data.get('cart_items', [])  # List of {product_id, quantity, price}
+        
+        # Throttle before touching the database or the usage log. The body's user_id is
+        # unverified, so the per-user budget follows the token and anonymous calls count per IP only
+        allowed, retry_after = rate_limiter.check_all(ip=request.remote_addr, user=verified_user_id())
+        if not allowed:
+            return rate_limited_response(retry_after)
+        
+        if not coupon_code:
+            return jsonify({'error': 'Coupon code is required'}), 400
+        
+        # Codes that cannot exist are answered without a query or a log write
+        if not coupon_code_filter.might_exist(coupon_code):
+            return jsonify({'valid': False, 'message': 'Coupon code not found or inactive'}), 400
+        
+        result = coupon_service.validate_coupon(coupon_code, user_id, cart_items)
+        
+        # Log the validation attempt
+        log_coupon_usage(coupon_code, user_id, 'validate', result['valid'], 
+                        result.get('message') if not result['valid'] else None)
+        
+        return jsonify(result), 200 if result['valid'] else 400
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/coupons/apply', methods=['POST'])
+@jwt_required()
+def apply_coupon():
+    """Apply a coupon to an order"""
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json()
+        
+        coupon_code = data.get('code', '').strip().upper()
+        order_id = data.get('order_id')
+        cart_items = data.get('cart_items', [])
+        original_amount = data.get('original_amount')
+        
+        if not all([coupon_code, order_id, cart_items, original_amount]):
+            return jsonify({'error': 'Missing required fields'}), 400
+        
+        if not coupon_code_filter.might_exist(coupon_code):
+            log_coupon_usage(coupon_code, user_id, 'apply', False, 'Coupon code not found or inactive')
+            return jsonify({'success': False, 'message': 'Coupon code not found or inactive'}), 400
+        
+        # Flash-sale coupons admit requests from an in-memory slot pool, refusing
+        # the rest before any database work or log write
+        admitted = flash_sale.admit(coupon_code)
+        if admitted is False:
+            return jsonify({'success': False, 'message': 'Coupon has expired or reached usage limit'}), 400
+        
+        result = {}
+        try:
+            result = coupon_service.apply_coupon(coupon_code, user_id, order_id, cart_items, original_amount)
+        finally:
+            if admitted:
+                flash_sale.finish(coupon_code, result.get('success', False))
+        
+        # Log the application attempt
+        log_coupon_usage(coupon_code, user_id, 'apply', result.get('success', False),
+                        result.get('message') if not result.get('success') else None)
+        
+        if result.get('success'):
+            return jsonify(result), 200
+        else:
+            return jsonify(result), 400
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/coupons/apply/bulk', methods=['POST'])
+def apply_coupons_bulk():
+    """Apply coupons to a batch of orders sent as NDJSON; streams one NDJSON result per order"""
+    try:
+        forbidden = token_forbidden_response('BULK_APPLY_TOKEN', 'X-Bulk-Token', 'Bulk apply')
+        if forbidden:
+            return forbidden
+        
+        orders = parse_orders(request.get_data(as_text=True).splitlines())
+        ip_address, user_agent = request.remote_addr, request.headers.get('User-Agent')
+        
+        # Each chunk is committed before its results are sent
+        def generate():
+            for result in bulk_applier.apply(orders, ip_address, user_agent):
+                yield json.dumps(result, separators=(',', ':')) + '\n'
+        
+        return current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/coupons', methods=['GET'])
+def get_available_coupons():
+    """Get all available coupons"""
+    try:
+        theme = request.args.get('theme')
+        category = request.args.get('category')
+        
+        # Live ids come from the validity schedule
+        live_ids = sorted(validity_schedule.valid_ids())
+        cached = load_coupon_fragments(live_ids)
+        
+        fragments = []
+        for coupon_id in live_ids:
+            if coupon_id not in cached:
+                continue
+            fragment, rules = cached[coupon_id]
+            
+            # Filter by theme or category if specified
+            if theme and theme.upper() not in rules.applicable_themes:
+                continue
+            if category and category.upper() not in rules.applicable_categories:
+                continue
+            
+            redemption_count, usage_count = usage_counters.get(coupon_id)
+            fragments.append(close_fragment(fragment, is_valid=not rules.is_exhausted(redemption_count),
+                                            usage_count=usage_count))
+        
+        return json_bytes_response(join_fragments('coupons', fragments))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/coupons/mine', methods=['GET'])
+@jwt_required()
+def get_my_coupons():
+    """Get the coupons the current user can use right now"""
+    try:
+        user_id = get_jwt_identity()
+        
+        coupon_ids, uses_left = user_eligibility.usable_coupons(user_id)
+        cached = load_coupon_fragments(coupon_ids)
+        
+        fragments = []
+        for coupon_id in coupon_ids:
+            if coupon_id not in cached:
+                continue
+            fragments.append(close_fragment(cached[coupon_id][0], is_valid=True,
+                                            usage_count=usage_counters.get(coupon_id)[1],
+                                            uses_left=uses_left[coupon_id]))
+        
+        return json_bytes_response(join_fragments('coupons', fragments))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/coupons/user-history', methods=['GET'])
+@jwt_required()
+def get_user_coupon_history():
+    """Get user's coupon usage history"""
+    try:
+        user_id = get_jwt_identity()
+        
+        history = [serialize_redemption_history(record) for record in load_user_history(user_id)]
+        
+        return jsonify({'history': history}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Stock Routes
+@api.route('/stock/reserve', methods=['POST'])
+@jwt_required()
+def reserve_stock():
+    """Reserve stock for the items in a cart"""
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json()
+        
+        cart_items = data.get('cart_items', [])
+        if not cart_items:
+            return jsonify({'error': 'Cart items are required'}), 400
+        
+        result = inventory_service.reserve_stock(cart_items, user_id, data.get('order_id'), data.get('ttl'))
+        
+        if result.get('success'):
+            return jsonify(result), 201
+        return jsonify(result), 409 if result.get('unavailable') else 400
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/stock/reservations/<reservation_id>/release', methods=['POST'])
+@jwt_required()
+def release_stock(reservation_id):
+    """Release a stock reservation"""
+    try:
+        result = inventory_service.release_reservation(reservation_id, user_id=get_jwt_identity())
+        if result.get('not_found'):
+            return jsonify(result), 404
+        return jsonify(result), 200 if result.get('success') else 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/stock/reservations/<reservation_id>/commit', methods=['POST'])
+@jwt_required()
+def commit_stock(reservation_id):
+    """Confirm a stock reservation once the order is paid"""
+    try:
+        result = inventory_service.commit_reservation(reservation_id, user_id=get_jwt_identity())
+        if result.get('not_found'):
+            return jsonify(result), 404
+        return jsonify(result), 200 if result.get('success') else 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Analytics Routes (for admin)
+@api.route('/analytics/coupons', methods=['GET'])
+def get_coupon_analytics():
+    """Get coupon usage analytics"""
+    try:
+        return jsonify(coupon_analytics()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/analytics/tenants', methods=['GET'])
+def get_tenant_analytics():
+    """Coupon usage analytics summed over every tenant database"""
+    try:
+        per_tenant = tenancy.each(coupon_analytics)
+        most_used = [
+            dict(coupon, tenant=tenant)
+            for tenant, analytics in per_tenant.items()
+            for coupon in analytics['most_used_coupons']
+        ]
+        most_used.sort(key=lambda coupon: coupon['usage_count'], reverse=True)
+
+        return jsonify({
+            'total_coupons': sum(analytics['total_coupons'] for analytics in per_tenant.values()),
+            'active_coupons': sum(analytics['active_coupons'] for analytics in per_tenant.values()),
+            'total_redemptions': sum(analytics['total_redemptions'] for analytics in per_tenant.values()),
+            'most_used_coupons': most_used[:10],
+            'tenants': {
+                tenant or 'default': {key: value for key, value in analytics.items() if key != 'most_used_coupons'}
+                for tenant, analytics in per_tenant.items()
+            }
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Redemption Feed Routes
+@api.route('/feeds/redemptions', methods=['GET'])
+def get_redemption_feed():
+    """Stream redemption events past a cursor as NDJSON"""
+    try:
+        forbidden = token_forbidden_response('REDEMPTION_FEED_TOKEN', 'X-Feed-Token', 'Redemption feed')
+        if forbidden:
+            return forbidden
+        
+        # Resume from ?after=, or from a registered consumer's acknowledged cursor
+        consumer_name = request.args.get('consumer')
+        after = request.args.get('after', type=int)
+        if after is None:
+            after = 0
+            if consumer_name:
+                consumer = redemption_feed.consumer(consumer_name)
+                if consumer is None:
+                    return jsonify({'error': 'Consumer not found'}), 404
+                after = consumer.cursor
+        
+        limit = request.args.get('limit', type=int)
+        events = redemption_feed.read(after, limit)
+        next_cursor = events[-1].id if events else after
+        
+        def generate():
+            for row in events:
+                yield json.dumps(serialize_event(row), separators=(',', ':')) + '\n'
+        
+        response = current_app.response_class(generate(), mimetype='application/x-ndjson')
+        response.headers['X-Feed-Cursor'] = str(next_cursor)
+        response.headers['X-Feed-More'] = 'true' if len(events) == redemption_feed.batch_limit(limit) else 'false'
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/feeds/redemptions/consumers', methods=['POST'])
+def register_feed_consumer():
+    """Register a named feed consumer"""
+    try:
+        forbidden = token_forbidden_response('REDEMPTION_FEED_TOKEN', 'X-Feed-Token', 'Redemption feed')
+        if forbidden:
+            return forbidden
+        
+        data = request.get_json()
+        name = (data.get('name') or '').strip()
+        if not name:
+            return jsonify({'error': 'Consumer name is required'}), 400
+        
+        cursor = data.get('cursor', 0)
+        if not isinstance(cursor, int):
+            return jsonify({'error': 'Cursor must be an event id'}), 400
+        
+        consumer = redemption_feed.register(name, cursor)
+        return jsonify({'name': consumer.name, 'cursor': consumer.cursor}), 201
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/feeds/redemptions/consumers/<name>/ack', methods=['POST'])
+def acknowledge_feed_events(name):
+    """Record that a consumer has processed every event up to a cursor"""
+    try:
+        forbidden = token_forbidden_response('REDEMPTION_FEED_TOKEN', 'X-Feed-Token', 'Redemption feed')
+        if forbidden:
+            return forbidden
+        
+        cursor = (request.get_json() or {}).get('cursor')
+        if not isinstance(cursor, int):
+            return jsonify({'error': 'Cursor is required'}), 400
+        
+        if not redemption_feed.acknowledge(name, cursor):
+            return jsonify({'error': 'Consumer not found'}), 404
+        return jsonify({'name': name, 'cursor': redemption_feed.consumer(name).cursor}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Batch Routes
+@api.route('/batch', methods=['POST'])
+def run_batch():
+    """Run several API calls in one round trip and return every response"""
+    try:
+        try:
+            sub_requests = batch_dispatcher.parse(request.get_json(silent=True))
+        except BatchError as e:
+            return jsonify({'error': str(e)}), 400
+        return json_bytes_response(encode_results(batch_dispatcher.run(sub_requests)))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Health check
+@api.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.utcnow().isoformat(),
+        'version': '1.0.0'
+    }), 200
@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import Coupon
+from tenancy import TenantScoped
+from serializers import coupon_static_fields, product_static_fields
+
+class SerializationCache:
+    """Pre-encoded JSON fragments for products and coupons
+
+    Each entity's static fields are encoded once per entity version and
+    stored as the bytes of an *open* JSON object (no closing brace). Volatile
+    fields such as stock or usage counts are appended at response time and
+    list responses are built by joining the cached bytes, so steady-state
+    requests do no dict building, ``isoformat()`` or ``json.loads`` at all.
+
+    Products are versioned by the catalogue snapshot version. Coupons are
+    dropped from the cache when they change and otherwise expire after
+    ``SERIALIZATION_CACHE_TTL`` seconds, which bounds staleness from writes
+    made by other processes.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 300
+        self._entries = {}  # (kind, id) -> (version, expires_at, fragment, extra)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('SERIALIZATION_CACHE_TTL', self.ttl)
+        app.extensions['serialization_cache'] = self
+
+    def product_fragment(self, product, version):
+        """Open JSON object for a product's static fields at a catalogue version"""
+        entry = self._lookup(('product', product.id), version)
+        if entry is None:
+            entry = self._store(('product', product.id), version, product_static_fields(product))
+        return entry[2]
+
+    def coupon_fragment(self, coupon):
+        """Return (open JSON object, validity rules) for a coupon's static fields"""
+        entry = self._lookup(('coupon', coupon.id), None)
+        if entry is None:
+            rules = CouponRules(coupon)
+            entry = self._store(('coupon', coupon.id), None, coupon_static_fields(coupon), rules)
+        return entry[2], entry[3]
+
+    def cached_coupon(self, coupon_id):
+        """(open JSON object, rules) for a cached coupon, or None on a miss"""
+        entry = self._lookup(('coupon', coupon_id), None)
+        if entry is None:
+            return None
+        return entry[2], entry[3]
+
+    def invalidate(self, kind, entity_id=None):
+        """Drop one cached entity, or every entity of a kind"""
+        with self._lock:
+            if entity_id is not None:
+                self._entries.pop((kind, entity_id), None)
+            else:
+                for key in [k for k in self._entries if k[0] == kind]:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, key, version):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version or entry[1] < time.monotonic():
+            return None
+        return entry
+
+    def _store(self, key, version, fields, extra=None):
+        encoded = json.dumps(fields, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        entry = (version, time.monotonic() + self.ttl, encoded[:-1], extra)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+class CouponRules:
+    """The columns listing filters and usage checks read, kept beside the fragment"""
+
+    __slots__ = ('usage_limit', 'applicable_themes', 'applicable_categories')
+
+    def __init__(self, coupon):
+        self.usage_limit = coupon.usage_limit
+        self.applicable_themes = json.loads(coupon.applicable_themes) if coupon.applicable_themes else []
+        self.applicable_categories = json.loads(coupon.applicable_categories) if coupon.applicable_categories else []
+
+    def is_exhausted(self, redemption_count):
+        return Coupon.is_exhausted(self, redemption_count)
+
+def close_fragment(fragment, **volatile):
+    """Append volatile fields to an open fragment and close the object"""
+    if not volatile:
+        return fragment + b'}'
+    extra = json.dumps(volatile, separators=(',', ':'))
+    return fragment + b',' + extra[1:].encode('utf-8')
+
+def join_fragments(key, fragments):
+    """Assemble ``{"key": [fragment, ...]}`` from encoded objects"""
+    return b''.join([b'{"', key.encode('utf-8'), b'":[', b','.join(fragments), b']}'])
+
+serialization_cache = TenantScoped(SerializationCache)
+
+@event.listens_for(Coupon, 'after_update')
+@event.listens_for(Coupon, 'after_delete')
+def _queue_coupon_change(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_coupons', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def _drop_changed_coupons(session):
+    for coupon_id in session.info.pop('changed_coupons', ()):
+        serialization_cache.invalidate('coupon', coupon_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_coupons(session):
+    session.info.pop('changed_coupons', None)
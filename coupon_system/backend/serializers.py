@@ -0,0 +1,65 @@
+import json
+
+def serialize_coupon(coupon):
+    """Serialize coupon object to JSON"""
+    data = coupon_static_fields(coupon)
+    data['is_valid'] = coupon.is_valid
+    data['usage_count'] = coupon.get_usage_count()
+    return data
+
+def coupon_static_fields(coupon):
+    """Coupon fields that only change when the coupon itself is edited"""
+    return {
+        'id': coupon.id,
+        'code': coupon.code,
+        'name': coupon.name,
+        'description': coupon.description,
+        'coupon_type': coupon.coupon_type.value,
+        'discount_value': coupon.discount_value,
+        'min_purchase_amount': coupon.min_purchase_amount,
+        'max_discount_amount': coupon.max_discount_amount,
+        'valid_from': coupon.valid_from.isoformat() if coupon.valid_from else None,
+        'valid_until': coupon.valid_until.isoformat() if coupon.valid_until else None,
+        'usage_limit': coupon.usage_limit,
+        'usage_limit_per_user': coupon.usage_limit_per_user,
+        'applicable_themes': json.loads(coupon.applicable_themes) if coupon.applicable_themes else [],
+        'applicable_categories': json.loads(coupon.applicable_categories) if coupon.applicable_categories else [],
+        'applicable_product_ids': json.loads(coupon.applicable_product_ids) if coupon.applicable_product_ids else [],
+        'is_active': coupon.is_active,
+        'created_at': coupon.created_at.isoformat()
+    }
+
+def serialize_redemption_history(redemption):
+    """Serialize a user's redemption (with its coupon's code and name) to JSON"""
+    return {
+        'id': redemption.id,
+        'coupon_code': redemption.coupon_code,
+        'coupon_name': redemption.coupon_name,
+        'order_id': redemption.order_id,
+        'discount_applied': redemption.discount_applied,
+        'original_amount': redemption.original_amount,
+        'final_amount': redemption.final_amount,
+        'is_used': redemption.is_used,
+        'used_at': redemption.used_at.isoformat() if redemption.used_at else None,
+        'created_at': redemption.created_at.isoformat()
+    }
+
+def serialize_product(product):
+    """Serialize product object to JSON"""
+    data = product_static_fields(product)
+    data['stock_quantity'] = product.stock_quantity
+    return data
+
+def product_static_fields(product):
+    """Product fields that only change when the product itself is edited"""
+    return {
+        'id': product.id,
+        'name': product.name,
+        'description': product.description,
+        'category': product.category.value,
+        'theme': product.theme.value,
+        'price': product.price,
+        'image_url': product.image_url,
+        'is_active': product.is_active,
+        'created_at': product.created_at.isoformat()
+    }
@@ -0,0 +1,395 @@
+"""
+Memory-mapped store of product and coupon definitions shared by all workers
+
+One process writes the catalogue and the coupon definitions into a single
+file of fixed-width columns (ids, enum codes, prices, timestamps, string
+offsets) plus one UTF-8 string blob. Every worker maps the file read-only
+and reads records straight out of the mapping, so the data lives once in
+the OS page cache however many workers run, and a new worker is warm as
+soon as it maps the file.
+
+A rebuild writes a new versioned file next to the old one and renames it
+over the store path. Readers notice the new inode on their next check and
+map it; requests already holding the old mapping finish on it.
+
+Usage:
+    python shared_store.py build    # write the store from the database
+    python shared_store.py watch    # rebuild whenever coupons or products change
+    python shared_store.py info     # print the version and record counts
+"""
+
+from array import array
+from datetime import datetime, timedelta
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from models import db, Product, CacheChange, ThemeType, ProductCategory, CouponType
+from read_models import CatalogueProduct, CouponRecord, load_coupons
+
+MAGIC = b'CPST'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHQdI')  # magic, format, reserved, store version, built at, section count
+SECTION = struct.Struct('<24sQQc7x')  # name, byte offset, item count, array typecode
+ALIGN = 8
+
+NULL_TIME = -2 ** 63
+NULL_INT = -1
+NULL_LENGTH = 0xFFFFFFFF
+EPOCH = datetime(1970, 1, 1)
+
+THEMES = list(ThemeType)
+CATEGORIES = list(ProductCategory)
+COUPON_TYPES = list(CouponType)
+
+def _to_micros(value):
+    return NULL_TIME if value is None else (value - EPOCH) // timedelta(microseconds=1)
+
+def _from_micros(value):
+    return None if value == NULL_TIME else EPOCH + timedelta(microseconds=value)
+
+def _to_float(value):
+    return float('nan') if value is None else value
+
+def _from_float(value):
+    return None if value != value else value
+
+class _StoreWriter:
+    """Collects typed columns and strings, then lays them out in one file"""
+
+    def __init__(self):
+        self.sections = []  # (name, typecode, bytes, count)
+        self.blob = bytearray()
+
+    def column(self, name, typecode, values):
+        data = array(typecode, values)
+        self.sections.append((name, typecode, data.tobytes(), len(data)))
+
+    def strings(self, name, values):
+        offsets, lengths = array('I'), array('I')
+        for value in values:
+            if value is None:
+                offsets.append(0)
+                lengths.append(NULL_LENGTH)
+                continue
+            encoded = value.encode('utf-8')
+            offsets.append(len(self.blob))
+            lengths.append(len(encoded))
+            self.blob += encoded
+        self.column(name + '.off', 'I', offsets)
+        self.column(name + '.len', 'I', lengths)
+
+    def dump(self, version):
+        sections = self.sections + [('strings', 'B', bytes(self.blob), len(self.blob))]
+        offset = HEADER.size + SECTION.size * len(sections)
+        table, body = [], []
+        for name, typecode, data, count in sections:
+            padding = -offset % ALIGN
+            body.append(b'\0' * padding)
+            offset += padding
+            table.append(SECTION.pack(name.encode('ascii'), offset, count, typecode.encode('ascii')))
+            body.append(data)
+            offset += len(data)
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, version, time.time(), len(sections))
+        return b''.join([header] + table + body)
+
+def read_version(path):
+    """Version of the store at ``path``, or 0 if there is none"""
+    try:
+        with open(path, 'rb') as f:
+            magic, _, _, version, _, _ = HEADER.unpack(f.read(HEADER.size))
+    except (FileNotFoundError, struct.error):
+        return 0
+    return version if magic == MAGIC else 0
+
+def write_store(path):
+    """
+    Write products and coupons from the database to a new store file
+
+    Args:
+        path (str): Store path; the new file is renamed over it atomically
+
+    Returns:
+        int: Version of the store written
+    """
+    products = db.session.query(
+        Product.id, Product.name, Product.description, Product.category, Product.theme,
+        Product.price, Product.image_url, Product.is_active, Product.created_at
+    ).order_by(Product.id).all()
+    coupons = load_coupons()
+
+    writer = _StoreWriter()
+    writer.column('p.id', 'I', [p.id for p in products])
+    writer.column('p.theme', 'B', [THEMES.index(p.theme) for p in products])
+    writer.column('p.category', 'B', [CATEGORIES.index(p.category) for p in products])
+    writer.column('p.active', 'B', [1 if p.is_active else 0 for p in products])
+    writer.column('p.price', 'd', [p.price for p in products])
+    writer.column('p.created', 'q', [_to_micros(p.created_at) for p in products])
+    writer.strings('p.name', [p.name for p in products])
+    writer.strings('p.description', [p.description for p in products])
+    writer.strings('p.image_url', [p.image_url for p in products])
+
+    writer.column('c.id', 'I', [c.id for c in coupons])
+    writer.column('c.type', 'B', [COUPON_TYPES.index(c.coupon_type) for c in coupons])
+    writer.column('c.active', 'B', [1 if c.is_active else 0 for c in coupons])
+    writer.column('c.value', 'd', [_to_float(c.discount_value) for c in coupons])
+    writer.column('c.min_purchase', 'd', [_to_float(c.min_purchase_amount) for c in coupons])
+    writer.column('c.max_discount', 'd', [_to_float(c.max_discount_amount) for c in coupons])
+    writer.column('c.valid_from', 'q', [_to_micros(c.valid_from) for c in coupons])
+    writer.column('c.valid_until', 'q', [_to_micros(c.valid_until) for c in coupons])
+    writer.column('c.limit', 'i', [NULL_INT if c.usage_limit is None else c.usage_limit for c in coupons])
+    writer.column('c.user_limit', 'i', [NULL_INT if c.usage_limit_per_user is None else c.usage_limit_per_user
+                                        for c in coupons])
+    writer.column('c.created', 'q', [_to_micros(c.created_at) for c in coupons])
+    writer.strings('c.code', [c.code for c in coupons])
+    writer.strings('c.name', [c.name for c in coupons])
+    writer.strings('c.description', [c.description for c in coupons])
+    writer.strings('c.themes', [c.applicable_themes for c in coupons])
+    writer.strings('c.categories', [c.applicable_categories for c in coupons])
+    writer.strings('c.product_ids', [c.applicable_product_ids for c in coupons])
+    # Row positions in code order, for binary search by code
+    codes = [c.code.encode('utf-8') for c in coupons]
+    writer.column('c.by_code', 'I', sorted(range(len(coupons)), key=codes.__getitem__))
+
+    version = read_version(path) + 1
+    temp_path = f'{path}.{version}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(writer.dump(version))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return version
+
+class StoreView:
+    """One mapped version of the store file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._map)
+        magic, format_version, _, self.version, self.built_at, count = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a version {FORMAT_VERSION} coupon store')
+
+        self._columns = {}
+        for i in range(count):
+            name, offset, items, typecode = SECTION.unpack_from(buffer, HEADER.size + i * SECTION.size)
+            typecode = typecode.decode('ascii')
+            size = items * struct.calcsize(typecode)
+            self._columns[name.rstrip(b'\0').decode('ascii')] = buffer[offset:offset + size].cast(typecode)
+
+        self.products = ProductTable(self)
+        self.coupons = CouponTable(self)
+
+    def column(self, name):
+        return self._columns[name]
+
+    def string(self, name, pos):
+        length = self._columns[name + '.len'][pos]
+        if length == NULL_LENGTH:
+            return None
+        start = self._columns[name + '.off'][pos]
+        return str(self._columns['strings'][start:start + length], 'utf-8')
+
+    def raw_string(self, name, pos):
+        start = self._columns[name + '.off'][pos]
+        return bytes(self._columns['strings'][start:start + self._columns[name + '.len'][pos]])
+
+def _find_position(ids, wanted):
+    low, high = 0, len(ids)
+    while low < high:
+        mid = (low + high) // 2
+        if ids[mid] < wanted:
+            low = mid + 1
+        else:
+            high = mid
+    return low if low < len(ids) and ids[low] == wanted else None
+
+class ProductTable:
+    """Products in a store view; a drop-in for ``CatalogueSnapshot``"""
+
+    def __init__(self, view):
+        self._view = view
+        self.version = ('shared', view.version)
+        self.ids = view.column('p.id')
+        self.prices = view.column('p.price')
+        self.active = view.column('p.active')
+        self._themes = view.column('p.theme')
+        self._categories = view.column('p.category')
+        self._created = view.column('p.created')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, product_id):
+        """Return the product record for an id, or None"""
+        try:
+            pos = _find_position(self.ids, int(product_id))
+        except (TypeError, ValueError):
+            return None
+        return None if pos is None else self.record(pos)
+
+    def filter(self, theme=None, category=None, active_only=True):
+        """Return records matching an optional theme and category, in id order"""
+        themes, categories, active = self._themes, self._categories, self.active
+        theme_code = None if theme is None else THEMES.index(theme)
+        category_code = None if category is None else CATEGORIES.index(category)
+        return [
+            self.record(pos) for pos in range(len(self.ids))
+            if (theme_code is None or themes[pos] == theme_code)
+            and (category_code is None or categories[pos] == category_code)
+            and (active[pos] or not active_only)
+        ]
+
+    def record(self, pos):
+        view = self._view
+        return CatalogueProduct(
+            self.ids[pos], view.string('p.name', pos), view.string('p.description', pos),
+            CATEGORIES[self._categories[pos]], THEMES[self._themes[pos]], self.prices[pos],
+            view.string('p.image_url', pos), None, bool(self.active[pos]), _from_micros(self._created[pos])
+        )
+
+class CouponTable:
+    """Coupon definitions in a store view, looked up by id or code"""
+
+    def __init__(self, view):
+        self._view = view
+        self.ids = view.column('c.id')
+        self._by_code = view.column('c.by_code')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, coupon_id):
+        pos = _find_position(self.ids, coupon_id)
+        return None if pos is None else self.record(pos)
+
+    def find(self, code):
+        """Return the coupon with this code, or None"""
+        wanted = code.encode('utf-8')
+        order, view = self._by_code, self._view
+        low, high = 0, len(order)
+        while low < high:
+            mid = (low + high) // 2
+            if view.raw_string('c.code', order[mid]) < wanted:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(order) and view.raw_string('c.code', order[low]) == wanted:
+            return self.record(order[low])
+        return None
+
+    def record(self, pos):
+        view, column = self._view, self._view.column
+        coupon = CouponRecord()
+        coupon.id = self.ids[pos]
+        coupon.code = view.string('c.code', pos)
+        coupon.name = view.string('c.name', pos)
+        coupon.description = view.string('c.description', pos)
+        coupon.coupon_type = COUPON_TYPES[column('c.type')[pos]]
+        coupon.discount_value = _from_float(column('c.value')[pos])
+        coupon.min_purchase_amount = _from_float(column('c.min_purchase')[pos])
+        coupon.max_discount_amount = _from_float(column('c.max_discount')[pos])
+        coupon.valid_from = _from_micros(column('c.valid_from')[pos])
+        coupon.valid_until = _from_micros(column('c.valid_until')[pos])
+        limit, user_limit = column('c.limit')[pos], column('c.user_limit')[pos]
+        coupon.usage_limit = None if limit == NULL_INT else limit
+        coupon.usage_limit_per_user = None if user_limit == NULL_INT else user_limit
+        coupon.applicable_themes = view.string('c.themes', pos)
+        coupon.applicable_categories = view.string('c.categories', pos)
+        coupon.applicable_product_ids = view.string('c.product_ids', pos)
+        coupon.is_active = bool(column('c.active')[pos])
+        coupon.created_at = _from_micros(column('c.created')[pos])
+        return coupon
+
+class SharedStore:
+    """Maps the store file and remaps it when a new version is renamed in
+
+    Disabled (``current()`` returns None) unless ``SHARED_STORE_PATH`` is
+    set, and while the file does not exist yet; callers then read the
+    database as before.
+    """
+
+    def __init__(self, app=None):
+        self.path = None
+        self.check_interval = 1.0
+        self._view = None
+        self._identity = None
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config.get('SHARED_STORE_PATH')
+        self.check_interval = app.config.get('SHARED_STORE_CHECK_INTERVAL', self.check_interval)
+        app.extensions['shared_store'] = self
+
+    def current(self):
+        """The newest mapped store view, or None"""
+        if not self.path:
+            return None
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self._refresh()
+        return self._view
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._view = self._identity = None
+            return
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity != self._identity:
+            with self._lock:
+                if identity != self._identity:
+                    self._view = StoreView(self.path)
+                    self._identity = identity
+
+def _changes_seen():
+    kinds = ('coupon', 'product')
+    return db.session.query(db.func.max(CacheChange.id)).filter(CacheChange.kind.in_(kinds)).scalar() or 0
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'build'
+    from app import create_app
+
+    app = create_app()
+
+    path = app.config.get('SHARED_STORE_PATH')
+    if not path:
+        print('Set SHARED_STORE_PATH to the store file location')
+        return 1
+
+    with app.app_context():
+        if command == 'build':
+            print(f'Wrote {path} version {write_store(path)}')
+        elif command == 'watch':
+            interval = app.config.get('SHARED_STORE_CHECK_INTERVAL', 1.0)
+            seen = None
+            while True:
+                latest = _changes_seen()
+                db.session.rollback()
+                if latest != seen:
+                    print(f'Wrote {path} version {write_store(path)}')
+                    db.session.rollback()
+                    seen = latest
+                time.sleep(interval)
+        elif command == 'info':
+            view = StoreView(path)
+            built_at = datetime.utcfromtimestamp(view.built_at).isoformat()
+            print(f'{path}: version {view.version}, built {built_at}, '
+                  f'{len(view.products)} products, {len(view.coupons)} coupons, '
+                  f'{os.path.getsize(path)} bytes')
+        else:
+            print(__doc__)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
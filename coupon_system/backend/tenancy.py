@@ -0,0 +1,187 @@
+"""
+Tenant databases
+
+Each storefront (tenant) listed in ``TENANT_DATABASES`` keeps its coupons,
+redemptions and usage logs, and every table keyed by their ids, in its own
+database, so one tenant's writes never wait on another's SQLite lock.
+Users, products and stock stay in the main database. Requests pick their
+tenant with the ``TENANT_HEADER`` header (``X-Tenant`` by default).
+Requests without it use ``DEFAULT_TENANT``, or the main database's own
+coupon tables when that is unset. Jobs and CLI commands run outside
+requests also use ``DEFAULT_TENANT``.
+
+Every tenant database is a Flask-SQLAlchemy bind, so each has its own
+engine and connection pool. The session sends a statement to the current
+tenant's engine when it touches one of ``TENANT_TABLES``, and to the main
+engine otherwise.
+
+Caches keyed by coupon or redemption ids are ``TenantScoped``. The module
+keeps one name for them, and each tenant gets its own instance, chosen
+again on every attribute access.
+
+Usage:
+    X-Tenant: anime                          # request header
+    TENANT_DATABASES="bts=sqlite:///bts.db,anime=sqlite:///anime.db"
+"""
+
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context, jsonify, request
+from flask_sqlalchemy.session import Session
+import sqlalchemy as sa
+from sqlalchemy.sql.util import find_tables
+
+# Tables that live in each tenant's database
+TENANT_TABLES = frozenset({
+    'coupons', 'coupon_redemptions', 'coupon_usage_logs', 'coupon_usage_stripes',
+    'coupon_redemptions_archive', 'archived_redemption_totals', 'redemption_events',
+    'feed_consumers', 'cache_changes'
+})
+
+def bind_key(tenant):
+    """Flask-SQLAlchemy bind key of a tenant's database"""
+    return f'tenant_{tenant}'
+
+def parse_databases(value):
+    """{tenant: database URL} from 'key=url,key=url'"""
+    databases = {}
+    for entry in (value or '').split(','):
+        if not entry.strip():
+            continue
+        tenant, separator, url = entry.partition('=')
+        if not separator or not tenant.strip() or not url.strip():
+            raise ValueError(f'TENANT_DATABASES entries must be key=url, got {entry!r}')
+        databases[tenant.strip().lower()] = url.strip()
+    return databases
+
+def current_tenant():
+    """Key of the tenant the current request or job works for; None for the main database"""
+    if not has_app_context():
+        return None
+    if 'tenant' in g:
+        return g.tenant
+    return current_app.config.get('DEFAULT_TENANT') or None
+
+@contextmanager
+def tenant_context(tenant, app=None):
+    """
+    Work for a tenant in a fresh app context
+
+    The fresh context has its own session, so rows of different tenants
+    (which reuse the same ids) never share an identity map.
+    """
+    app = app or current_app._get_current_object()
+    with app.app_context():
+        g.tenant = tenant
+        yield
+
+class TenantSession(Session):
+    """Session that sends statements on tenant tables to the current tenant's engine"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            tenant = current_tenant()
+            if tenant is not None and self._uses_tenant_tables(mapper, clause):
+                return self._db.engines[bind_key(tenant)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    @staticmethod
+    def _uses_tenant_tables(mapper, clause):
+        if mapper is not None:
+            return sa.inspect(mapper).local_table.name in TENANT_TABLES
+        if clause is not None:
+            return any(table.name in TENANT_TABLES for table in find_tables(clause, include_crud=True))
+        # session.connection() without a statement: used by writes to tenant tables
+        return True
+
+class Tenancy:
+    """Tenant databases and the per-request choice between them"""
+
+    def __init__(self, app=None):
+        self.header = 'X-Tenant'
+        self.databases = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the tenant binds; call before ``db.init_app`` creates the engines"""
+        self.header = app.config.get('TENANT_HEADER', self.header)
+        self.databases = parse_databases(app.config.get('TENANT_DATABASES'))
+        default = app.config.get('DEFAULT_TENANT')
+        if default and default not in self.databases:
+            raise ValueError(f'DEFAULT_TENANT {default!r} is not in TENANT_DATABASES')
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.update({bind_key(tenant): url for tenant, url in self.databases.items()})
+        app.config['SQLALCHEMY_BINDS'] = binds
+        app.extensions['tenancy'] = self
+        app.before_request(self.select_tenant)
+
+    def tenants(self):
+        """Every tenant key, None (the main database) first"""
+        return [None] + sorted(self.databases)
+
+    def select_tenant(self):
+        tenant = (request.headers.get(self.header) or '').strip().lower()
+        if not tenant:
+            return
+        if tenant not in self.databases:
+            return jsonify({'error': f'Unknown tenant: {tenant}'}), 404
+        g.tenant = tenant
+
+    def each(self, func):
+        """
+        Run ``func()`` once per tenant, each in its own context
+
+        Returns:
+            dict: {tenant key (None for the main database): result}
+        """
+        app = current_app._get_current_object()
+        results = {}
+        for tenant in self.tenants():
+            with tenant_context(tenant, app):
+                results[tenant] = func()
+        return results
+
+tenancy = Tenancy()
+
+class TenantScoped:
+    """One instance of an extension per tenant, behind a single module-level name
+
+    Attribute access goes to the current tenant's instance, so calls made
+    while serving a tenant read and fill that tenant's caches only. Every
+    instance is created and configured by ``init_app``, before the app
+    serves requests, and knows its tenant through ``tenant``.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {None: self._create(None)}
+
+    def init_app(self, app):
+        extension = app.extensions.get('tenancy')
+        tenants = extension.tenants() if extension is not None else [None]
+        instances = {tenant: self._instances.get(tenant) or self._create(tenant) for tenant in tenants}
+        for instance in instances.values():
+            instance.init_app(app)
+        self._instances = instances
+        # Extensions registered themselves; point their names at the proxy instead
+        for name, value in list(app.extensions.items()):
+            if any(value is instance for instance in instances.values()):
+                app.extensions[name] = self
+
+    def for_tenant(self, tenant):
+        try:
+            return self._instances[tenant]
+        except KeyError:
+            raise LookupError(f'Unknown tenant: {tenant}') from None
+
+    def all_instances(self):
+        """Every tenant's instance"""
+        return list(self._instances.values())
+
+    def _create(self, tenant):
+        instance = self._factory()
+        instance.tenant = tenant
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self.for_tenant(current_tenant()), name)
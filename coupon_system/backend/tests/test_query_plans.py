@@ -0,0 +1,30 @@
+"""
+Query plan regression tests
+
+Runs the same ``EXPLAIN QUERY PLAN`` assertions as
+``python migrations.py check-plans``, so a hot query that loses its index
+fails the test run.
+"""
+
+from sqlalchemy import create_engine, text
+
+from migrations import check_query_plans, upgrade
+
+def describe(failures):
+    return '\n'.join(
+        f'{name}: {problem}\n' + '\n'.join(f'    {line}' for line in plan)
+        for name, problem, plan in failures
+    )
+
+def test_hot_queries_use_their_indexes():
+    failures = check_query_plans()
+    assert not failures, describe(failures)
+
+def test_dropped_index_is_reported(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "plans.db"}')
+    upgrade(engine)
+    with engine.begin() as connection:
+        connection.execute(text('DROP INDEX ix_coupons_active_validity'))
+
+    failures = check_query_plans(engine)
+    assert [name for name, _, _ in failures] == ['unexpired coupons']
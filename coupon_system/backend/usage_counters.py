@@ -0,0 +1,108 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, CouponRedemption
+from tenancy import TenantScoped
+from redemption_archive import redemption_totals
+
+class UsageCounters:
+    """In-memory redemption counts per coupon
+
+    Loaded with one grouped query over both redemption tiers and then kept
+    current from committed redemption inserts, so usage counts and usage-limit checks do not walk a
+    coupon's redemptions. A refresh interval re-reads the table to pick up
+    writes made by other processes.
+    """
+
+    def __init__(self, app=None):
+        self.refresh_interval = 60
+        self._totals = {}  # coupon_id -> [redemptions, used]
+        self.version = 0  # bumped whenever any count changes
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.refresh_interval = app.config.get('USAGE_COUNTERS_REFRESH_INTERVAL', self.refresh_interval)
+        app.extensions['usage_counters'] = self
+
+    def get(self, coupon_id):
+        """Return (redemption_count, usage_count) for a coupon"""
+        self._ensure_loaded()
+        redemptions, used = self._totals.get(coupon_id, (0, 0))
+        return redemptions, used
+
+    def current_version(self):
+        """Version of the counts, loading them first if needed"""
+        self._ensure_loaded()
+        return self.version
+
+    def usage_count(self, coupon_id):
+        return self.get(coupon_id)[1]
+
+    def reload(self):
+        """Recount every coupon's redemptions from the database"""
+        totals = {coupon_id: [total, used] for coupon_id, total, used in db.session.execute(redemption_totals())}
+        with self._lock:
+            self._totals = totals
+            self._loaded_at = time.monotonic()
+            self.version += 1
+
+    def refresh(self, coupon_ids):
+        """Recount the given coupons, or everything when ``coupon_ids`` is None"""
+        if coupon_ids is None:
+            self.invalidate()
+            return
+        rows = db.session.execute(redemption_totals(coupon_ids))
+        counted = {coupon_id: [total, used] for coupon_id, total, used in rows}
+        with self._lock:
+            for coupon_id in coupon_ids:
+                self._totals[coupon_id] = counted.get(coupon_id, [0, 0])
+            self.version += 1
+
+    def record(self, coupon_id, used=True, count=1):
+        """Count new redemptions that have been committed"""
+        with self._lock:
+            entry = self._totals.setdefault(coupon_id, [0, 0])
+            entry[0] += count
+            if used:
+                entry[1] += count
+            self.version += 1
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.refresh_interval:
+            self.reload()
+
+usage_counters = TenantScoped(UsageCounters)
+
+@event.listens_for(CouponRedemption, 'after_insert')
+def _queue_redemption(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('new_redemptions', []).append((target.coupon_id, bool(target.is_used)))
+
+@event.listens_for(CouponRedemption, 'after_update')
+def _redemption_changed(mapper, connection, target):
+    # Rare (e.g. is_used flipped by hand); recount rather than track deltas
+    session = Session.object_session(target)
+    if session is not None:
+        session.info['redemptions_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _apply_redemptions(session):
+    for coupon_id, used in session.info.pop('new_redemptions', ()):
+        usage_counters.record(coupon_id, used)
+    if session.info.pop('redemptions_changed', False):
+        usage_counters.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_redemptions(session):
+    session.info.pop('new_redemptions', None)
+    session.info.pop('redemptions_changed', None)
@@ -0,0 +1,247 @@
+"""
+Striped usage counters for coupon limits
+
+A coupon's usage limit is split over one or more stripe rows in
+``coupon_usage_stripes``, each with its own used count and capacity; the
+capacities add up to the limit. An apply takes one unit from the stripe its
+user and order hash to, with a single conditional UPDATE in the same
+transaction as the redemption, so concurrent applies on one coupon lock
+different rows instead of all queuing on one. When a stripe runs out it
+moves half of the spare capacity of the fullest stripe over and retries;
+the coupon is used up when no stripe has any left.
+
+Coupons start with one stripe. A worker that sees more than
+``USAGE_STRIPES_HOT_RATE`` applies per second on a coupon splits it into
+``USAGE_STRIPES_MAX`` stripes; new stripes start empty and borrow capacity
+on first use. Changing a coupon's usage limit drops its stripes, which are
+rebuilt from the redemption count on the next apply.
+
+Usage:
+    python usage_stripes.py info BTS20OFF     # stripes and their sum
+    python usage_stripes.py split BTS20OFF 8
+    python usage_stripes.py reset BTS20OFF    # rebuild from the redemptions
+"""
+
+import sys
+import threading
+import time
+import zlib
+from sqlalchemy import event, select, update, delete, insert, inspect
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Coupon, CouponUsageStripe
+from tenancy import TenantScoped
+from redemption_archive import redemption_totals
+
+stripes_table = CouponUsageStripe.__table__
+
+def take_statement(coupon_id, stripe):
+    """Conditional UPDATE taking one use from a stripe; matches no row once it is full"""
+    return (
+        update(stripes_table)
+        .where(stripes_table.c.coupon_id == coupon_id, stripes_table.c.stripe == stripe,
+               stripes_table.c.used < stripes_table.c.capacity)
+        .values(used=stripes_table.c.used + 1)
+    )
+
+class UsageStripes:
+    """Usage-limit enforcement through striped per-coupon counters"""
+
+    def __init__(self, app=None):
+        self.max_stripes = 8
+        self.hot_rate = 20
+        self._stripe_counts = {}  # coupon_id -> number of stripes last seen
+        self._rates = {}  # coupon_id -> [second, applies in that second]
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_stripes = app.config.get('USAGE_STRIPES_MAX', self.max_stripes)
+        self.hot_rate = app.config.get('USAGE_STRIPES_HOT_RATE', self.hot_rate)
+        app.extensions['usage_stripes'] = self
+
+    def reserve(self, coupon, key):
+        """
+        Take one use of a coupon's usage limit in the current transaction
+
+        Args:
+            coupon: Coupon row (id and usage_limit)
+            key (str): User and order the stripe is chosen by
+
+        Returns:
+            bool: False when the usage limit is reached
+        """
+        if not coupon.usage_limit:
+            return True
+        count = self._stripe_counts.get(coupon.id) or self._ensure_stripes(coupon)
+        if count < self.max_stripes and self._is_hot(coupon.id):
+            count = self.split(coupon.id, self.max_stripes)
+        stripe = zlib.crc32(str(key).encode('utf-8')) % count
+        if self._take(coupon.id, stripe):
+            return True
+        return self._rebalance(coupon, stripe)
+
+    def reserve_many(self, coupon, count):
+        """Take up to ``count`` uses at once, from whichever stripes have room; returns how many"""
+        if not coupon.usage_limit or count <= 0:
+            return count
+        self._ensure_stripes(coupon)
+        granted = 0
+        # A concurrent apply can take capacity between our read and update; look again then
+        for _ in range(3):
+            for stripe, used, capacity in self.stripes(coupon.id):
+                wanted = min(capacity - used, count - granted)
+                if wanted <= 0:
+                    continue
+                result = db.session.execute(
+                    update(stripes_table)
+                    .where(stripes_table.c.coupon_id == coupon.id, stripes_table.c.stripe == stripe,
+                           stripes_table.c.capacity - stripes_table.c.used >= wanted)
+                    .values(used=stripes_table.c.used + wanted)
+                )
+                if result.rowcount == 1:
+                    granted += wanted
+            if granted == count or not any(capacity > used for _, used, capacity in self.stripes(coupon.id)):
+                break
+        return granted
+
+    def used(self, coupon_id):
+        """Uses taken so far, summed over the stripes"""
+        return db.session.execute(
+            select(db.func.coalesce(db.func.sum(stripes_table.c.used), 0))
+            .where(stripes_table.c.coupon_id == coupon_id)
+        ).scalar()
+
+    def stripes(self, coupon_id):
+        """(stripe, used, capacity) rows of a coupon"""
+        return db.session.execute(
+            select(stripes_table.c.stripe, stripes_table.c.used, stripes_table.c.capacity)
+            .where(stripes_table.c.coupon_id == coupon_id)
+            .order_by(stripes_table.c.stripe)
+        ).all()
+
+    def split(self, coupon_id, count):
+        """Grow a coupon to ``count`` stripes; the new ones start without capacity"""
+        existing = len(self.stripes(coupon_id))
+        if existing and existing < count:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(stripes_table), [
+                        {'coupon_id': coupon_id, 'stripe': stripe, 'used': 0, 'capacity': 0}
+                        for stripe in range(existing, count)
+                    ])
+            except IntegrityError:
+                # Another worker split it first
+                pass
+            existing = len(self.stripes(coupon_id))
+        self._stripe_counts[coupon_id] = existing
+        return existing
+
+    def reset(self, coupon_id):
+        """Drop a coupon's stripes so they are rebuilt from its redemptions"""
+        db.session.execute(delete(stripes_table).where(stripes_table.c.coupon_id == coupon_id))
+        self._stripe_counts.pop(coupon_id, None)
+
+    def _take(self, coupon_id, stripe):
+        result = db.session.execute(take_statement(coupon_id, stripe))
+        return result.rowcount == 1
+
+    def _rebalance(self, coupon, stripe):
+        rows = self.stripes(coupon.id)
+        if not rows:
+            # Dropped since we last looked; rebuild and start over
+            self._stripe_counts.pop(coupon.id, None)
+            count = self._ensure_stripes(coupon)
+            return self._take(coupon.id, stripe % count)
+        self._stripe_counts[coupon.id] = len(rows)
+        for donor, used, capacity in sorted(rows, key=lambda row: row[1] - row[2]):
+            spare = capacity - used
+            if spare <= 0:
+                break
+            if donor == stripe:
+                # Capacity arrived since our update missed
+                if self._take(coupon.id, stripe):
+                    return True
+                continue
+            moved = max(1, spare // 2)
+            result = db.session.execute(
+                update(stripes_table)
+                .where(stripes_table.c.coupon_id == coupon.id, stripes_table.c.stripe == donor,
+                       stripes_table.c.capacity - stripes_table.c.used >= moved)
+                .values(capacity=stripes_table.c.capacity - moved)
+            )
+            if result.rowcount != 1:
+                continue
+            db.session.execute(
+                update(stripes_table)
+                .where(stripes_table.c.coupon_id == coupon.id, stripes_table.c.stripe == stripe)
+                .values(capacity=stripes_table.c.capacity + moved)
+            )
+            if self._take(coupon.id, stripe):
+                return True
+        return False
+
+    def _ensure_stripes(self, coupon):
+        count = len(self.stripes(coupon.id))
+        if not count:
+            totals = db.session.execute(redemption_totals([coupon.id])).one_or_none()
+            redeemed = totals.redemptions if totals is not None else 0
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(stripes_table), [{
+                        'coupon_id': coupon.id, 'stripe': 0, 'used': redeemed,
+                        'capacity': max(coupon.usage_limit, redeemed)
+                    }])
+            except IntegrityError:
+                # Another worker created it first
+                pass
+            count = len(self.stripes(coupon.id))
+        self._stripe_counts[coupon.id] = count
+        return count
+
+    def _is_hot(self, coupon_id):
+        second = int(time.monotonic())
+        with self._lock:
+            rate = self._rates.get(coupon_id)
+            if rate is None or rate[0] != second:
+                rate = self._rates[coupon_id] = [second, 0]
+            rate[1] += 1
+            return rate[1] > self.hot_rate
+
+usage_stripes = TenantScoped(UsageStripes)
+
+# A new usage limit invalidates the stripes' capacities; rebuild them on next use
+@event.listens_for(Coupon, 'after_update')
+def _drop_stripes_on_limit_change(mapper, connection, target):
+    if inspect(target).attrs.usage_limit.history.has_changes():
+        connection.execute(delete(stripes_table).where(stripes_table.c.coupon_id == target.id))
+        usage_stripes._stripe_counts.pop(target.id, None)
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in ('info', 'split', 'reset'):
+        print(__doc__)
+        return 1
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        coupon = Coupon.query.filter_by(code=argv[2].strip().upper()).first()
+        if coupon is None:
+            print(f'No coupon {argv[2]}')
+            return 1
+        if argv[1] == 'split':
+            usage_stripes._ensure_stripes(coupon)
+            usage_stripes.split(coupon.id, int(argv[3]) if len(argv) > 3 else usage_stripes.max_stripes)
+            db.session.commit()
+        elif argv[1] == 'reset':
+            usage_stripes.reset(coupon.id)
+            usage_stripes._ensure_stripes(coupon)
+            db.session.commit()
+        for stripe, used, capacity in usage_stripes.stripes(coupon.id):
+            print(f'  stripe {stripe}: {used}/{capacity}')
+        print(f'{coupon.code}: {usage_stripes.used(coupon.id)} of {coupon.usage_limit or "unlimited"} used')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,166 @@
+from collections import Counter, OrderedDict
+import threading
+import time
+from sqlalchemy import event, select, union_all
+from sqlalchemy.orm import Session
+
+from models import db, Coupon, CouponRedemption, ArchivedRedemption
+from tenancy import TenantScoped
+from usage_counters import usage_counters
+from validity_schedule import validity_schedule
+
+class _UserEntry:
+    __slots__ = ('used', 'expires_at', 'available_version', 'usable', 'uses_left')
+
+def used_coupons_statement(user_id):
+    """Coupon id of each of a user's used redemptions, in both tiers"""
+    # Uses the user_created index of each tier; a user has few rows, so callers count them
+    return union_all(*(
+        select(table.c.coupon_id).where(table.c.user_id == user_id, table.c.is_used == True)
+        for table in (CouponRedemption.__table__, ArchivedRedemption.__table__)
+    ))
+
+class UserEligibility:
+    """Coupons each user can still use, kept per user
+
+    The coupons anyone can use are the live set from the validity schedule
+    minus those whose total usage limit is reached; that set is recomputed
+    only when the schedule or the usage counters change. Per user, one
+    indexed query loads how often they used each coupon, and the usable set
+    is the shared set minus the coupons they have used up. Both steps are set
+    operations, and a cached user is answered without touching any coupon.
+
+    A user's entry is dropped when they redeem a coupon (in any worker, via
+    the change log) and otherwise expires after ``USER_ELIGIBILITY_TTL``
+    seconds; at most ``USER_ELIGIBILITY_MAX_USERS`` users are kept.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 300
+        self.max_users = 10000
+        self._users = OrderedDict()  # user_id -> _UserEntry, least recently used first
+        self._available = None  # (live ids, counters version, limits, available ids, version)
+        self._available_version = 0
+        self._invalidations = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('USER_ELIGIBILITY_TTL', self.ttl)
+        self.max_users = app.config.get('USER_ELIGIBILITY_MAX_USERS', self.max_users)
+        app.extensions['user_eligibility'] = self
+
+    def usable_coupons(self, user_id):
+        """
+        Coupons a user can use right now
+
+        Args:
+            user_id (int): User ID
+
+        Returns:
+            tuple: (sorted tuple of coupon ids, {coupon_id: uses left, None if unlimited})
+        """
+        invalidations = self._invalidations
+        limits, available, version = self._current_available()
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                self._users.move_to_end(user_id)
+        if entry is not None and entry.expires_at >= now and entry.available_version == version:
+            return entry.usable, entry.uses_left
+
+        fresh = _UserEntry()
+        if entry is None or entry.expires_at < now:
+            fresh.used = self._load_user_usage(user_id)
+            fresh.expires_at = now + self.ttl
+        else:
+            # Only the shared set moved; the user's own counts still hold
+            fresh.used, fresh.expires_at = entry.used, entry.expires_at
+
+        blocked = {
+            coupon_id for coupon_id, used in fresh.used.items()
+            if coupon_id in limits and limits[coupon_id][1] is not None and used >= limits[coupon_id][1]
+        }
+        fresh.usable = tuple(sorted(available - blocked))
+        fresh.uses_left = {
+            coupon_id: None if limits[coupon_id][1] is None else limits[coupon_id][1] - fresh.used.get(coupon_id, 0)
+            for coupon_id in fresh.usable
+        }
+        fresh.available_version = version
+        self._remember(user_id, fresh, invalidations)
+        return fresh.usable, fresh.uses_left
+
+    def invalidate_users(self, user_ids):
+        """Drop cached users (every user when ``user_ids`` is None)"""
+        with self._lock:
+            self._invalidations += 1
+            if user_ids is None:
+                self._users.clear()
+                return
+            for user_id in user_ids:
+                self._users.pop(user_id, None)
+
+    def _current_available(self):
+        live = validity_schedule.valid_ids()
+        counters_version = usage_counters.current_version()
+        cached = self._available
+        if cached is not None and cached[0] is live and cached[1] == counters_version:
+            return cached[2], cached[3], cached[4]
+
+        limits = cached[2] if cached is not None and cached[0] is live else self._load_limits(live)
+        exhausted = {
+            coupon_id for coupon_id, (limit, _) in limits.items()
+            if limit and usage_counters.get(coupon_id)[0] >= limit
+        }
+        available = live.intersection(limits) - exhausted
+        with self._lock:
+            previous = self._available
+            if previous is None or previous[3] != available or previous[2] is not limits:
+                self._available_version += 1
+                version = self._available_version
+            else:
+                available, version = previous[3], previous[4]
+            self._available = (live, counters_version, limits, available, version)
+        return limits, available, version
+
+    def _load_limits(self, live):
+        rows = db.session.query(Coupon.id, Coupon.usage_limit, Coupon.usage_limit_per_user).filter(
+            Coupon.is_active == True
+        ).all()
+        return {coupon_id: (limit, per_user) for coupon_id, limit, per_user in rows if coupon_id in live}
+
+    def _load_user_usage(self, user_id):
+        rows = db.session.execute(used_coupons_statement(user_id)).all()
+        return Counter(coupon_id for (coupon_id,) in rows)
+
+    def _remember(self, user_id, entry, invalidations):
+        with self._lock:
+            if invalidations != self._invalidations:
+                # A redemption committed while we loaded; let the next call reload
+                return
+            self._users[user_id] = entry
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+user_eligibility = TenantScoped(UserEligibility)
+
+@event.listens_for(CouponRedemption, 'after_insert')
+@event.listens_for(CouponRedemption, 'after_update')
+def _queue_user_redemption(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('redeemed_users', set()).add(target.user_id)
+
+@event.listens_for(Session, 'after_commit')
+def _drop_redeemed_users(session):
+    users = session.info.pop('redeemed_users', None)
+    if users:
+        user_eligibility.invalidate_users(users)
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_redeemed_users(session):
+    session.info.pop('redeemed_users', None)
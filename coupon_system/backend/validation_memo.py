@@ -0,0 +1,174 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import Coupon, CouponRedemption, Product
+from tenancy import TenantScoped
+
+def cart_key(cart_items):
+    """Hash of a cart that ignores item order and key order"""
+    items = sorted(json.dumps(item, sort_keys=True, separators=(',', ':'), default=str)
+                   for item in (cart_items or []))
+    return hashlib.sha1('\n'.join(items).encode('utf-8')).hexdigest()
+
+class _Flight:
+    __slots__ = ('started', 'done', 'coupon_id', 'result')
+
+    def __init__(self, started):
+        self.started = started
+        self.done = threading.Event()
+        self.coupon_id = None
+        self.result = None
+
+class ValidationMemo:
+    """Coalesces identical coupon validations and keeps their results briefly
+
+    Validations are keyed by (code, user, cart hash). While one is running,
+    identical requests wait for it instead of repeating the queries
+    (single-flight), and its result is then kept for
+    ``VALIDATION_MEMO_TTL`` seconds. A committed redemption or coupon change
+    drops the results for that coupon, in any worker via the change log; a
+    product change drops everything.
+
+    Every invalidation takes a sequence number. A result is only stored, or
+    handed to a waiting request, if its coupon has not been invalidated since
+    the computation started, so a validation never reflects counts older
+    than the request.
+
+    Results are shared between requests and must not be modified.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 2.0
+        self.max_entries = 10000
+        self.wait_timeout = 5.0
+        self._entries = OrderedDict()  # key -> (expires_at, coupon_id, result), oldest first
+        self._keys_by_coupon = {}  # coupon_id (None for unknown codes) -> set of keys
+        self._flights = {}  # key -> _Flight
+        self._seq = 0
+        self._invalidated_at = {}  # coupon_id -> seq of its last invalidation
+        self._cleared_at = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('VALIDATION_MEMO_TTL', self.ttl)
+        self.max_entries = app.config.get('VALIDATION_MEMO_MAX_ENTRIES', self.max_entries)
+        app.extensions['validation_memo'] = self
+
+    def run(self, key, compute):
+        """
+        Result for ``key``, from the memo, a running identical call, or ``compute()``
+
+        Args:
+            key (tuple): Identifies the validation
+            compute (callable): Returns (coupon_id or None, result); exceptions propagate
+                and are not shared
+
+        Returns:
+            dict: The validation result
+        """
+        for _ in range(2):
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    return entry[2]
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight(self._seq)
+                    break
+            if flight.done.wait(self.wait_timeout) and flight.result is not None:
+                with self._lock:
+                    if not self._stale(flight.coupon_id, flight.started):
+                        return flight.result
+            # The shared run failed, timed out or predates a change; join or lead a fresh one
+        else:
+            return compute()[1]
+
+        try:
+            flight.coupon_id, result = compute()
+            flight.result = result
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                if flight.result is not None and self.ttl > 0 and not self._stale(flight.coupon_id, flight.started):
+                    self._store(key, flight)
+            flight.done.set()
+        return result
+
+    def invalidate(self, coupon_ids=None):
+        """Drop results for the given coupons (everything when ``coupon_ids`` is None)"""
+        with self._lock:
+            self._seq += 1
+            if coupon_ids is None:
+                self._cleared_at = self._seq
+                self._entries.clear()
+                self._keys_by_coupon.clear()
+                self._invalidated_at.clear()
+                return
+            # A change can also make an unknown code valid
+            for coupon_id in list(coupon_ids) + [None]:
+                self._invalidated_at[coupon_id] = self._seq
+                for key in self._keys_by_coupon.pop(coupon_id, ()):
+                    self._entries.pop(key, None)
+
+    def _stale(self, coupon_id, started):
+        return self._cleared_at > started or self._invalidated_at.get(coupon_id, 0) > started
+
+    def _store(self, key, flight):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._forget(key, previous[1])
+        self._entries[key] = (time.monotonic() + self.ttl, flight.coupon_id, flight.result)
+        self._keys_by_coupon.setdefault(flight.coupon_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest, (_, coupon_id, _) = self._entries.popitem(last=False)
+            self._forget(oldest, coupon_id)
+
+    def _forget(self, key, coupon_id):
+        keys = self._keys_by_coupon.get(coupon_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_coupon[coupon_id]
+
+validation_memo = TenantScoped(ValidationMemo)
+
+# Drop results once the change that affects them is committed
+@event.listens_for(CouponRedemption, 'after_insert')
+@event.listens_for(CouponRedemption, 'after_update')
+@event.listens_for(CouponRedemption, 'after_delete')
+def _queue_redemption_change(mapper, connection, target):
+    _queue(target, target.coupon_id)
+
+@event.listens_for(Coupon, 'after_insert')
+@event.listens_for(Coupon, 'after_update')
+@event.listens_for(Coupon, 'after_delete')
+def _queue_coupon_change(mapper, connection, target):
+    _queue(target, target.id)
+
+@event.listens_for(Product, 'after_update')
+@event.listens_for(Product, 'after_delete')
+def _queue_product_change(mapper, connection, target):
+    _queue(target, None)
+
+def _queue(target, coupon_id):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('validation_changes', set()).add(coupon_id)
+
+@event.listens_for(Session, 'after_commit')
+def _drop_changed_validations(session):
+    changes = session.info.pop('validation_changes', None)
+    if changes:
+        validation_memo.invalidate(None if None in changes else changes)
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_validations(session):
+    session.info.pop('validation_changes', None)
@@ -0,0 +1,185 @@
+from datetime import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from models import db, Coupon
+from tenancy import TenantScoped, tenant_context
+from cache_sync import cache_sync
+from serialization_cache import serialization_cache
+from validation_memo import validation_memo
+
+logger = logging.getLogger(__name__)
+
+ACTIVATE = 'activate'
+EXPIRE = 'expire'
+
+def unexpired_coupons(now):
+    """Statement for (id, valid_from, valid_until) of active coupons not yet expired at ``now``"""
+    return select(Coupon.id, Coupon.valid_from, Coupon.valid_until).where(
+        Coupon.is_active == True,
+        (Coupon.valid_until.is_(None)) | (Coupon.valid_until >= now)
+    )
+
+class ValiditySchedule:
+    """Set of coupon ids that are active and inside their validity window
+
+    Activation (``valid_from``) and expiry (``valid_until``) times sit in a
+    min-heap; reading the set first pops every event that is due, so the set
+    moves forward in O(log n) per event instead of re-filtering every coupon
+    by date on each request. Coupon edits mark the schedule stale and it is
+    rebuilt on the next read, as it is every ``refresh_interval`` seconds to
+    pick up edits from other processes.
+    """
+
+    def __init__(self, app=None):
+        self.refresh_interval = 60
+        self.expiry_job_interval = 60
+        self._valid = frozenset()
+        self._events = []
+        self._seq = itertools.count()
+        self._loaded_at = None
+        self._lock = threading.RLock()
+        self._job = None
+        self.tenant = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.refresh_interval = app.config.get('VALIDITY_SCHEDULE_REFRESH_INTERVAL', self.refresh_interval)
+        self.expiry_job_interval = app.config.get('COUPON_EXPIRY_JOB_INTERVAL', self.expiry_job_interval)
+        app.extensions['validity_schedule'] = self
+        # Started by the first request so the thread lives in the serving
+        # process, not in a pre-fork master or a CLI job
+        app.before_request(lambda: self.start_expiry_job(app))
+
+    def valid_ids(self, now=None):
+        """Frozen set of currently valid coupon ids (ignores usage limits)"""
+        self._advance(now or datetime.utcnow())
+        return self._valid
+
+    def is_live(self, coupon_id, now=None):
+        return coupon_id in self.valid_ids(now)
+
+    def reload(self, now=None):
+        """Rebuild the set and the event heap from the coupons table"""
+        now = now or datetime.utcnow()
+        rows = db.session.execute(unexpired_coupons(now)).all()
+
+        valid = set()
+        events = []
+        seq = itertools.count()
+        for coupon_id, valid_from, valid_until in rows:
+            if valid_from is not None and valid_from > now:
+                events.append((valid_from, next(seq), ACTIVATE, coupon_id, valid_until))
+            else:
+                valid.add(coupon_id)
+                if valid_until is not None:
+                    events.append((valid_until, next(seq), EXPIRE, coupon_id, None))
+        heapq.heapify(events)
+
+        with self._lock:
+            self._valid = frozenset(valid)
+            self._events = events
+            self._seq = seq
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def deactivate_expired(self, now=None):
+        """Set is_active = False on coupons whose validity window has closed"""
+        now = now or datetime.utcnow()
+        expired_ids = [row.id for row in db.session.query(Coupon.id).filter(
+            Coupon.is_active == True,
+            Coupon.valid_until.isnot(None),
+            Coupon.valid_until < now
+        ).all()]
+        if not expired_ids:
+            return []
+        db.session.execute(
+            update(Coupon.__table__)
+            .where(Coupon.__table__.c.id.in_(expired_ids))
+            .values(is_active=False)
+        )
+        cache_sync.publish(db.session.connection(), [('coupon', coupon_id) for coupon_id in expired_ids])
+        db.session.commit()
+        # A Core UPDATE skips the mapper events, so drop the cached copies here
+        for coupon_id in expired_ids:
+            serialization_cache.invalidate('coupon', coupon_id)
+        validation_memo.invalidate(expired_ids)
+        self.invalidate()
+        return expired_ids
+
+    def start_expiry_job(self, app):
+        """Run deactivate_expired every ``expiry_job_interval`` seconds on a daemon thread"""
+        interval = self.expiry_job_interval
+        if self._job is not None or interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    with tenant_context(self.tenant, app):
+                        deactivated = self.deactivate_expired()
+                        if deactivated:
+                            logger.info('Deactivated expired coupons of tenant %s: %s', self.tenant, deactivated)
+                except Exception:
+                    logger.exception('Coupon expiry job failed')
+
+        with self._lock:
+            if self._job is None:
+                self._job = threading.Thread(target=run, name='coupon-expiry', daemon=True)
+                self._job.start()
+
+    def _advance(self, now):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.refresh_interval:
+            self.reload(now)
+            return
+
+        events = self._events
+        if not events or not self._is_due(events[0], now):
+            return
+
+        with self._lock:
+            valid = set(self._valid)
+            while events and self._is_due(events[0], now):
+                _, _, kind, coupon_id, valid_until = heapq.heappop(events)
+                if kind == ACTIVATE:
+                    valid.add(coupon_id)
+                    if valid_until is not None:
+                        heapq.heappush(events, (valid_until, next(self._seq), EXPIRE, coupon_id, None))
+                else:
+                    valid.discard(coupon_id)
+            self._valid = frozenset(valid)
+
+    @staticmethod
+    def _is_due(event_entry, now):
+        # Matches Coupon.is_live: live from valid_from, still live at valid_until
+        when, _, kind = event_entry[:3]
+        return when <= now if kind == ACTIVATE else when < now
+
+validity_schedule = TenantScoped(ValiditySchedule)
+
+@event.listens_for(Coupon, 'after_insert')
+@event.listens_for(Coupon, 'after_update')
+@event.listens_for(Coupon, 'after_delete')
+def _queue_schedule_change(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info['coupon_dates_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_schedule(session):
+    if session.info.pop('coupon_dates_changed', False):
+        validity_schedule.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_schedule(session):
+    session.info.pop('coupon_dates_changed', None)
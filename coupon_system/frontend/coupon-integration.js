@@ -141,6 +141,53 @@ class CouponSystemAPI {
             return { success: false, message: 'Network error' };
         }
     }
+
+    // Batch methods
+    // Runs several API calls in one round trip. Each request is
+    // { path, method?, body? } with path relative to baseURL; the result is
+    // one { status, body } per request, in order.
+    async batch(requests) {
+        try {
+            const headers = { 'Content-Type': 'application/json' };
+            if (this.authToken) headers['Authorization'] = `Bearer ${this.authToken}`;
+
+            const response = await fetch(`${this.baseURL}/batch`, {
+                method: 'POST',
+                headers,
+                body: JSON.stringify({
+                    requests: requests.map((request, index) => ({
+                        id: index,
+                        method: request.method || 'GET',
+                        path: `/api${request.path}`,
+                        body: request.body
+                    }))
+                })
+            });
+
+            const data = await response.json();
+            return response.ok ? { success: true, responses: data.responses } : { success: false, message: data.error };
+        } catch (error) {
+            return { success: false, message: 'Network error' };
+        }
+    }
+
+    // Products and available coupons in one round trip, shaped like getProducts() / getAvailableCoupons()
+    async getStorefront() {
+        const result = await this.batch([{ path: '/products' }, { path: '/coupons' }]);
+        if (!result.success) {
+            return { products: result, coupons: result };
+        }
+
+        const [products, coupons] = result.responses;
+        return {
+            products: products.status === 200
+                ? { success: true, products: products.body.products }
+                : { success: false, message: products.body && products.body.error },
+            coupons: coupons.status === 200
+                ? { success: true, coupons: coupons.body.coupons }
+                : { success: false, message: coupons.body && coupons.body.error }
+        };
+    }
 }
 
 // Application state
@@ -201,8 +248,8 @@ function logout() {
 }
 
 // Product functions
-async function loadProducts() {
-    const result = await api.getProducts();
+async function loadProducts(preloaded = null) {
+    const result = preloaded || await api.getProducts();
     
     if (result.success) {
         const productsGrid = document.getElementById('productsGrid');
@@ -230,6 +277,12 @@ async function loadProducts() {
     }
 }
 
+async function loadStorefront() {
+    const { products, coupons } = await api.getStorefront();
+    loadProducts(products);
+    loadAvailableCoupons(coupons);
+}
+
 // Cart functions
 function addToCart(productId, name, price, theme, category) {
     const existingItem = cart.find(item => item.product_id === productId);
@@ -371,8 +424,8 @@ function applyCouponFromList(couponCode) {
     applyCoupon();
 }
 
-async function loadAvailableCoupons() {
-    const result = await api.getAvailableCoupons();
+async function loadAvailableCoupons(preloaded = null) {
+    const result = preloaded || await api.getAvailableCoupons();
     
     if (result.success) {
         const couponsContainer = document.getElementById('availableCoupons');
@@ -497,9 +550,8 @@ document.addEventListener('DOMContentLoaded', function() {
         document.getElementById('welcomeMessage').textContent = `Welcome, ${api.currentUser.username}!`;
     }
     
-    // Load initial data
-    loadProducts();
-    loadAvailableCoupons();
+    // Load initial data (products and coupons in one request)
+    loadStorefront();
     updateOrderSummary();
     
     // Set up coupon code input to uppercase